@@ -1,48 +1,257 @@
-from flask import Flask, render_template
-from flask_restful import Api, Resource, reqparse
-from datetime import datetime
+from flask import Flask, render_template, request, send_file, Response
+from flask_restful import Api, Resource, reqparse, inputs
 import os
+import uuid
+
+from fleet import Fleet, ALERT_FLAGS
+from imagestore import ImageStore
+from telemetry import TelemetryStore
 
 app = Flask(__name__)
 api = Api(app)
 
-data_store = {
-    "bike_status": None,
-    "last_updated": None
-}
+LONG_POLL_TIMEOUT = 30
+
+# The single bike api (/api/bike etc.) is the device with this id
+DEFAULT_BIKE = "default"
+
+# Part of every etag, so that versions from before a restart never match
+BOOT_ID = uuid.uuid4().hex[:8]
+
+fleet = Fleet()
+image_store = ImageStore(os.environ.get("IMAGE_STORE_DIR", os.path.join(app.root_path, "images")))
+telemetry = TelemetryStore(os.environ.get("TELEMETRY_DB", os.path.join(app.root_path, "telemetry.db")))
+
+
+def _conditional(body, version):
+    """Responds with body and a version based etag, or an empty 304 if the client already has this version
+    """
+    etag = f"{BOOT_ID}-{version}"
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    return body, 200, headers
 
 
 class BikeData(Resource):
-    def get(self):
-        if data_store["bike_status"] is None:
+    def get(self, bike_id=DEFAULT_BIKE):
+        device = fleet.get(bike_id)
+
+        if device is None or device.status is None:
             return {"error": "No bike data available."}, 404
 
         # Return the latest bike status
-        response = {
-            "bike_status": data_store["bike_status"],
-            "last_updated": data_store["last_updated"]
-        }
-        return response, 200
+        with device.changed:
+            response = {
+                "bike_status": dict(device.status),
+                "last_updated": device.last_updated
+            }
+            version = device.status_version
+
+        return _conditional(response, version)
 
-    def post(self):
+    def post(self, bike_id=DEFAULT_BIKE):
+        # Bikes only send the fields which have changed, or every field as a heartbeat
         parser = reqparse.RequestParser()
-        parser.add_argument('sentry_mode', required=True, type=str, help='Sentry mode is required')
-        parser.add_argument('latitude', required=True, type=float, help='Latitude is required')
-        parser.add_argument('longitude', required=True, type=float, help='Longitude is required')
+        parser.add_argument('sentry_mode', type=inputs.boolean, store_missing=False)
+        parser.add_argument('latitude', type=float, store_missing=False)
+        parser.add_argument('longitude', type=float, store_missing=False)
+        parser.add_argument('objects', type=int, store_missing=False)
         args = parser.parse_args()
 
-        # Update the data store with the new data
-        data_store["bike_status"] = {
-            "sentry_mode": args['sentry_mode'],
-            "latitude": args['latitude'],
-            "longitude": args['longitude']
-        }
-        data_store["last_updated"] = datetime.now().isoformat()
+        device = fleet.get(bike_id, create=True)
+        if device is None:
+            return {"error": "Invalid bike id."}, 400
+
+        # Update the device with the new data, keeping the fields which weren't sent
+        bike_status, changed = fleet.update_status(device, args)
+
+        # Heartbeats (posts where nothing has changed) aren't added to the history
+        if changed:
+            telemetry.append(bike_id, bike_status)
 
         return {"message": "Bike data updated successfully."}, 200
 
 
-api.add_resource(BikeData, '/api/bike')
+class BikeHistory(Resource):
+    def get(self, bike_id=DEFAULT_BIKE):
+        parser = reqparse.RequestParser()
+        parser.add_argument('start', type=float, location='args')
+        parser.add_argument('end', type=float, location='args')
+        parser.add_argument('step', type=float, location='args')
+        parser.add_argument('limit', type=int, location='args', default=10000)
+        args = parser.parse_args()
+
+        points = telemetry.range(bike_id, start=args['start'], end=args['end'], step=args['step'],
+                                 limit=min(max(args['limit'], 1), 10000))
+
+        return {"points": points}, 200
+
+
+class SentryMode(Resource):
+    def get(self, bike_id=DEFAULT_BIKE):
+        """Long poll for sentry mode. Returns as soon as the version is newer than since, or after timeout seconds.
+        """
+        parser = reqparse.RequestParser()
+        parser.add_argument('since', type=int, location='args', default=-1)
+        parser.add_argument('timeout', type=float, location='args', default=LONG_POLL_TIMEOUT)
+        args = parser.parse_args()
+
+        timeout = min(max(args['timeout'], 0), LONG_POLL_TIMEOUT)
+
+        # a bike may wait for sentry mode before it has posted anything
+        device = fleet.get(bike_id, create=True)
+        if device is None:
+            return {"error": "Invalid bike id."}, 400
+
+        with device.changed:
+            device.changed.wait_for(lambda: device.sentry_version > args['since'], timeout)
+
+            return {
+                "sentry_mode": device.sentry_mode,
+                "version": device.sentry_version
+            }, 200
+
+
+class Alerts(Resource):
+    def get(self, bike_id=DEFAULT_BIKE):
+        device = fleet.get(bike_id)
+
+        if device is None:
+            return _conditional({flag: False for flag in ALERT_FLAGS}, 0)
+
+        with device.changed:
+            alerts = dict(device.alerts)
+            version = device.alerts_version
+
+        return _conditional(alerts, version)
+
+    def post(self, bike_id=DEFAULT_BIKE):
+        parser = reqparse.RequestParser()
+        parser.add_argument('movement_flag', type=inputs.boolean, store_missing=False)
+        parser.add_argument('object_flag', type=inputs.boolean, store_missing=False)
+        parser.add_argument('coord_flag', type=inputs.boolean, store_missing=False)
+        args = parser.parse_args()
+
+        device = fleet.get(bike_id, create=True)
+        if device is None:
+            return {"error": "Invalid bike id."}, 400
+
+        fleet.update_alerts(device, args)
+
+        return {"message": "Alerts updated successfully."}, 200
+
+
+class FleetSummary(Resource):
+    def get(self):
+        return fleet.summary(), 200
+
+
+def _send_image(record, thumb=False, immutable=True):
+    """Sends an image from the image store as a jpeg response
+    """
+    response = send_file(image_store.path(record, thumb), mimetype="image/jpeg", conditional=True,
+                         etag=f"{record.id}-thumb" if thumb else record.id)
+
+    if immutable:
+        # an image id always refers to the same image
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response
+
+
+def _image_json(record):
+    return {
+        "id": record.id,
+        "bike": record.bike,
+        "timestamp": record.timestamp,
+        "size": record.size,
+        "url": f"/api/images/{record.id}",
+        "thumb_url": f"/api/images/{record.id}/thumb"
+    }
+
+
+class Image(Resource):
+    def get(self, bike_id=None):
+        record = image_store.latest(bike_id or request.args.get("bike"))
+
+        if record is None:
+            return {"error": "No image available."}, 404
+
+        # Served as the raw jpeg, so the dashboard can use it directly. Browsers revalidate it on every load
+        return _send_image(record, immutable=False)
+
+    def post(self, bike_id=None):
+        # Accepts the jpeg either as the raw request body or as the "image" file of a multipart form
+        if "image" in request.files:
+            image = request.files["image"].read()
+        else:
+            image = request.get_data()
+
+        if not image.startswith(b"\xff\xd8"):
+            return {"error": "Image must be a jpeg."}, 415
+
+        bike = bike_id or request.args.get("bike") or request.headers.get("X-Bike-Id") or DEFAULT_BIKE
+
+        try:
+            record = image_store.add(image, bike)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        return {"message": "Image uploaded successfully.", "image": _image_json(record)}, 200
+
+
+class ImageList(Resource):
+    def get(self):
+        parser = reqparse.RequestParser()
+        parser.add_argument('bike', type=str, location='args')
+        parser.add_argument('before', type=float, location='args')
+        parser.add_argument('before_id', type=str, location='args')
+        parser.add_argument('limit', type=int, location='args', default=20)
+        args = parser.parse_args()
+
+        limit = min(max(args['limit'], 1), 100)
+        records = image_store.list(bike=args['bike'], before=args['before'], before_id=args['before_id'],
+                                   limit=limit)
+
+        return {
+            "images": [_image_json(record) for record in records],
+            # pass back as before_id to get the next page
+            "next": records[-1].id if len(records) == limit else None
+        }, 200
+
+
+class ImageFile(Resource):
+    def get(self, image_id, thumb=False):
+        record = image_store.get(image_id)
+
+        if record is None:
+            return {"error": "No such image."}, 404
+
+        return _send_image(record, thumb=thumb)
+
+
+class ImageThumb(ImageFile):
+    def get(self, image_id):
+        return super().get(image_id, thumb=True)
+
+
+api.add_resource(FleetSummary, '/api/bikes')
+api.add_resource(BikeData, '/api/bike', '/api/bikes/<string:bike_id>')
+api.add_resource(BikeHistory, '/api/bike/history', '/api/bikes/<string:bike_id>/history')
+api.add_resource(SentryMode, '/api/bike/sentry', '/api/bikes/<string:bike_id>/sentry')
+api.add_resource(Alerts, '/api/alerts', '/api/bikes/<string:bike_id>/alerts')
+api.add_resource(Image, '/api/image', '/api/bikes/<string:bike_id>/image')
+api.add_resource(ImageList, '/api/images')
+api.add_resource(ImageFile, '/api/images/<string:image_id>')
+api.add_resource(ImageThumb, '/api/images/<string:image_id>/thumb')
 
 
 @app.route('/')
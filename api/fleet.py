@@ -0,0 +1,135 @@
+import re
+from datetime import datetime
+from threading import Condition, Lock
+
+ALERT_FLAGS = ("movement_flag", "object_flag", "coord_flag")
+
+
+class Device:
+    """State of a single bike. Every device has its own lock, so updates from different bikes never wait on each
+    other.
+
+    The lock is a Condition, notified whenever sentry mode changes, for long polls waiting on the device.
+    """
+
+    def __init__(self, bike_id: str):
+        self.id = bike_id
+        self.changed = Condition()
+
+        self.status = None
+        self.last_updated = None
+        self.alerts = {flag: False for flag in ALERT_FLAGS}
+
+        # bumped on every change, for long polls and etags
+        self.sentry_version = 0
+        self.status_version = 0
+        self.alerts_version = 0
+
+    @property
+    def sentry_mode(self) -> bool:
+        return bool(self.status and self.status.get("sentry_mode"))
+
+    @property
+    def alerting(self) -> bool:
+        return any(self.alerts.values())
+
+
+class Fleet:
+    """Registry of devices, keyed by bike id.
+
+    Keeps a summary of the fleet (number of bikes, number in sentry mode, and which are alerting) which is updated
+    as devices change, so it never has to scan every device.
+    """
+
+    def __init__(self):
+        self._devices = {}
+        self._lock = Lock()  # only held to add devices and update the summary
+
+        self._sentry = 0
+        self._alerting = set()
+
+    def get(self, bike_id: str, create: bool = False) -> Device:
+        """Gets a device
+
+        Args:
+            bike_id (str): id of the bike (letters, digits, and underscores)
+            create (bool): add the device if it doesn't exist yet
+
+        Returns:
+            Device: the device, or None if it doesn't exist (or the id is invalid)
+        """
+        device = self._devices.get(bike_id)
+
+        if device is None and create and re.fullmatch(r"\w{1,64}", bike_id):
+            with self._lock:
+                device = self._devices.setdefault(bike_id, Device(bike_id))
+
+        return device
+
+    def update_status(self, device: Device, changes: dict) -> tuple[dict, bool]:
+        """Merges changed fields into the status of a device
+
+        Args:
+            device (Device): device to update
+            changes (dict): fields which have changed. A heartbeat sends every field, changed or not
+
+        Returns:
+            tuple[dict, bool]: copy of the new status, and whether any field actually changed
+        """
+        with device.changed:
+            previous = device.status.get("sentry_mode") if device.status else None
+
+            if device.status is None:
+                device.status = {}
+            changed = any(key not in device.status or device.status[key] != value for key, value in changes.items())
+            device.status.update(changes)
+            device.last_updated = datetime.now().isoformat()
+            device.status_version += 1
+
+            if "sentry_mode" in changes and changes["sentry_mode"] != previous:
+                device.sentry_version += 1
+                device.changed.notify_all()
+
+                if device.sentry_mode != bool(previous):
+                    with self._lock:
+                        self._sentry += 1 if device.sentry_mode else -1
+
+            return dict(device.status), changed
+
+    def update_alerts(self, device: Device, changes: dict) -> dict:
+        """Merges changed flags into the alerts of a device
+
+        Args:
+            device (Device): device to update
+            changes (dict): flags which have changed
+
+        Returns:
+            dict: copy of the new alerts
+        """
+        with device.changed:
+            if any(device.alerts[flag] != value for flag, value in changes.items()):
+                was_alerting = device.alerting
+                device.alerts.update(changes)
+                device.alerts_version += 1
+
+                if device.alerting != was_alerting:
+                    with self._lock:
+                        if device.alerting:
+                            self._alerting.add(device.id)
+                        else:
+                            self._alerting.discard(device.id)
+
+            return dict(device.alerts)
+
+    def summary(self) -> dict:
+        """Gets the fleet summary
+
+        Returns:
+            dict: number of bikes, number in sentry mode, and ids of the bikes with an alert flag set
+        """
+        with self._lock:
+            return {
+                "bikes": len(self._devices),
+                "sentry": self._sentry,
+                "alerting": sorted(self._alerting)
+            }
@@ -0,0 +1,277 @@
+import bisect
+import os
+import re
+import time
+from collections import namedtuple
+from threading import Lock
+
+import cv2 as cv
+import numpy as np
+
+ImageRecord = namedtuple("ImageRecord", ["id", "bike", "timestamp", "size"])
+
+
+def _make_id(timestamp: float, seq: int) -> str:
+    """Image ids sort in time order: milliseconds since the epoch followed by a 3 digit sequence number
+    """
+    return f"{int(timestamp * 1000) * 1000 + seq:019d}"
+
+
+def _id_timestamp(image_id: str) -> float:
+    return int(image_id) // 1000 / 1000
+
+
+class _IdList:
+    """Sorted list of image ids which is only appended to, and evicted from the front.
+
+    Eviction moves a start offset rather than shifting the list, and the list is only compacted once half of it has
+    been evicted, so both are amortised O(1). It can still be bisected and sliced, for paging.
+    """
+
+    def __init__(self):
+        self._ids = []
+        self._start = 0
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._start
+
+    def append(self, image_id: str):
+        self._ids.append(image_id)
+
+    def sort(self):
+        del self._ids[:self._start]
+        self._start = 0
+        self._ids.sort()
+
+    def first(self) -> str:
+        return self._ids[self._start]
+
+    def last(self) -> str:
+        return self._ids[-1]
+
+    def popleft(self) -> str:
+        image_id = self._ids[self._start]
+        self._start += 1
+
+        if self._start * 2 >= len(self._ids):
+            del self._ids[:self._start]
+            self._start = 0
+
+        return image_id
+
+    def newest(self, before: str = None, limit: int = 20) -> list[str]:
+        """Gets the newest ids, newest first
+
+        Args:
+            before (str, optional): only ids which sort before this
+            limit (int): maximum number of ids
+
+        Returns:
+            list[str]: ids
+        """
+        end = len(self._ids) if before is None else bisect.bisect_left(self._ids, before, lo=self._start)
+        return self._ids[max(self._start, end - limit):end][::-1]
+
+
+class ImageStore:
+    """Bounded on disk store of jpeg images.
+
+    Images are kept in a ring: the oldest are evicted once there are more than max_images, they take up more than
+    max_bytes, or they are older than max_age. A thumbnail is made once when each image is added, and an in memory
+    index (rebuilt from the file names on start up) allows paging through the images by time and bike.
+    """
+
+    def __init__(self, root: str, max_images: int = 1000, max_bytes: int = 500 * 2 ** 20,
+                 max_age: float = 7 * 24 * 60 * 60, thumb_width: int = 160):
+        """
+        Args:
+            root (str): directory to keep the images in
+            max_images (int): maximum number of images kept
+            max_bytes (int): maximum size of the images and thumbnails on disk
+            max_age (float): seconds an image is kept for
+            thumb_width (int): width of the thumbnails (pixels)
+        """
+        self.root = root
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.thumb_width = thumb_width
+
+        self._full_dir = os.path.join(root, "full")
+        self._thumb_dir = os.path.join(root, "thumb")
+        os.makedirs(self._full_dir, exist_ok=True)
+        os.makedirs(self._thumb_dir, exist_ok=True)
+
+        self._lock = Lock()
+        self._records = {}
+        self._ids = _IdList()
+        self._ids_by_bike = {}
+        self._bytes = 0
+        self._last_id = None
+
+        self._load()
+
+    def _load(self):
+        """Rebuilds the index from the files on disk
+        """
+        for name in os.listdir(self._full_dir):
+            match = re.fullmatch(r"(\d{19})_(\w+)\.jpg", name)
+            if match is None:
+                continue
+
+            image_id, bike = match.groups()
+            size = os.path.getsize(os.path.join(self._full_dir, name))
+            thumb = os.path.join(self._thumb_dir, name)
+            if os.path.exists(thumb):
+                size += os.path.getsize(thumb)
+
+            self._index(ImageRecord(image_id, bike, _id_timestamp(image_id), size))
+
+        self._ids.sort()
+        for ids in self._ids_by_bike.values():
+            ids.sort()
+        if self._ids:
+            self._last_id = self._ids.last()
+
+        with self._lock:
+            self._evict(time.time())
+
+    def _index(self, record: ImageRecord):
+        self._records[record.id] = record
+        self._ids.append(record.id)
+        self._ids_by_bike.setdefault(record.bike, _IdList()).append(record.id)
+        self._bytes += record.size
+
+    def _filename(self, record: ImageRecord) -> str:
+        return f"{record.id}_{record.bike}.jpg"
+
+    def _thumbnail(self, image: bytes) -> bytes:
+        """Makes a jpeg thumbnail, decoding the image at a reduced size where possible
+        """
+        frame = cv.imdecode(np.frombuffer(image, dtype=np.uint8), cv.IMREAD_REDUCED_COLOR_2)
+        if frame is None:
+            return None
+
+        height, width = frame.shape[:2]
+        if width > self.thumb_width:
+            frame = cv.resize(frame, (self.thumb_width, max(1, height * self.thumb_width // width)),
+                              interpolation=cv.INTER_AREA)
+
+        ret, buffer = cv.imencode(".jpg", frame, [cv.IMWRITE_JPEG_QUALITY, 70])
+        return buffer.tobytes()
+
+    def add(self, image: bytes, bike: str = "default") -> ImageRecord:
+        """Adds a jpeg image to the store, evicting old images if needed
+
+        Args:
+            image (bytes): jpeg image, stored as is
+            bike (str): id of the bike which took the image (letters, digits, and underscores)
+
+        Returns:
+            ImageRecord: record of the new image
+        """
+        if not re.fullmatch(r"\w+", bike):
+            raise ValueError(f"Invalid bike id: {bike}")
+
+        thumb = self._thumbnail(image)
+        if thumb is None:
+            raise ValueError("Image could not be decoded")
+
+        # it would be evicted as soon as it was added
+        if len(image) + len(thumb) > self.max_bytes:
+            raise ValueError(f"Image is too large to store ({len(image) + len(thumb)} bytes, with its thumbnail)")
+
+        now = time.time()
+
+        with self._lock:
+            image_id = _make_id(now, 0)
+            if self._last_id is not None and image_id <= self._last_id:
+                image_id = f"{int(self._last_id) + 1:019d}"
+            self._last_id = image_id
+
+            record = ImageRecord(image_id, bike, _id_timestamp(image_id), len(image) + len(thumb))
+            name = self._filename(record)
+
+            with open(os.path.join(self._full_dir, name), "wb") as f:
+                f.write(image)
+            with open(os.path.join(self._thumb_dir, name), "wb") as f:
+                f.write(thumb)
+
+            self._index(record)
+            self._evict(now)
+
+        return record
+
+    def _evict(self, now: float):
+        """Removes the oldest images until the store is within its limits. Call with the lock held
+        """
+        while self._ids and (len(self._ids) > self.max_images or self._bytes > self.max_bytes or
+                             now - self._records[self._ids.first()].timestamp > self.max_age):
+            record = self._records.pop(self._ids.popleft())
+
+            # the oldest image is also the oldest from its bike
+            bike_ids = self._ids_by_bike[record.bike]
+            bike_ids.popleft()
+            if not bike_ids:
+                del self._ids_by_bike[record.bike]
+
+            self._bytes -= record.size
+
+            name = self._filename(record)
+            for directory in (self._full_dir, self._thumb_dir):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def list(self, bike: str = None, before: float = None, before_id: str = None,
+             limit: int = 20) -> list[ImageRecord]:
+        """Lists images, newest first
+
+        Args:
+            bike (str, optional): only list images from this bike
+            before (float, optional): only list images taken before this time (seconds since the epoch)
+            before_id (str, optional): only list images older than this image, for paging
+            limit (int): maximum number of images to list
+
+        Returns:
+            list[ImageRecord]: records of the images
+        """
+        with self._lock:
+            ids = self._ids if bike is None else self._ids_by_bike.get(bike)
+            if ids is None:
+                return []
+
+            bounds = [bound for bound in (None if before is None else _make_id(before, 0), before_id)
+                      if bound is not None]
+
+            return [self._records[i] for i in ids.newest(min(bounds, default=None), limit)]
+
+    def latest(self, bike: str = None) -> ImageRecord:
+        """Gets the newest image
+
+        Args:
+            bike (str, optional): newest image from this bike
+
+        Returns:
+            ImageRecord: record of the image, or None if there are no images
+        """
+        images = self.list(bike=bike, limit=1)
+        return images[0] if images else None
+
+    def get(self, image_id: str) -> ImageRecord:
+        """Gets the record of an image
+
+        Args:
+            image_id (str): id of the image
+
+        Returns:
+            ImageRecord: record of the image, or None if it isn't in the store
+        """
+        with self._lock:
+            return self._records.get(image_id)
+
+    def path(self, record: ImageRecord, thumb: bool = False) -> str:
+        """Gets the path of an image (or its thumbnail) on disk
+        """
+        return os.path.join(self._thumb_dir if thumb else self._full_dir, self._filename(record))
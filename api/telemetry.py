@@ -0,0 +1,189 @@
+import sqlite3
+import time
+from datetime import datetime
+from threading import Condition, Lock, Thread
+
+FIELDS = ("latitude", "longitude", "objects", "sentry_mode")
+
+
+class TelemetryStore:
+    """Append only history of bike statuses, kept in SQLite with an index on (bike, timestamp).
+
+    Appends are queued and written by a writer thread, so a request never waits on the database. Everything queued
+    while the last batch was being written goes in the next batch, with a single commit. Reads write out the queue
+    first, so they always see every point appended before them.
+
+    Points older than retention are deleted, and points older than compact_after are thinned out to one per
+    compact_step seconds, every compact_every appends.
+    """
+
+    def __init__(self, path: str, retention: float = 30 * 24 * 60 * 60, compact_after: float = 24 * 60 * 60,
+                 compact_step: float = 60, compact_every: int = 1000):
+        """
+        Args:
+            path (str): path of the SQLite database (":memory:" for an in memory database)
+            retention (float): seconds points are kept for
+            compact_after (float): seconds after which points are thinned out
+            compact_step (float): seconds between the points kept when compacting
+            compact_every (int): number of appends between compactions
+        """
+        self.retention = retention
+        self.compact_after = compact_after
+        self.compact_step = compact_step
+        self.compact_every = compact_every
+
+        self._lock = Lock()  # held to use the database
+        self._appends = 0
+
+        self._pending = []
+        self._pending_changed = Condition()
+        self.stopped = False
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS telemetry (
+                bike TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                latitude REAL,
+                longitude REAL,
+                objects INTEGER,
+                sentry_mode INTEGER
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS telemetry_bike_time ON telemetry (bike, timestamp)")
+        self._db.commit()
+
+        self.thread = Thread(target=self._update, name="TelemetryWriter", daemon=True)
+        self.thread.start()
+
+    def append(self, bike: str, status: dict, timestamp: float = None):
+        """Queues a point to be added to the history of a bike. Doesn't wait for it to be written
+
+        Args:
+            bike (str): id of the bike
+            status (dict): bike status, any of latitude, longitude, objects, and sentry_mode
+            timestamp (float, optional): seconds since the epoch, defaults to now
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        row = (bike, timestamp, *(status.get(field) for field in FIELDS))
+
+        with self._pending_changed:
+            self._pending.append(row)
+            self._pending_changed.notify()
+
+    def flush(self):
+        """Writes every queued point to the database
+        """
+        with self._lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        """Call with the lock held
+        """
+        with self._pending_changed:
+            rows, self._pending = self._pending, []
+
+        if not rows:
+            return
+
+        self._db.executemany(
+            "INSERT INTO telemetry (bike, timestamp, latitude, longitude, objects, sentry_mode) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        self._db.commit()
+
+        self._appends += len(rows)
+        if self._appends >= self.compact_every:
+            self._compact(time.time())
+
+    def _update(self):
+        """This runs continuously in the thread. Writes out the queue whenever anything is added to it
+        """
+        while True:
+            with self._pending_changed:
+                self._pending_changed.wait_for(lambda: self._pending or self.stopped)
+                if self.stopped:
+                    break
+
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"{datetime.now().isoformat()} Error writing telemetry: {e}")
+                time.sleep(1)
+
+    def range(self, bike: str, start: float = None, end: float = None, step: float = None,
+              limit: int = 10000) -> list[dict]:
+        """Gets the history of a bike, oldest first
+
+        Args:
+            bike (str): id of the bike
+            start (float, optional): earliest time (seconds since the epoch)
+            end (float, optional): latest time (seconds since the epoch)
+            step (float, optional): downsample to the last point in every step seconds
+            limit (int): maximum number of points
+
+        Returns:
+            list[dict]: points with timestamp, latitude, longitude, objects, and sentry_mode
+        """
+        where = "bike = ?"
+        args = [bike]
+
+        # only bound the time when asked to, so an open range uses the index on bike alone
+        if start is not None:
+            where += " AND timestamp >= ?"
+            args.append(start)
+        if end is not None:
+            where += " AND timestamp <= ?"
+            args.append(end)
+
+        if step:
+            # SQLite returns the other columns from the row with the MAX(timestamp) of each group
+            query = (f"SELECT MAX(timestamp), {', '.join(FIELDS)} FROM telemetry WHERE {where} "
+                     f"GROUP BY CAST(timestamp / ? AS INTEGER) ORDER BY 1 LIMIT ?")
+            args += [step, limit]
+        else:
+            query = f"SELECT timestamp, {', '.join(FIELDS)} FROM telemetry WHERE {where} ORDER BY timestamp LIMIT ?"
+            args += [limit]
+
+        with self._lock:
+            self._write_pending()
+            rows = self._db.execute(query, args).fetchall()
+
+        return [{"timestamp": timestamp, "latitude": latitude, "longitude": longitude, "objects": objects,
+                 "sentry_mode": None if sentry_mode is None else bool(sentry_mode)}
+                for timestamp, latitude, longitude, objects, sentry_mode in rows]
+
+    def compact(self):
+        """Deletes points past retention and thins out points older than compact_after
+        """
+        with self._lock:
+            self._write_pending()
+            self._compact(time.time())
+
+    def _compact(self, now: float):
+        """Call with the lock held
+        """
+        self._db.execute("DELETE FROM telemetry WHERE timestamp < ?", (now - self.retention,))
+        self._db.execute(
+            "DELETE FROM telemetry WHERE timestamp < ? AND rowid NOT IN ("
+            "  SELECT MAX(rowid) FROM telemetry WHERE timestamp < ? "
+            "  GROUP BY bike, CAST(timestamp / ? AS INTEGER))",
+            (now - self.compact_after, now - self.compact_after, self.compact_step)
+        )
+        self._db.commit()
+
+        self._appends = 0
+
+    def close(self):
+        """Stops the writer thread, writes out the queue, and closes the database
+        """
+        with self._pending_changed:
+            self.stopped = True
+            self._pending_changed.notify()
+        self.thread.join()
+
+        with self._lock:
+            self._write_pending()
+            self._db.close()
@@ -0,0 +1,425 @@
+"""Benchmarks the detection hot path, stage by stage, and writes the results as JSON to compare across commits.
+
+Run from the root of the repo with: python -m bin.benchmark -o bench.json
+
+Each resolution is run on the same seeded sample image (or the images in --images, resized), through the stages of
+ObjectDetection.detect (blob, forward) and DetectionOutput (filter, nms, draw_boxes, jpeg_encode). If the model
+isn't installed, the forward stage is skipped and the later stages run on a seeded stand in for the network output,
+which is recorded as "outputs": "synthetic". Only compare results with the same outputs and config.
+
+GPS parsing and IMU scoring are run on the fakes in iotbike.fakes, so they need no hardware either.
+
+With --baseline, the run is compared to an earlier result, and exits with 1 if the p95 of any stage (imu stages
+included) has regressed, or the gps or imu throughput has dropped, by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import cv2 as cv
+import numpy as np
+
+from iotbike.fakes import FakeSenseHat, FakeSerial, acceleration_trace, nmea_fix
+from iotbike.gps import GPS
+from iotbike.imu import IMU, MotionWindow
+from iotbike.objectdetection import DetectionOutput, ObjectDetection, _load_class_names, filter_boxes, suppress
+
+# bump when the layout of the results changes, so old results aren't compared to new
+SCHEMA = 1
+
+STAGES = ("blob", "forward", "filter", "nms", "draw_boxes", "jpeg_encode")
+IMU_STAGES = ("motion_window", "update_data")
+RESOLUTIONS = ("640x480", "1280x720", "1920x1080")
+
+
+def percentiles(times: list[float]) -> dict:
+    """Summarises the times of a stage
+
+    Args:
+        times (list[float]): time of each run (seconds)
+
+    Returns:
+        dict: number of runs, mean, p50, p95, and p99 (milliseconds), and frames per second at the mean
+    """
+    ms = np.asarray(times) * 1000
+    mean = float(ms.mean())
+
+    return {
+        "n": len(ms),
+        "mean_ms": round(mean, 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "fps": round(1000 / mean, 2) if mean > 0 else None,
+    }
+
+
+def sample_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Makes a reproducible stand in for a camera frame: a gradient with some shapes and sensor noise, so it encodes
+    to a JPEG of a realistic size
+
+    Returns:
+        np.ndarray: BGR image
+    """
+    rng = np.random.default_rng(seed)
+
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                       (x + y) / 2]).astype(np.uint8)
+
+    for _ in range(12):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        size = int(rng.integers(height // 20, height // 4))
+        cv.rectangle(image, (x0, y0), (x0 + size, y0 + size), rng.integers(0, 256, 3).tolist(), -1)
+
+    noise = rng.normal(0, 4, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def load_images(directory: str, resolutions: list[tuple[int, int]]) -> dict:
+    """Loads the images in a directory, sorted by name, resized to each resolution
+
+    Returns:
+        dict: resolution to list of images
+    """
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+    images = [image for image in (cv.imread(path) for path in paths) if image is not None]
+    if not images:
+        raise Exception(f"{datetime.now().isoformat()} No images in {directory}")
+
+    return {(w, h): [cv.resize(image, (w, h), interpolation=cv.INTER_AREA) for image in images]
+            for w, h in resolutions}
+
+
+def synthetic_outputs(input_size: int, objects: int = 8, seed: int = 0) -> list[np.ndarray]:
+    """Makes a reproducible stand in for the output of yolov7-tiny: a row for every anchor of the three output
+    layers, all scoring under 0.5, with a cluster of overlapping confident rows around each object for nms to
+    suppress
+
+    Returns:
+        list[np.ndarray]: output of each output layer
+    """
+    rng = np.random.default_rng(seed)
+    outputs = []
+
+    for stride in (32, 16, 8):
+        rows = rng.random((3 * (input_size // stride) ** 2, 85), dtype=np.float32)
+        rows[:, 5:] = rows[:, 5:] ** 8 / 2
+        outputs.append(rows)
+
+    rows = outputs[-1]
+    for i in range(objects):
+        centre, size = rng.uniform(0.2, 0.8, 2), rng.uniform(0.05, 0.3, 2)
+        cluster = slice(i * 10, i * 10 + 10)
+
+        rows[cluster, :2] = centre + rng.normal(0, 0.01, (10, 2))
+        rows[cluster, 2:4] = size * rng.uniform(0.9, 1.1, (10, 2))
+        rows[cluster, 5 + i % 80] = rng.uniform(0.92, 0.99, 10)
+
+    return outputs
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+def bench_detection(detector: ObjectDetection, images: list[np.ndarray], input_size: int, threshold: float,
+                    repeat: int, warmup: int) -> dict:
+    """Times each stage of detection on images of one resolution
+
+    Args:
+        detector (ObjectDetection): detector, or None to skip the forward stage and use synthetic outputs
+        images (list[np.ndarray]): images, used in turn
+        input_size (int): input size of the network
+        threshold (float): threshold for detection
+        repeat (int): number of timed runs
+        warmup (int): number of untimed runs first
+
+    Returns:
+        dict: summary of each stage, and of the total of the stages run
+    """
+    classes = detector.classes if detector is not None else _classes()
+    framework = detector.framework if detector is not None else "dn"
+
+    raw = None if detector is not None else synthetic_outputs(input_size)
+    times = {stage: [] for stage in STAGES}
+    detections = 0
+
+    for i in range(warmup + repeat):
+        image = images[i % len(images)]
+        run = {}
+
+        if detector is not None:
+            blob, run["blob"] = _timed(detector.make_blob, image)
+            (raw, _), run["forward"] = _timed(detector._forward, blob, 1)
+        else:
+            # as make_blob does
+            _, run["blob"] = _timed(lambda: cv.dnn.blobFromImage(image, 1 / 255.0, (input_size, input_size),
+                                                                 swapRB=True, crop=False))
+
+        # the stages DetectionOutput runs on initialisation, one at a time
+        filtered, run["filter"] = _timed(lambda: filter_boxes(np.vstack(raw), image.shape[:2], threshold, framework))
+        kept, run["nms"] = _timed(suppress, *filtered, threshold)
+        output = DetectionOutput.from_boxes(*kept, image, framework, classes)
+
+        # on a copy, as the bike does
+        frame, run["draw_boxes"] = _timed(output.draw_boxes, True)
+        _, run["jpeg_encode"] = _timed(cv.imencode, ".jpg", frame)
+
+        if i >= warmup:
+            for stage, elapsed in run.items():
+                times[stage].append(elapsed)
+            times.setdefault("total", []).append(sum(run.values()))
+            detections = output.get_objects()
+
+    return {
+        "stages": {stage: percentiles(times[stage]) if times[stage] else None for stage in STAGES},
+        "total": percentiles(times["total"]),
+        "detections": detections,
+    }
+
+
+def _classes() -> tuple[str, ...]:
+    try:
+        return _load_class_names()
+    except Exception:
+        return ("person",) + tuple(f"class{i}" for i in range(1, 80))
+
+
+def bench_gps(fixes: int = 5000) -> dict:
+    """Times parsing NMEA from a fake serial port: throughput with every byte already waiting, and latency from the
+    last byte of a sentence arriving to it being parsed, at 115200 baud and 10 fixes a second
+
+    Returns:
+        dict: sentences a second, and summary of the latency
+    """
+    gps = GPS(serial_port=FakeSerial([nmea_fix(i) for i in range(fixes)]))
+
+    t0 = time.perf_counter()
+    while gps.serial.in_waiting:
+        gps.update()
+    elapsed = time.perf_counter() - t0
+
+    port = FakeSerial([nmea_fix(i) for i in range(10)], baudrate=115200, burst_interval=0.1)
+    gps = GPS(serial_port=port)
+
+    latencies = []
+    while port.pos < len(port.data):
+        if gps.update():
+            latencies.append(time.monotonic() - port.arrival_time(port.pos - 1))
+
+    return {
+        "sentences_per_second": round(3 * fixes / elapsed),
+        "latency": percentiles(latencies),
+    }
+
+
+def bench_imu(samples: int = 5000, rate: float = 100, window: float = 0.5) -> dict:
+    """Times scoring accelerometer samples from a fake sense hat: MotionWindow.append on its own, and the whole of
+    IMU.update_data, as the sampling thread runs it
+
+    Args:
+        samples (int): number of samples
+        rate (float): sample rate (Hz) of the imu
+        window (float): seconds of samples in the motion window
+
+    Returns:
+        dict: samples a second through update_data, and summary of each stage
+    """
+    trace = acceleration_trace(samples / rate, rate, shake=0.05)
+    times = {stage: [] for stage in IMU_STAGES}
+
+    motion = MotionWindow(max(2, int(rate * window)), rate)
+    for sample in trace:
+        _, elapsed = _timed(motion.append, sample)
+        times["motion_window"].append(elapsed)
+
+    imu = IMU(rate=rate, window=window, sense=FakeSenseHat(trace, loop=True))
+    for _ in range(samples):
+        _, elapsed = _timed(imu.update_data)
+        times["update_data"].append(elapsed)
+
+    return {
+        "samples_per_second": round(samples / sum(times["update_data"])),
+        "stages": {stage: percentiles(times[stage]) for stage in IMU_STAGES},
+    }
+
+
+def _git_commit() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, check=True).stdout
+        return {"commit": commit.strip(), "dirty": bool(dirty.strip())}
+    except Exception:
+        return {"commit": None, "dirty": None}
+
+
+def run(resolutions: list[str], input_size: int = 416, threshold: float = 0.9, repeat: int = 100, warmup: int = 5,
+        images: str = None, gps: bool = True, imu: bool = True) -> dict:
+    """Runs the benchmarks
+
+    Args:
+        resolutions (list[str]): resolutions of the images, as "WIDTHxHEIGHT"
+        input_size (int): input size of the network
+        threshold (float): threshold for detection, as used on the bike
+        repeat (int): number of timed runs of each resolution
+        warmup (int): number of untimed runs of each resolution first
+        images (str, optional): directory of images to use instead of the sample image
+        gps (bool): whether to benchmark gps parsing too
+        imu (bool): whether to benchmark imu scoring too
+
+    Returns:
+        dict: results
+    """
+    sizes = [tuple(int(v) for v in resolution.split("x")) for resolution in resolutions]
+
+    try:
+        detector = ObjectDetection(input_size=input_size)
+    except Exception as e:
+        print(f"{datetime.now().isoformat()} No model, skipping the forward stage: {e}", file=sys.stderr)
+        detector = None
+
+    samples = load_images(images, sizes) if images else {(w, h): [sample_image(w, h)] for w, h in sizes}
+
+    return {
+        "schema": SCHEMA,
+        **_git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "platform": {
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv.__version__,
+        },
+        "config": {
+            "input_size": input_size,
+            "threshold": threshold,
+            "repeat": repeat,
+            "warmup": warmup,
+            "images": images,
+            "outputs": "model" if detector is not None else "synthetic",
+        },
+        "detection": {f"{w}x{h}": bench_detection(detector, samples[(w, h)], input_size, threshold, repeat, warmup)
+                      for w, h in sizes},
+        "gps": bench_gps() if gps else None,
+        "imu": bench_imu() if imu else None,
+    }
+
+
+def _summaries(result: dict) -> dict:
+    """Gets the summary of every stage in the results, by name, e.g. "640x480 nms" or "imu update_data"
+    """
+    summaries = {}
+    for resolution, stats in result["detection"].items():
+        for stage, summary in {**stats["stages"], "total": stats["total"]}.items():
+            summaries[f"{resolution} {stage}"] = summary
+
+    for stage, summary in (result.get("imu") or {}).get("stages", {}).items():
+        summaries[f"imu {stage}"] = summary
+
+    return summaries
+
+
+def _rates(result: dict) -> dict:
+    """Gets the throughput of gps parsing and imu scoring in the results, by name
+    """
+    gps, imu = result.get("gps") or {}, result.get("imu") or {}
+    rates = {"gps sentences_per_second": gps.get("sentences_per_second"),
+             "imu samples_per_second": imu.get("samples_per_second")}
+
+    return {name: rate for name, rate in rates.items() if rate is not None}
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Finds the stages whose p95 is more than tolerance slower than in the baseline, and the throughputs which are
+    more than tolerance lower
+
+    Returns:
+        list[str]: description of each regression
+    """
+    if baseline.get("schema") != result["schema"] or baseline.get("config") != result["config"]:
+        raise Exception(f"{datetime.now().isoformat()} Baseline was run with a different schema or config")
+
+    regressions = []
+    before_summaries = _summaries(baseline)
+    for name, summary in _summaries(result).items():
+        before = before_summaries.get(name)
+        if summary is None or before is None:
+            continue
+
+        change = summary["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0
+        if change > tolerance:
+            regressions.append(f"{name}: p95 {before['p95_ms']:.3f} ms -> {summary['p95_ms']:.3f} ms ({change:+.0%})")
+
+    before_rates = _rates(baseline)
+    for name, rate in _rates(result).items():
+        before = before_rates.get(name)
+        if not before:
+            continue
+
+        change = rate / before - 1
+        if change < -tolerance:
+            regressions.append(f"{name}: {before} -> {rate} ({change:+.0%})")
+
+    return regressions
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [OPTIONS]",
+        description="Benchmarks each stage of object detection and writes p50/p95/p99 latency and fps as JSON"
+    )
+
+    parser.add_argument("-o", "--output", default=None, help="file to write the results to (default: stdout)")
+    parser.add_argument("-r", "--resolution", nargs="+", default=list(RESOLUTIONS),
+                        help="resolutions to run, as WIDTHxHEIGHT")
+    parser.add_argument("--input-size", type=int, default=416, help="input size of the network")
+    parser.add_argument("--threshold", type=float, default=0.9, help="threshold for detection")
+    parser.add_argument("-n", "--repeat", type=int, default=100, help="timed runs of each resolution")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed runs of each resolution first")
+    parser.add_argument("--images", default=None, help="directory of images to use instead of the sample image")
+    parser.add_argument("--no-gps", action="store_true", help="skip the gps parsing benchmark")
+    parser.add_argument("--no-imu", action="store_true", help="skip the imu scoring benchmark")
+    parser.add_argument("--baseline", default=None, help="results of an earlier run to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="fraction the p95 of a stage can be slower than the baseline by")
+
+    return parser
+
+
+def main():
+    args = init_argparse().parse_args()
+
+    result = run(args.resolution, args.input_size, args.threshold, args.repeat, args.warmup, args.images,
+                 not args.no_gps, not args.no_imu)
+
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+
+        for regression in regressions:
+            print(f"{datetime.now().isoformat()} Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
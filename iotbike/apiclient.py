@@ -0,0 +1,168 @@
+from datetime import datetime
+from threading import Lock, local
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = "http://joehartley.pythonanywhere.com"
+
+
+class ApiClient:
+    """Client for the bike api.
+
+    Keeps a requests session for each thread which calls the api, as a session isn't guaranteed to be thread safe.
+    They share one connection pool, so the TCP (and TLS) connection is reused between calls. Failed requests are
+    retried with exponential backoff. Posts are only retried if they never reached the api (the connection failed),
+    as the api may have acted on one it failed to answer, e.g. stored an image, or applied a change.
+    """
+
+    def __init__(self, base_url: str = API_URL, bike_id: str = "default", timeout: tuple[float, float] = (3.05, 10),
+                 retries: int = 3, backoff_factor: float = 0.5, pool_size: int = 4):
+        """
+        Args:
+            base_url (str): url of the api, without a trailing slash
+            bike_id (str): id of this bike in the fleet (letters, digits, and underscores)
+            timeout (tuple[float, float]): connect and read timeouts (seconds)
+            retries (int): number of times to retry a failed request
+            backoff_factor (float): retries wait backoff_factor * 2 ** (retry - 1) seconds
+            pool_size (int): maximum number of connections kept open to the api
+        """
+        self.base_url = base_url.rstrip("/")
+        self.bike_id = bike_id
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # idempotent methods only, not POST
+            raise_on_status=False
+        )
+        # urllib3's connection pool is thread safe, so every session shares it
+        self._adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_size)
+
+        self._local = local()
+        self._sessions = []
+        self._sessions_lock = Lock()
+
+        # etag and json of the last response from each url, sent back with If-None-Match
+        self._cache = {}
+
+    @property
+    def session(self) -> requests.Session:
+        """Gets the session of the calling thread, creating it if needed
+        """
+        session = getattr(self._local, "session", None)
+
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+
+        return session
+
+    def bike_path(self, resource: str = "") -> str:
+        """Gets the path of one of this bike's resources
+
+        Args:
+            resource (str): e.g. "/alerts", or "" for the bike status
+
+        Returns:
+            str: path to use as a suffix, e.g. "/api/bikes/default/alerts"
+        """
+        return f"/api/bikes/{self.bike_id}{resource}"
+
+    def get(self, suffix: str, **kwargs):
+        """GETs from the api. Conditional on the etag of the last response, so unchanged resources aren't sent again
+
+        Args:
+            suffix (str): path of the resource, e.g. "/api/bike"
+            **kwargs: passed on to requests
+
+        Returns:
+            any: json response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        key = (suffix, tuple(sorted((kwargs.get("params") or {}).items())))
+        cached = self._cache.get(key)
+        if cached is not None:
+            kwargs["headers"] = {"If-None-Match": cached[0], **(kwargs.get("headers") or {})}
+
+        response = self.session.get(self.base_url + suffix, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            return cached[1]
+        elif not(response.ok):
+            raise Exception(f"{datetime.now().isoformat()} Error getting data from the api: {response.text}")
+
+        data = response.json()
+
+        if "ETag" in response.headers:
+            self._cache[key] = (response.headers["ETag"], data)
+        else:
+            self._cache.pop(key, None)
+
+        return data
+
+    def post(self, data, suffix: str, **kwargs):
+        """POSTs json data to the api
+
+        Args:
+            data (dict): data to be sent as json
+            suffix (str): path of the resource, e.g. "/api/bike"
+            **kwargs: passed on to requests
+
+        Returns:
+            any: json response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        response = self.session.post(self.base_url + suffix, json=data, **kwargs)
+
+        if not(response.ok):
+            raise Exception(f"{datetime.now().isoformat()} Error posting data to the api: {response.text}")
+        else:
+            return response.json()
+
+    def post_image(self, image: bytes, suffix: str, content_type: str = "image/jpeg", **kwargs):
+        """POSTs an encoded image to the api as the raw request body
+
+        Args:
+            image (bytes): encoded image
+            suffix (str): path of the resource, e.g. "/api/image"
+            content_type (str): mime type of the image, sent as the Content-Type header
+            **kwargs: passed on to requests, any headers are sent too
+
+        Returns:
+            any: json response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs["headers"] = {**(kwargs.get("headers") or {}), "Content-Type": content_type}
+        response = self.session.post(self.base_url + suffix, data=image, **kwargs)
+
+        if not(response.ok):
+            raise Exception(f"{datetime.now().isoformat()} Error posting image to the api: {response.text}")
+        else:
+            return response.json()
+
+    def close(self):
+        """Closes the connections to the api
+        """
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+            self._local = local()
+
+        self._adapter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,181 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import cv2 as cv
+
+from iotbike import objectdetection
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+CSV_FIELDS = ["path", "class", "confidence", "x", "y", "w", "h", "error"]
+
+# set up once in each worker process by _init_worker
+_detector = None
+_decoder = None
+
+
+def find_images(directory: str) -> list[str]:
+    """Finds every image file under a directory
+
+    Args:
+        directory (str): directory to search, including subdirectories
+
+    Returns:
+        list[str]: paths of the images, sorted
+    """
+    return sorted(str(path) for path in Path(directory).rglob("*")
+                  if path.suffix.lower() in IMAGE_SUFFIXES and path.is_file())
+
+
+def _init_worker(input_size: int, decode_threads: int):
+    """Loads a detector for this worker process
+    """
+    global _detector, _decoder
+
+    # there is a process for each core, so opencv shouldn't start threads of its own
+    cv.setNumThreads(1)
+
+    _detector = objectdetection.ObjectDetection(input_size=input_size)
+    _decoder = ThreadPoolExecutor(max_workers=decode_threads, thread_name_prefix="decode")
+
+
+def _detect_paths(paths: list[str], threshold: float) -> list[dict]:
+    """Decodes a batch of images and detects objects in them with a single forward pass. Runs in a worker process
+
+    Returns:
+        list[dict]: result for each path, in order
+    """
+    images = list(_decoder.map(cv.imread, paths))
+
+    decoded = [(path, image) for path, image in zip(paths, images) if image is not None]
+    outputs = _detector.detect_batch([image for _, image in decoded], threshold)
+
+    results = {path: {"path": path, "error": "Image could not be decoded"} for path in paths}
+
+    for (path, _), output in zip(decoded, outputs):
+        detections = []
+        if output.boxes is not None:
+            detections = [{"class": output.get_name(class_id), "confidence": round(confidence, 4), "box": list(box)}
+                          for box, confidence, class_id in zip(output.boxes, output.confidences, output.classIDs)]
+
+        results[path] = {
+            "path": path,
+            "objects": output.get_objects(),
+            "people": output.get_people(),
+            "elapsed": output.elapsed,
+            "detections": detections
+        }
+
+    return [results[path] for path in paths]
+
+
+def _write_jsonl(f, result: dict):
+    f.write(json.dumps(result) + "\n")
+
+
+def _write_csv(writer: csv.DictWriter, result: dict):
+    """Writes a row for each detection, or a single row with no class if there weren't any
+    """
+    if "error" in result:
+        writer.writerow({"path": result["path"], "error": result["error"]})
+    elif not result["detections"]:
+        writer.writerow({"path": result["path"]})
+
+    for detection in result.get("detections", []):
+        x, y, w, h = detection["box"]
+        writer.writerow({"path": result["path"], "class": detection["class"], "confidence": detection["confidence"],
+                         "x": x, "y": y, "w": w, "h": h})
+
+
+def scan(directory: str, output: str = "-", output_format: str = None, workers: int = None, batch_size: int = 8,
+         threshold: float = 0.8, input_size: int = 416, decode_threads: int = 2) -> int:
+    """Detects objects in every image under a directory, spread over a pool of processes, streaming the results to
+    a file as they are ready
+
+    Args:
+        directory (str): directory of images
+        output (str): file to write the results to, "-" for stdout
+        output_format (str, optional): "jsonl" or "csv". Guessed from the output file extension if None
+        workers (int, optional): number of worker processes, defaults to the number of cores
+        batch_size (int): number of images detected in each forward pass
+        threshold (float): threshold for detection
+        input_size (int): input size of the detector
+        decode_threads (int): threads each worker decodes images with
+
+    Returns:
+        int: number of images scanned
+    """
+    if output_format is None:
+        output_format = "csv" if output.lower().endswith(".csv") else "jsonl"
+    if output_format not in ("jsonl", "csv"):
+        raise ValueError(f"Unknown output format: {output_format}")
+
+    paths = find_images(directory)
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    workers = workers or os.cpu_count()
+
+    f = sys.stdout if output == "-" else open(output, "w", newline="")
+
+    try:
+        if output_format == "csv":
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            write = lambda result: _write_csv(writer, result)
+        else:
+            write = lambda result: _write_jsonl(f, result)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(input_size, decode_threads)) as pool:
+            # results come back in order, and are written as soon as each batch is done
+            for results in pool.map(_detect_paths, batches, [threshold] * len(batches)):
+                for result in results:
+                    write(result)
+                f.flush()
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+    return len(paths)
+
+
+def init_argparse():
+    parser = argparse.ArgumentParser(
+        prog="python -m iotbike.batchdetect",
+        description="Detects objects in every image in a directory, without a display, using every core"
+    )
+
+    parser.add_argument("directory", help="Directory of images, including subdirectories")
+    parser.add_argument("-o", "--output", default="-", help="File to write the results to (default stdout)")
+    parser.add_argument("-f", "--format", choices=["jsonl", "csv"], default=None,
+                        help="Format of the results, guessed from the output file extension if not given")
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of worker processes (default number of cores)")
+    parser.add_argument("-b", "--batch-size", type=int, default=8, help="Images detected in each forward pass")
+    parser.add_argument("-t", "--threshold", type=float, default=0.8, help="Threshold for detection")
+    parser.add_argument("--input-size", type=int, choices=objectdetection.INPUT_SIZES, default=416,
+                        help="Input size of the detector")
+    parser.add_argument("--decode-threads", type=int, default=2, help="Threads each worker decodes images with")
+
+    return parser
+
+
+def main():
+    args = init_argparse().parse_args()
+
+    t0 = time.time()
+    count = scan(args.directory, args.output, args.format, args.workers, args.batch_size, args.threshold,
+                 args.input_size, args.decode_threads)
+    elapsed = time.time() - t0
+
+    print(f"Scanned {count} images in {elapsed:.1f}s ({count / elapsed if elapsed > 0 else 0:.1f} images/s)",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""In process stand ins for the gps serial port and the sense hat, for deterministic tests and benchmarks without
+hardware.
+"""
+import functools
+import operator
+import time
+
+import numpy as np
+
+
+def nmea_sentence(body: str) -> bytes:
+    """Makes an NMEA sentence with a valid checksum, e.g. nmea_sentence("GNRMC,...")
+    """
+    checksum = functools.reduce(operator.xor, body.encode(), 0)
+    return f"${body}*{checksum:02X}\r\n".encode()
+
+
+def nmea_fix(i: int, latitude: float = 51.5, longitude: float = -0.125) -> bytes:
+    """Makes the burst of sentences a gps sends for one fix: RMC, GGA, and VTG. The latitude goes up by about a metre
+    with each i
+    """
+    latitude += i * 1e-5
+    lat = f"{int(latitude):02d}{(latitude % 1) * 60:07.4f},{'N' if latitude >= 0 else 'S'}"
+    lon = f"{int(abs(longitude)):03d}{(abs(longitude) % 1) * 60:07.4f},{'E' if longitude >= 0 else 'W'}"
+    utc = f"{12 + i // 3600 % 12:02d}{i // 60 % 60:02d}{i % 60:02d}.00"
+
+    return (nmea_sentence(f"GNRMC,{utc},A,{lat},{lon},0.5,84.4,010124,,,A") +
+            nmea_sentence(f"GNGGA,{utc},{lat},{lon},1,08,0.9,45.4,M,46.9,M,,") +
+            nmea_sentence("GNVTG,84.4,T,,M,0.5,N,0.9,K,A"))
+
+
+class ManualClock:
+    """Clock which only moves when slept on, to pass as the clock and sleep of the fakes
+    """
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class FakeSerial:
+    """serial.Serial stand in which emits scripted bytes as a gps would: in bursts (one per fix) every burst_interval
+    seconds, each burst arriving at baudrate.
+
+    With baudrate None, each burst arrives all at once. Like a real port, read blocks (for up to timeout) until at
+    least one byte has arrived. The clock and sleep can be replaced, to run without waiting.
+    """
+
+    def __init__(self, bursts: list[bytes], baudrate: int = None, burst_interval: float = 0, timeout: float = 1,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            bursts (list[bytes]): bytes sent in each burst
+            baudrate (int, optional): baud rate, 10 bits per byte. Instant if None
+            burst_interval (float): seconds between the start of each burst
+            timeout (float): most seconds read blocks for
+            clock (callable): returns the time (seconds)
+            sleep (callable): sleeps for a number of seconds
+        """
+        self.data = b"".join(bursts)
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.is_open = True
+
+        # time each byte arrives, from when the port was opened
+        byte_time = 10. / baudrate if baudrate else 0.
+        self.arrivals = np.concatenate([i * burst_interval + byte_time * np.arange(1, len(burst) + 1)
+                                        for i, burst in enumerate(bursts)] or [np.zeros(0)])
+
+        self.start = clock()
+        self.pos = 0
+
+    def available(self) -> int:
+        """Number of bytes which have arrived, read or not
+        """
+        return int(np.searchsorted(self.arrivals, self.clock() - self.start, side="right"))
+
+    def arrival_time(self, offset: int) -> float:
+        """Time (on clock) the byte at offset arrived
+        """
+        return self.start + self.arrivals[offset]
+
+    @property
+    def in_waiting(self) -> int:
+        return self.available() - self.pos
+
+    def read(self, size: int = 1) -> bytes:
+        if self.in_waiting == 0:
+            # like a real port, wait for the next byte, or the whole timeout once there are none left
+            wait = self.arrival_time(self.pos) - self.clock() if self.pos < len(self.data) else self.timeout
+            self.sleep(min(self.timeout, max(0, wait)))
+
+        end = min(self.pos + size, self.available())
+        data = self.data[self.pos:end]
+        self.pos = max(self.pos, end)
+
+        return data
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+def acceleration_trace(seconds: float, rate: float = 100, gravity: tuple[float, float, float] = (0, 0, 1),
+                       noise: float = 0.005, shake: float = 0, seed: int = 0) -> np.ndarray:
+    """Makes a reproducible accelerometer trace
+
+    Args:
+        seconds (float): length of the trace
+        rate (float): samples a second
+        gravity (tuple[float, float, float]): acceleration at rest (g), i.e. which way up the sense hat is
+        noise (float): standard deviation of the sensor noise (g)
+        shake (float): standard deviation of the acceleration from being knocked about (g)
+        seed (int): seed of the random numbers
+
+    Returns:
+        np.ndarray: [samples, 3] array of x, y, z acceleration (g)
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * rate)
+
+    return np.asarray(gravity, dtype=float) + rng.normal(0, noise, (n, 3)) + rng.normal(0, shake, (n, 3))
+
+
+class FakeSenseHat:
+    """SenseHat stand in which plays back an accelerometer trace, one sample per read, and records what is shown on
+    the LED matrix.
+    """
+
+    def __init__(self, trace: np.ndarray, loop: bool = False):
+        """
+        Args:
+            trace (np.ndarray): [samples, 3] array of x, y, z acceleration (g), see acceleration_trace
+            loop (bool): start the trace again when it runs out, otherwise the last sample is repeated
+        """
+        self.trace = trace
+        self.loop = loop
+        self.reads = 0
+        self.shown = []
+
+    def get_accelerometer_raw(self) -> dict:
+        i = self.reads % len(self.trace) if self.loop else min(self.reads, len(self.trace) - 1)
+        self.reads += 1
+
+        x, y, z = self.trace[i]
+        return {"x": float(x), "y": float(y), "z": float(z)}
+
+    def show_letter(self, letter, text_colour=None, back_colour=None):
+        self.shown.append(letter)
+
+    def clear(self, *args):
+        self.shown.append(None)
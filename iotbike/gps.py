@@ -1,15 +1,91 @@
-import re
+import functools
+import operator
+
 import serial
 import time
 
+
+class NMEAParser:
+    """Incremental NMEA 0183 parser.
+
+    Bytes can be fed in any size of chunk: partial sentences are carried over to the next feed, and sentences with a
+    bad checksum (or garbage bytes) are dropped.
+    """
+
+    MAX_SENTENCE = 128  # longest partial sentence kept between feeds (NMEA sentences are at most 82 bytes)
+
+    def __init__(self):
+        self._partial = b""
+        self.checksum_errors = 0
+
+    def feed(self, data: bytes) -> list[list[str]]:
+        """Parses every complete sentence in data (and any partial sentence left from the last feed)
+
+        Args:
+            data (bytes): bytes read from the serial port
+
+        Returns:
+            list[list[str]]: fields of each valid sentence, oldest first. The first field is the type, e.g. "GNRMC"
+        """
+        *lines, self._partial = (self._partial + data).split(b"\n")
+
+        if len(self._partial) > self.MAX_SENTENCE:
+            # no newline for too long, only keep the start of the newest sentence
+            start = self._partial.rfind(b"$")
+            if start < 0 or len(self._partial) - start > self.MAX_SENTENCE:
+                start = len(self._partial)
+            self._partial = self._partial[start:]
+
+        sentences = []
+        for line in lines:
+            fields = self.parse_sentence(line)
+            if fields is not None:
+                sentences.append(fields)
+
+        return sentences
+
+    def parse_sentence(self, line: bytes) -> list[str]:
+        """Checks the checksum of a single sentence and splits it into fields
+
+        Args:
+            line (bytes): one line, e.g. b"$GNRMC,...*7C\r"
+
+        Returns:
+            list[str]: fields of the sentence, or None if it isn't a valid sentence
+        """
+        start = line.rfind(b"$")
+        if start < 0:
+            return None
+
+        body, star, checksum = line[start + 1:].rstrip(b"\r").partition(b"*")
+
+        try:
+            valid = star and int(checksum[:2], 16) == functools.reduce(operator.xor, body, 0)
+            text = body.decode("ascii")
+        except (ValueError, UnicodeDecodeError):
+            valid = False
+
+        if not valid:
+            self.checksum_errors += 1
+            return None
+
+        return text.split(",")
+
+
 class GPS:
 
     BUFFER_SIZE = 1024
 
-    def __init__(self, port="/dev/ttyACM0", baudrate=115200):
-        self.serial = serial.Serial(port, baudrate, timeout=1)
-        self.buffer = bytearray(self.BUFFER_SIZE)
-
+    def __init__(self, port="/dev/ttyACM0", baudrate=115200, serial_port=None):
+        """
+        Args:
+            port (str): serial port of the gps
+            baudrate (int): baud rate of the gps
+            serial_port (serial.Serial, optional): already open serial port (or anything with the same read,
+                in_waiting, is_open, and close), used instead of opening port
+        """
+        self.serial = serial_port if serial_port is not None else serial.Serial(port, baudrate, timeout=1)
+        self.parser = NMEAParser()
 
         if not self.serial.is_open:
             self.serial.open()
@@ -21,31 +97,59 @@ class GPS:
         self.n_s = ""
         self.e_w = ""
 
+        self.altitude = None # metres above mean sea level
+        self.satellites = None
+        self.hdop = None
+        self.speed = None # km/h
+        self.course = None # degrees from true north
+
     def update(self):
-        """Reads data from the serial port and saves data if useful
+        """Reads whatever is waiting on the serial port (blocking for at least one byte) and parses it.
+
+        Every complete sentence is applied in order, so the latest fix in the buffer is the one kept.
+
+        Returns:
+            bool: True if a sentence was parsed
         """
-        
-        self.buffer = self.serial.read(self.BUFFER_SIZE).decode("utf-8")
-        head = re.search(r'\$GPRMC|\$GNRMC', self.buffer)
+        data = self.serial.read(min(self.serial.in_waiting, self.BUFFER_SIZE) or 1)
+        sentences = self.parser.feed(data)
+
+        for fields in sentences:
+            self._apply(fields)
 
-        if head:
-            head_pos = head.start()
-            tail = self.buffer.find('\n', head_pos)
+        return len(sentences) > 0
 
-            if tail > head_pos:
-                raw_data = self.buffer[head_pos:tail]
+    def _apply(self, fields):
+        """Updates the gps data from the fields of one sentence
+        """
+        kind = fields[0][2:]
 
-                fields = raw_data.split(',')
-                
-                if len(fields) >= 7:
-                    self.utc_time = fields[1]
-                    self.useful = fields[2] == 'A'
-                    
-                    if self.useful:
-                        self.latitude, self.longitude = self._dm_to_dd(fields[3], fields[4], fields[5], fields[6])
+        try:
+            if kind == "RMC" and len(fields) >= 9:
+                self.utc_time = fields[1]
+                self.useful = fields[2] == 'A'
 
-                else:
-                    self.useful = False
+                if self.useful:
+                    self.latitude, self.longitude = self._dm_to_dd(fields[3], fields[4], fields[5], fields[6])
+                    self.n_s, self.e_w = fields[4], fields[6]
+                    self.speed = float(fields[7]) * 1.852 if fields[7] else self.speed
+                    self.course = float(fields[8]) if fields[8] else self.course
+
+            elif kind == "GGA" and len(fields) >= 10:
+                if fields[6] not in ("", "0"):
+                    self.satellites = int(fields[7]) if fields[7] else None
+                    self.hdop = float(fields[8]) if fields[8] else None
+                    self.altitude = float(fields[9]) if fields[9] else None
+
+            elif kind == "VTG" and len(fields) >= 8:
+                if fields[7]:
+                    self.speed = float(fields[7])
+                if fields[1]:
+                    self.course = float(fields[1])
+
+        except ValueError:
+            if kind == "RMC":
+                self.useful = False
 
     def get_latlong(self):
         return self.useful, (self.latitude, self.longitude)
@@ -76,13 +180,16 @@ class GPS:
         try:
             while True:
 
-                self.update()
+                if not self.update():
+                    continue
 
                 if self.useful:
                     print(f"***************************************************")
                     print(f"UTC Time: {self.utc_time}")
                     print(f"Latitude: {self.latitude}\n")
                     print(f"Longitude: {self.longitude}\n")
+                    print(f"Altitude: {self.altitude}, satellites: {self.satellites}, HDOP: {self.hdop}")
+                    print(f"Speed: {self.speed} km/h\n")
                     print(f"***************************************************\n")
                 else:
                     print(f"***************************************************")
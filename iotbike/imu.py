@@ -1,7 +1,9 @@
-
+import time
+from datetime import datetime
+from threading import Thread, Lock
 from time import sleep
 
-from sense_hat import SenseHat
+import numpy as np
 
 # class SenseHat:
 
@@ -12,47 +14,207 @@ from sense_hat import SenseHat
 #         return self.acceleration
 
 
-class IMU:
+class MotionWindow:
+    """Fixed size ring buffer of accelerometer samples, scored for motion every time a sample is added.
+
+    Gravity (and any tilt or offset of the sensor) is removed by subtracting the mean of the window, so a bike at rest
+    scores close to zero whichever way up it is. Samples are written in place at a moving index, and the jerk of each
+    sample (from the one before) is kept in a second ring alongside, so scoring never has to put the window in order.
+    """
+
+    def __init__(self, size: int = 50, rate: float = 100):
+        """
+        Args:
+            size (int): number of samples in the window
+            rate (float): rate (Hz) samples are added at, to scale the jerk to g/s
+        """
+        self.rate = rate
+        self.samples = np.zeros((size, 3))
+        self.count = 0
+
+        # squared jerk from the previous sample to the sample at the same index
+        self._jerks = np.zeros(size)
+
+        self._index = 0
+
+        self.rms = 0.0
+        self.jerk = 0.0
+
+    def append(self, sample: tuple[float, float, float]):
+        """Adds a sample and rescores the window
+
+        Args:
+            sample (tuple[float, float, float]): x, y, z acceleration (g)
+        """
+        sample = np.asarray(sample, dtype=float)
+        if self.count:
+            self._jerks[self._index] = np.sum(((sample - self.samples[self._index - 1]) * self.rate) ** 2)
+        else:
+            self._jerks[self._index] = 0
+
+        self.samples[self._index] = sample
+        self._index = (self._index + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+
+        self._score()
+
+    def window(self) -> np.ndarray:
+        """Gets the samples in the window, oldest first
+
+        Returns:
+            np.ndarray: [samples, 3] array of x, y, z acceleration (g)
+        """
+        if self.count < len(self.samples):
+            return self.samples[:self.count].copy()
+
+        return np.concatenate([self.samples[self._index:], self.samples[:self._index]])
+
+    def _score(self):
+        if self.count < 2:
+            self.rms, self.jerk = 0.0, 0.0
+            return
+
+        # in storage order, which doesn't matter to either score
+        window = self.samples[:self.count]
+        oldest = self._index if self.count == len(self.samples) else 0
 
-    def __init__(self):
-        self.sense = SenseHat()
+        # rms of the acceleration with the mean (gravity) removed, i.e. the standard deviation of the window
+        dynamic = window - window.mean(axis=0)
+        self.rms = float(np.sqrt(np.mean(np.sum(dynamic ** 2, axis=1))))
 
-        
+        # rms rate of change of the acceleration, which picks up knocks too short to move the rms much. The jerk of
+        # the oldest sample is from a sample which has left the window
+        jerks = self._jerks[:self.count].sum() - self._jerks[oldest]
+        self.jerk = float(np.sqrt(max(jerks, 0) / (self.count - 1)))
+
+
+class IMU:
+    """Samples the Sense HAT accelerometer in its own thread, at a fixed rate, into a MotionWindow.
+
+    The bike is moving if the rms or jerk of the window goes over its threshold, and stays moving for hold seconds
+    after, so short knocks aren't missed between frames. on_motion is called from the sampling thread whenever the
+    bike starts or stops moving.
+    """
+
+    def __init__(self, rate: float = 100, window: float = 0.5, rms_threshold: float = 0.05,
+                 jerk_threshold: float = 5.0, hold: float = 1.0, on_motion=None, sense=None):
+        """
+        Args:
+            rate (float): rate (Hz) to sample the accelerometer at
+            window (float): seconds of samples to score motion over
+            rms_threshold (float): rms acceleration (g), with gravity removed, over which the bike is moving
+            jerk_threshold (float): rms jerk (g/s) over which the bike is moving
+            hold (float): seconds the bike is still moving for after the thresholds were last crossed
+            on_motion (callable, optional): called with True when the bike starts moving, and False when it stops
+            sense (SenseHat, optional): sense hat (or anything with get_accelerometer_raw) to use instead of opening
+                one, e.g. a replay
+        """
+        if sense is None:
+            from sense_hat import SenseHat
+            sense = SenseHat()
+
+        self.sense = sense
+
+        self.rate = rate
+        self.rms_threshold = rms_threshold
+        self.jerk_threshold = jerk_threshold
+        self.hold = hold
+        self.on_motion = on_motion
+
+        self.motion = MotionWindow(max(2, int(rate * window)), rate)
+        self.timestamp = None
+        self._moving_until = 0
+        self._moving = False
+
+        self._lock = Lock()
+        self.stopped = False
+        self.thread = Thread(target=self._update, name="IMU", daemon=True)
 
         self.update_data()
 
-    def update_data(self):
+    def start(self):
+        """Starts thread
+        """
+        self.thread.start()
+
+    def stop(self):
+        """Stops the while loop in the update function
+        """
+        self.stopped = True
+
+    def _update(self):
+        """This runs continuously in the thread. Samples the accelerometer at rate
+        """
+        period = 1. / self.rate
+        next_sample = time.time()
+
+        while not self.stopped:
+            try:
+                self.update_data()
+            except Exception as e:
+                print(f"{datetime.now().isoformat()} Error reading IMU: {e}")
+
+            # sample on a fixed schedule, rather than sleeping a fixed time after each sample
+            next_sample += period
+            wait = next_sample - time.time()
+            if wait > 0:
+                sleep(wait)
+            else:
+                next_sample = time.time()
 
+    def update_data(self):
+        """Reads a sample from the accelerometer and rescores motion
+        """
         acceleration = self.sense.get_accelerometer_raw()
 
-        self.x = acceleration['x']
-        self.y = acceleration['y']
-        self.z = acceleration['z']
+        with self._lock:
+            self.x = acceleration['x']
+            self.y = acceleration['y']
+            self.z = acceleration['z']
+            self.timestamp = time.time()
+
+            self.motion.append((self.x, self.y, self.z))
+
+            if self.motion.rms > self.rms_threshold or self.motion.jerk > self.jerk_threshold:
+                self._moving_until = self.timestamp + self.hold
+
+            moving = self.timestamp < self._moving_until
+            changed = moving != self._moving
+            self._moving = moving
+
+        if changed and self.on_motion is not None:
+            self.on_motion(moving)
 
     def get_data(self):
 
         return self.x, self.y, self.z
 
-    def is_moving(self):
-        if abs(self.x) > 1 or abs(self.y) > 1 or abs(self.z) > 1:
-            self.sense.show_letter("!",(255, 0, 0))
-            return True
-        else:
-            self.sense.clear()
-            return False
+    def get_score(self) -> dict:
+        """Gets the latest motion score
+
+        Returns:
+            dict: rms acceleration (g) and rms jerk (g/s) over the window
+        """
+        with self._lock:
+            return {"rms": self.motion.rms, "jerk": self.motion.jerk}
+
+    def is_moving(self) -> bool:
+        """Whether the bike is moving, from the latest motion score. Doesn't touch the hardware
+
+        Returns:
+            bool: True if the bike is moving
+        """
+        return time.time() < self._moving_until
 
     #def __del__(self):
      #   self.sense.clear()
-        
+
 if __name__=="__main__":
-    
+
     imu=IMU()
+    imu.start()
     while True:
         sleep(1)
-        imu.update_data()
         print(imu.get_data())
+        print(imu.get_score())
         print(imu.is_moving())
-        
-    
-
-
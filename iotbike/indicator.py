@@ -0,0 +1,104 @@
+import time
+from datetime import datetime
+from threading import Thread, Condition
+
+# what to show for each state, highest priority first. The matrix is cleared when none are on
+DISPLAYS = (
+    ("moving", "!", (255, 0, 0)),
+    ("sentry", "S", (0, 0, 255)),
+)
+
+
+class StatusIndicator:
+    """Shows the state of the bike on the Sense HAT LED matrix.
+
+    States can be set from any thread without touching the hardware. The matrix is only written from the
+    indicator's own thread, when what it should show changes, and at most max_rate times a second.
+    """
+
+    def __init__(self, sense, max_rate: float = 2):
+        """
+        Args:
+            sense (SenseHat): sense hat to draw on
+            max_rate (float): most times a second the matrix is written to
+        """
+        self.sense = sense
+        self.max_rate = max_rate
+
+        self.states = {name: False for name, _, _ in DISPLAYS}
+        self.shown = None
+        self.writes = 0
+
+        self._changed = Condition()
+        self.stopped = False
+        self.thread = Thread(target=self._update, name="StatusIndicator", daemon=True)
+
+    def set(self, state: str, on: bool):
+        """Turns a state on or off. Cheap, the matrix is updated in the background
+
+        Args:
+            state (str): one of the states in DISPLAYS, e.g. "moving"
+            on (bool): whether the state is on
+        """
+        with self._changed:
+            if self.states[state] != bool(on):
+                self.states[state] = bool(on)
+                self._changed.notify()
+
+    def start(self):
+        """Starts thread
+        """
+        self.thread.start()
+
+    def stop(self):
+        """Stops the while loop in the update function, and clears the matrix
+        """
+        with self._changed:
+            self.stopped = True
+            self._changed.notify()
+
+    def _display(self) -> str:
+        """Name of the highest priority state which is on, None if none are. Call with the lock held
+        """
+        return next((name for name, _, _ in DISPLAYS if self.states[name]), None)
+
+    def _update(self):
+        """This runs continuously in the thread.
+        """
+        prev = 0
+
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self.stopped or self._display() != self.shown)
+                if self.stopped:
+                    break
+
+            # cap the rate, then show whatever the state is by then
+            wait = 1. / self.max_rate - (time.time() - prev)
+            if wait > 0:
+                time.sleep(wait)
+            prev = time.time()
+
+            with self._changed:
+                display = self._display()
+
+            try:
+                self._write(display)
+            except Exception as e:
+                print(f"{datetime.now().isoformat()} Error writing to the LED matrix: {e}")
+                time.sleep(1)
+
+        try:
+            self._write(None)
+        except Exception:
+            pass
+
+    def _write(self, display: str):
+        if display is None:
+            self.sense.clear()
+        else:
+            _, letter, colour = next(d for d in DISPLAYS if d[0] == display)
+            self.sense.show_letter(letter, colour)
+
+        self.shown = display
+        self.writes += 1
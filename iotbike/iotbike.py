@@ -1,31 +1,56 @@
 
-import requests
+import asyncio
 import time
 import cv2
-import base64
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from math import radians, cos, sin, sqrt, atan2
+from threading import Thread
 
+from iotbike import apiclient
+from iotbike import motion
 from iotbike import objectdetection
+from iotbike import pipeline
 from iotbike import sensorhandler
 
-def api_post(data, suffix, url="http://joehartley.pythonanywhere.com"):
-    
-    response = requests.post(url + suffix, json=data)
+_client = None
 
-    if not(response.ok):
-        raise Exception(f"{datetime.now().isoformat()} Error posting data to the api: {response.text}")
-    else:
-        return response.json()
 
-def api_get(suffix, url="http://joehartley.pythonanywhere.com"):
-    
-    response = requests.get(url + suffix)
+def configure_api(base_url=apiclient.API_URL, **kwargs):
+    """Replaces the client shared by api_post and api_get
+
+    Args:
+        base_url (str): url of the api
+        **kwargs: passed on to ApiClient (bike_id, timeout, retries, backoff_factor, pool_size)
+    """
+    global _client
+
+    if _client is not None:
+        _client.close()
+    _client = apiclient.ApiClient(base_url, **kwargs)
+
+    return _client
+
+
+def get_client():
+    """Gets the client shared by api_post and api_get, creating it if needed
+    """
+    if _client is None:
+        configure_api()
+    return _client
 
-    if not(response.ok):
-        raise Exception(f"{datetime.now().isoformat()} Error getting data from the api: {response.text}")
-    else:
-        return response.json()
+
+def bike_path(resource=""):
+    """Gets the path of one of this bike's resources on the api, e.g. bike_path("/alerts")
+    """
+    return get_client().bike_path(resource)
+
+
+def api_post(data, suffix):
+    return get_client().post(data, suffix)
+
+def api_get(suffix):
+    return get_client().get(suffix)
 
 def log(message):
     print(f"{datetime.now().isoformat()} {message}")
@@ -49,95 +74,562 @@ def is_outside_tolerance(coord1, coord2, tolerance=10):
     return distance > tolerance
 
 
-def main(source=0, pi=True):
+class ChangeTracker:
+    """Works out which fields of a dict have changed since they were last sent to the api.
+
+    Coordinates only count as changed once they move further than distance. Every heartbeat seconds, the whole state
+    is sent even when nothing has changed, so that last_updated on the api stays fresh, and an api which has
+    restarted (and lost the state) gets all of it back.
+    """
+
+    def __init__(self, distance=10, heartbeat=None):
+        """
+        Args:
+            distance (float): distance (metres) the latitude and longitude have to move to be resent
+            heartbeat (float, optional): seconds between uploads when nothing has changed. Never sent if None
+        """
+        self.distance = distance
+        self.heartbeat = heartbeat
+
+        self.sent = {}
+        self.last_sent = None
+
+    def changes(self, data):
+        """Gets the fields of data which need to be sent
+
+        Args:
+            data (dict): current state
+
+        Returns:
+            dict | None: changed fields (all of them for a heartbeat), or None if nothing needs to be sent
+        """
+        changed = {key: value for key, value in data.items()
+                   if key not in ("latitude", "longitude") and (key not in self.sent or self.sent[key] != value)}
+
+        if "latitude" in data or "longitude" in data:
+            coord = (data.get("latitude"), data.get("longitude"))
+            sent_coord = (self.sent.get("latitude"), self.sent.get("longitude"))
+
+            if "latitude" not in self.sent or None in coord or None in sent_coord:
+                moved = coord != sent_coord
+            else:
+                moved = is_outside_tolerance(sent_coord, coord, self.distance)
+
+            if moved:
+                changed["latitude"], changed["longitude"] = coord
+
+        if changed:
+            return changed
+        elif self.heartbeat is not None and (self.last_sent is None or
+                                             time.time() - self.last_sent >= self.heartbeat):
+            return dict(data)
+        else:
+            return None
+
+    def commit(self, changes):
+        """Records that changes have been sent
+
+        Args:
+            changes (dict): output of changes() which was successfully sent
+        """
+        self.sent.update(changes)
+        self.last_sent = time.time()
+
+
+def _post_changes(tracker, data, suffix):
+    """Posts only the fields of data which have changed since the last post
+
+    Returns:
+        bool: whether anything was posted
+    """
+    changes = tracker.changes(data)
+
+    if changes is None:
+        return False
+
+    api_post(changes, suffix)
+    tracker.commit(changes)
+
+    return True
+
+
+class SentryWatcher:
+    """Follows sentry mode on the api in the background, using the /api/bike/sentry long poll.
+
+    The api holds each request open until sentry mode changes (or the poll times out), so toggles arrive as soon as
+    they happen without polling in the main loop.
+    """
+
+    def __init__(self, poll_timeout=25, retry_delay=5, on_change=None):
+        """
+        Args:
+            poll_timeout (float): seconds the api holds each poll open for
+            retry_delay (float): seconds to wait before polling again after an error
+            on_change (callable, optional): called with the new sentry mode whenever it changes
+        """
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.on_change = on_change
+
+        self.sentry_mode = False
+        self.version = -1
+        self.stopped = False
+
+        self.thread = Thread(target=self._update, name="SentryWatcher", daemon=True)
+
+    def start(self):
+        """Gets the current sentry mode, then starts following changes in a thread
+        """
+        self._poll(timeout=0)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the while loop in the update function
+        """
+        self.stopped = True
+
+    def _poll(self, timeout):
+        client = get_client()
+        response = client.get(client.bike_path("/sentry"), params={"since": self.version, "timeout": timeout},
+                              timeout=(client.timeout[0], timeout + client.timeout[1]))
+
+        sentry_mode = bool(response["sentry_mode"])
+        changed = sentry_mode != self.sentry_mode
+
+        if changed:
+            log(f"Sentry mode changed to {sentry_mode}")
+
+        self.sentry_mode = sentry_mode
+        self.version = response["version"]
+
+        if changed and self.on_change is not None:
+            self.on_change(sentry_mode)
+
+    def _update(self):
+        """This runs continuously in the thread.
+        """
+        while not self.stopped:
+            try:
+                self._poll(self.poll_timeout)
+            except Exception as e:
+                log(f"Error following sentry mode: {e}")
+                time.sleep(self.retry_delay)
+
+
+class SentryMonitor:
+    """Keeps track of the alert flags between frames.
+
+    Flags are only raised while in sentry mode and are cleared when sentry mode is turned off.
+    """
+
+    def __init__(self, tolerance=10):
+        self.tolerance = tolerance
+        self.saved_coord = (None, None)
+
+        self.movement_flag = False
+        self.object_flag = False
+        self.coord_flag = False
+
+        self.people_counter = 0
+
+    def update(self, sensor_data, sentry_mode, num_people):
+        """Updates the flags with the latest sensor data and detection
+
+        Args:
+            sensor_data (dict): output of SensorHandler.read()
+            sentry_mode (bool): whether sentry mode is on
+            num_people (int): number of objects found in the frame, or None if the detector wasn't run on it
+
+        Returns:
+            bool: True if the frame should be uploaded to the api
+        """
+        coord = (sensor_data["latitude"], sensor_data["longitude"])
+
+        if sentry_mode and not all(self.saved_coord):
+            self.saved_coord = coord # saves current coordinate
+        elif sentry_mode and is_outside_tolerance(self.saved_coord, coord, self.tolerance):
+            self.coord_flag = True
+        elif not sentry_mode:
+            self.saved_coord = (None, None)
+            self.coord_flag = False
+
+        if num_people is None:
+            # skipped by the motion gate, so the people counter carries on from the last detection
+            upload_frame = False
+        else:
+            upload_frame = num_people > 0 and sentry_mode
+
+            if upload_frame:
+                self.people_counter += 1
+            else:
+                self.people_counter = 0
+
+        if self.people_counter >= 2 and sentry_mode:
+            self.object_flag = True
+        elif not sentry_mode:
+            self.object_flag = False
+
+        if sensor_data["is_moving"] and sentry_mode:
+            self.movement_flag = True
+        elif not sentry_mode:
+            self.movement_flag = False
+
+        return upload_frame
+
+    @property
+    def flags(self):
+        return {
+            "movement_flag": self.movement_flag,
+            "object_flag": self.object_flag,
+            "coord_flag": self.coord_flag
+        }
+
+
+def _upload_initial(sensor_data, monitor, status_tracker, flags_tracker):
+    """Uploads the starting bike status and flags to the api, and records them as sent, so the loop only sends what
+    changes after
+    """
+    log("Uploading initial data to api")
+
+    # sentry mode isn't sent: it is set from the dashboard, and SentryWatcher reads it from the api
+    bike_status = {
+        "latitude": sensor_data["latitude"], 
+        "longitude": sensor_data["longitude"],
+        "objects": None
+    }
+    log(f"Initial data being sent: {bike_status}")
+    api_post(bike_status, bike_path())
+    status_tracker.commit(bike_status)
+
+    flags = monitor.flags
+    log(f"Initial flags being send: {flags}")
+    api_post(flags, bike_path("/alerts"))
+    flags_tracker.commit(flags)
+
+
+def _make_gate(motion_threshold, max_skip):
+    """Makes the motion gate for the bike loop, or None to run the detector on every frame
+    """
+    if not motion_threshold:
+        return None
+
+    return motion.MotionGate(threshold=motion_threshold, max_skip=max_skip)
+
+
+def _upload_frame(frame):
+    """JPEG encodes a frame and uploads it to the api
+    """
+    ret, buffer = cv2.imencode(".jpg", frame)
+    get_client().post_image(buffer.tobytes(), bike_path("/image"))
+
+
+def main(source=0, pi=True, status_distance=10, heartbeat=30, buffer_pool=0, motion_threshold=0.005, max_skip=30,
+         input_size=416, target_fps=None, roi=None, replay=None, replay_speed=1.0, record=None):
+    sensors = None
+    sentry = None
 
     try:
         
         log("Initialising sensors and object detector")
 
-        detector = objectdetection.ObjectDetection()
+        detector = objectdetection.ObjectDetection(input_size=input_size, target_fps=target_fps)
 
-        sensors = sensorhandler.SensorHandler(src=int(source), pi=pi)
+        sensors = sensorhandler.SensorHandler(src=int(source), pi=pi, buffer_pool=buffer_pool, replay=replay,
+                                              replay_speed=replay_speed, record=record)
         sensors.start()
         sensor_data = sensors.read()
+        sensors.release(sensor_data)
 
-        saved_coord = (None, None)
+        monitor = SentryMonitor()
+        status_tracker = ChangeTracker(distance=status_distance, heartbeat=heartbeat)
+        flags_tracker = ChangeTracker(heartbeat=heartbeat)
+        _upload_initial(sensor_data, monitor, status_tracker, flags_tracker)
 
-        log("Uploading initial data to api")
+        sentry = SentryWatcher(on_change=sensors.show_sentry_mode)
+        sentry.start()
 
-        sentry_mode = False
-
-        movement_flag = False
-        object_flag = False
-        coord_flag = False
-
-        bike_status = {
-            "sentry_mode": sentry_mode, 
-            "latitude": sensor_data["latitude"], 
-            "longitude": sensor_data["longitude"],
-            "objects": None
-        }
-        log(f"Initial data being sent: {bike_status}")
-        api_post(bike_status, "/api/bike")
-
-        flags = {
-            "movement_flag": movement_flag,
-            "object_flag": object_flag,
-            "coord_flag": coord_flag
-        }
-        log(f"Initial flags being send: {flags}")
-        api_post(flags, "/api/alerts")
+        gate = _make_gate(motion_threshold, max_skip)
 
         log("Initialisation completed, now entering loop")
 
-        people_counter = 0
+        frame_id = 0
+        num_people = None
 
         close_flag = True
         while close_flag:
 
-            sensor_data = sensors.read()
-            bike_status = api_get("/api/bike")["bike_status"]
-            sentry_mode = bool(bike_status["sentry_mode"])
+            # never run the detector on the same frame twice
+            sensor_data = sensors.read_newer(frame_id, timeout=1)
+            if sensor_data is None:
+                if sensors.ended:
+                    log("Camera has ended, e.g. the replay finished, stopping")
+                    break
+                continue
+            frame_id = sensor_data["frame_id"]
+            sentry_mode = sentry.sentry_mode
+
+            # only run the detector on frames which have changed
+            detected = gate is None or gate.check(sensor_data["frame"], sensor_data["is_moving"])
+            if detected:
+                detection_output = detector.detect_filtered(sensor_data["frame"], 0.9, roi)
+                num_people = detection_output.get_objects()
+
+            if monitor.update(sensor_data, sentry_mode, num_people if detected else None):
+                # drawn on a copy, as the frame is shared with anything else reading the sensors
+                _upload_frame(detection_output.draw_boxes(copy=True))
+
+                log(f"Found {num_people} people in current frame -- uploaded frame to api")
 
-            if sentry_mode and not all(saved_coord):
-                saved_coord = (sensor_data["latitude"], sensor_data["longitude"]) # saves current coordinate
-            elif sentry_mode and is_outside_tolerance(saved_coord, (sensor_data["latitude"], sensor_data["longitude"])):
-                coord_flag = True 
-            elif not sentry_mode:
-                saved_coord = (None, None)
-                coord_flag = False
+            sensors.release(sensor_data)
 
-            detection_output = detector.detect_filtered(sensor_data["frame"], 0.9)
-            num_people = detection_output.get_objects()
+            flags = monitor.flags
+            bike_status = {
+                "latitude": sensor_data["latitude"], 
+                "longitude": sensor_data["longitude"],
+                "objects": num_people
+            }
 
-            if num_people > 0 and sentry_mode:
-                # object_flag = True
-                people_counter += 1
+            log(f"Flags: {flags}")
+            log(f"Status: {bike_status}")
 
-                capture_frame = detection_output.draw_boxes()
-                ret, buffer = cv2.imencode(".jpg", capture_frame)
-                api_post({"image": base64.b64encode(buffer)}, "/api/image")
+            _post_changes(status_tracker, bike_status, bike_path())
+            _post_changes(flags_tracker, flags, bike_path("/alerts"))
 
-                log(f"Found {num_people} people in current frame -- uploaded frame to api")
+            if detected:
+                log(f"Frame {frame_id} done {time.time() - sensor_data['frame_time']:.3f}s after capture")
             else:
-                # object_flag = False
-                people_counter = 0
-
-            if people_counter >= 2 and sentry_mode:
-                object_flag = True
-            elif not sentry_mode:
-                object_flag = False
-
-            if sensor_data["is_moving"] and sentry_mode:
-                movement_flag = True
-            elif not sentry_mode:
-                movement_flag = False
-
-            flags = {
-                "movement_flag": movement_flag,
-                "object_flag": object_flag,
-                "coord_flag": coord_flag
+                log(f"Frame {frame_id} skipped, {gate.changed:.1%} of it changed")
+
+    finally:
+        if sentry is not None:
+            sentry.stop()
+        if sensors is not None:
+            sensors.stop()
+
+
+def main_pipelined(source=0, pi=True, capture_rate=30, queue_size=2, stats_interval=10, status_distance=10,
+                   heartbeat=30, buffer_pool=0, motion_threshold=0.005, max_skip=30, input_size=416, target_fps=None,
+                   roi=None, replay=None, replay_speed=1.0, record=None):
+    """Runs the bike loop as a pipeline of capture -> inference -> upload stages.
+
+    Each stage runs in its own thread at its own rate, connected by bounded queues which drop the oldest item when
+    full. The detector is never left waiting for the network.
+
+    Args:
+        source (int): webcam index, if not using the pi camera
+        pi (bool): if running on the raspberry pi
+        capture_rate (float): maximum rate (Hz) that sensor data is read at
+        queue_size (int): size of the queues between stages
+        stats_interval (float): seconds between logging the pipeline stats
+        status_distance (float): distance (metres) the bike has to move before its coordinates are resent
+        heartbeat (float): seconds between uploads of the whole status and flags, even when nothing has changed
+        buffer_pool (int): number of preallocated frame buffers to capture into, 0 to allocate every frame
+        motion_threshold (float): fraction of a frame which has to change for the detector to run on it, 0 to run
+            it on every frame
+        max_skip (int): most frames the detector skips in a row
+        input_size (int): input size (pixels) of the detector
+        target_fps (float, optional): frame rate the detector adapts its input size to keep up with
+        roi (tuple[int, int, int, int], optional): x, y, width, height of the region of the frame to detect in
+        replay (str, optional): directory of a recording to play back instead of using the camera and sensors
+        replay_speed (float): playback speed of the replay, 0 for as fast as possible
+        record (str, optional): directory to record the camera and sensors to
+    """
+    sensors = None
+    sentry = None
+    stages = None
+
+    try:
+
+        log("Initialising sensors and object detector")
+
+        detector = objectdetection.ObjectDetection(input_size=input_size, target_fps=target_fps)
+
+        sensors = sensorhandler.SensorHandler(src=int(source), pi=pi, buffer_pool=buffer_pool, replay=replay,
+                                              replay_speed=replay_speed, record=record)
+        sensors.start()
+
+        sensor_data = sensors.read()
+        sensors.release(sensor_data)
+
+        monitor = SentryMonitor()
+        status_tracker = ChangeTracker(distance=status_distance, heartbeat=heartbeat)
+        flags_tracker = ChangeTracker(heartbeat=heartbeat)
+        _upload_initial(sensor_data, monitor, status_tracker, flags_tracker)
+
+        sentry = SentryWatcher(on_change=sensors.show_sentry_mode)
+        sentry.start()
+
+        gate = _make_gate(motion_threshold, max_skip)
+
+        state = {"frame_id": 0, "latency": None, "num_people": None}
+
+        def capture():
+            # only pass on new frames, so the detector never sees the same frame twice
+            sensor_data = sensors.read_newer(state["frame_id"], timeout=1)
+
+            if sensor_data is not None:
+                state["frame_id"] = sensor_data["frame_id"]
+            elif sensors.ended:
+                # read_newer returns straight away once the camera has ended, so wait to be stopped instead of spinning
+                time.sleep(0.1)
+
+            return sensor_data
+
+        def infer(sensor_data):
+            try:
+                # only run the detector on frames which have changed
+                detected = gate is None or gate.check(sensor_data["frame"], sensor_data["is_moving"])
+                if detected:
+                    detection_output = detector.detect_filtered(sensor_data["frame"], 0.9, roi)
+                    state["num_people"] = detection_output.get_objects()
+                num_people = state["num_people"]
+
+                upload_frame = monitor.update(sensor_data, sentry.sentry_mode, num_people if detected else None)
+
+                # drawn on a copy, as the frame is shared with anything else reading the sensors, and a pooled frame
+                # is captured into again once it is released
+                frame = detection_output.draw_boxes(copy=True) if upload_frame else None
+            finally:
+                sensors.release(sensor_data)
+
+            return {
+                "frame": frame,
+                "frame_time": sensor_data["frame_time"],
+                "flags": monitor.flags,
+                "bike_status": {
+                    "latitude": sensor_data["latitude"], 
+                    "longitude": sensor_data["longitude"],
+                    "objects": num_people
+                }
             }
+
+        def upload(result):
+            if result["frame"] is not None:
+                _upload_frame(result["frame"])
+                log(f"Found {result['bike_status']['objects']} people in current frame -- uploaded frame to api")
+
+            _post_changes(status_tracker, result["bike_status"], bike_path())
+            _post_changes(flags_tracker, result["flags"], bike_path("/alerts"))
+
+            state["latency"] = time.time() - result["frame_time"]
+
+        stages = pipeline.Pipeline()
+        stages.add_stage("capture", capture, rate=capture_rate)
+        stages.add_stage("inference", infer, queue_size=queue_size, on_drop=sensors.release)
+        stages.add_stage("upload", upload, queue_size=queue_size)
+
+        log("Initialisation completed, now starting pipeline")
+        stages.start()
+
+        while stages.is_alive():
+            time.sleep(stats_interval)
+            log(f"Pipeline stats: {stages.stats()}, capture to upload latency: {state['latency']}")
+            if gate is not None:
+                log(f"Motion gate stats: {gate.stats()}")
+            log(f"Detector input size: {detector.input_size}")
+
+            if sensors.ended:
+                # the queues have had stats_interval to drain
+                log("Camera has ended, e.g. the replay finished, stopping")
+                break
+
+    finally:
+        if stages is not None:
+            stages.stop()
+        if sentry is not None:
+            sentry.stop()
+        if sensors is not None:
+            sensors.stop()
+
+
+async def main_async(source=0, pi=True, status_distance=10, heartbeat=30, buffer_pool=0, motion_threshold=0.005,
+                     max_skip=30, input_size=416, target_fps=None, roi=None, replay=None, replay_speed=1.0,
+                     record=None):
+    """Runs the bike loop with asyncio, so that api calls are made concurrently instead of one after another.
+
+    Detection runs in an executor, so the event loop is not blocked, and the status, flags, and image uploads of one
+    frame run concurrently with the detection of the next.
+
+    Args:
+        source (int): webcam index, if not using the pi camera
+        pi (bool): if running on the raspberry pi
+        status_distance (float): distance (metres) the bike has to move before its coordinates are resent
+        heartbeat (float): seconds between uploads of the whole status and flags, even when nothing has changed
+        buffer_pool (int): number of preallocated frame buffers to capture into, 0 to allocate every frame
+        motion_threshold (float): fraction of a frame which has to change for the detector to run on it, 0 to run
+            it on every frame
+        max_skip (int): most frames the detector skips in a row
+        input_size (int): input size (pixels) of the detector
+        target_fps (float, optional): frame rate the detector adapts its input size to keep up with
+        roi (tuple[int, int, int, int], optional): x, y, width, height of the region of the frame to detect in
+        replay (str, optional): directory of a recording to play back instead of using the camera and sensors
+        replay_speed (float): playback speed of the replay, 0 for as fast as possible
+        record (str, optional): directory to record the camera and sensors to
+    """
+    loop = asyncio.get_running_loop()
+    detector_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detector")
+    sensors = None
+    sentry = None
+    uploads = None
+
+    try:
+
+        log("Initialising sensors and object detector")
+
+        detector = objectdetection.ObjectDetection(input_size=input_size, target_fps=target_fps)
+
+        sensors = sensorhandler.SensorHandler(src=int(source), pi=pi, buffer_pool=buffer_pool, replay=replay,
+                                              replay_speed=replay_speed, record=record)
+        sensors.start()
+
+        sensor_data = sensors.read()
+        sensors.release(sensor_data)
+
+        monitor = SentryMonitor()
+        status_tracker = ChangeTracker(distance=status_distance, heartbeat=heartbeat)
+        flags_tracker = ChangeTracker(heartbeat=heartbeat)
+        await asyncio.to_thread(_upload_initial, sensor_data, monitor, status_tracker, flags_tracker)
+
+        sentry = SentryWatcher(on_change=sensors.show_sentry_mode)
+        await asyncio.to_thread(sentry.start)
+
+        gate = _make_gate(motion_threshold, max_skip)
+
+        log("Initialisation completed, now entering loop")
+
+        frame_id = 0
+        num_people = None
+
+        close_flag = True
+        while close_flag:
+
+            # never run the detector on the same frame twice
+            sensor_data = await asyncio.to_thread(sensors.read_newer, frame_id, 1)
+            if sensor_data is None:
+                if sensors.ended:
+                    log("Camera has ended, e.g. the replay finished, stopping")
+                    break
+                continue
+            frame_id = sensor_data["frame_id"]
+
+            try:
+                # only run the detector on frames which have changed
+                detected = gate is None or gate.check(sensor_data["frame"], sensor_data["is_moving"])
+                if detected:
+                    detection_output = await loop.run_in_executor(detector_executor, detector.detect_filtered,
+                                                                  sensor_data["frame"], 0.9, roi)
+                    num_people = detection_output.get_objects()
+                sentry_mode = sentry.sentry_mode
+
+                upload_frame = monitor.update(sensor_data, sentry_mode, num_people if detected else None)
+
+                # drawn on a copy, as the frame is shared with anything else reading the sensors, and the upload runs
+                # after a pooled frame has been released
+                frame = detection_output.draw_boxes(copy=True) if upload_frame else None
+            finally:
+                sensors.release(sensor_data)
+
+            flags = monitor.flags
             bike_status = {
                 "latitude": sensor_data["latitude"], 
                 "longitude": sensor_data["longitude"],
@@ -147,11 +639,38 @@ def main(source=0, pi=True):
             log(f"Flags: {flags}")
             log(f"Status: {bike_status}")
 
-            api_post(bike_status, "/api/bike")
-            api_post(flags, "/api/alerts")
+            # only one frame's uploads in flight at a time
+            if uploads is not None:
+                await uploads
+
+            calls = [
+                asyncio.to_thread(_post_changes, status_tracker, bike_status, bike_path()),
+                asyncio.to_thread(_post_changes, flags_tracker, flags, bike_path("/alerts"))
+            ]
+            if upload_frame:
+                calls.append(asyncio.to_thread(_upload_frame, frame))
+                log(f"Found {num_people} people in current frame -- uploading frame to api")
+
+            uploads = asyncio.gather(*calls)
 
     finally:
-        sensors.stop()
+        if uploads is not None:
+            uploads.cancel()
+            await asyncio.gather(uploads, return_exceptions=True)
+        if sentry is not None:
+            sentry.stop()
+        if sensors is not None:
+            sensors.stop()
+        detector_executor.shutdown(wait=False)
+
+
+def run_async(source=0, pi=True, **kwargs):
+    """Runs main_async in a new event loop
+
+    Args:
+        **kwargs: passed on to main_async
+    """
+    asyncio.run(main_async(source=source, pi=pi, **kwargs))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+import cv2 as cv
+import numpy as np
+
+
+class MotionGate:
+    """Cheap check for whether a frame has changed enough to be worth running the detector on.
+
+    Each frame is shrunk, converted to grayscale, and compared against a running average of the previous frames.
+    A frame passes the gate if enough of its pixels have changed, if the bike is moving, or if max_skip frames in a
+    row have been skipped.
+    """
+
+    def __init__(self, threshold: float = 0.005, pixel_delta: int = 25, width: int = 160, alpha: float = 0.05,
+                 max_skip: int = 30):
+        """
+        Args:
+            threshold (float): fraction of pixels which have to change for a frame to pass
+            pixel_delta (int): difference in brightness (0-255) for a pixel to count as changed
+            width (int): width (pixels) frames are shrunk to before comparing
+            alpha (float): weight of each new frame in the running average
+            max_skip (int): most frames skipped in a row before one is let through anyway
+        """
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.alpha = alpha
+        self.max_skip = max_skip
+
+        self._background = None
+
+        self.changed = 1.0
+        self.skipped = 0
+        self.passed = 0
+        self.total_skipped = 0
+
+    def _prepare(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        small = cv.resize(frame, (self.width, max(1, height * self.width // width)), interpolation=cv.INTER_AREA)
+
+        if small.ndim == 3:
+            small = cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+
+        return cv.GaussianBlur(small, (5, 5), 0)
+
+    def check(self, frame: np.ndarray, is_moving: bool = False) -> bool:
+        """Compares a frame with the background and adds it to the background
+
+        Args:
+            frame (np.ndarray): frame from the camera
+            is_moving (bool): whether the imu says the bike is moving
+
+        Returns:
+            bool: True if the detector should be run on the frame
+        """
+        gray = self._prepare(frame)
+
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            self.changed = 1.0
+        else:
+            diff = cv.absdiff(gray, cv.convertScaleAbs(self._background))
+            self.changed = np.count_nonzero(diff > self.pixel_delta) / diff.size
+            cv.accumulateWeighted(gray, self._background, self.alpha)
+
+        if self.changed >= self.threshold or is_moving or self.skipped >= self.max_skip:
+            self.skipped = 0
+            self.passed += 1
+            return True
+
+        self.skipped += 1
+        self.total_skipped += 1
+        return False
+
+    def reset(self):
+        """Forgets the background, so the next frame always passes
+        """
+        self._background = None
+        self.skipped = 0
+
+    def stats(self) -> dict:
+        """Gets the number of frames passed and skipped
+
+        Returns:
+            dict: frames passed, frames skipped, and the fraction of pixels changed in the last frame
+        """
+        return {"passed": self.passed, "skipped": self.total_skipped, "changed": self.changed}
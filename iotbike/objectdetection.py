@@ -1,7 +1,9 @@
 from __future__ import print_function, unicode_literals
 
+import functools
 import importlib.resources
 from pathlib import Path
+from types import MappingProxyType
 from queue import Queue, Full
 
 import cv2 as cv
@@ -10,6 +12,12 @@ import time
 
 from iotbike.sensorhandler import SensorHandler
 
+# input sizes (pixels) the network can be run at, smallest first. YOLO needs multiples of 32
+INPUT_SIZES = (320, 416, 608)
+
+# overlap (IoU) over which non maximum suppression drops the less confident box
+NMS_THRESHOLD = 0.2
+
 
 def _get_model_files(directory: str) -> tuple[str, str, str]:
     """
@@ -37,6 +45,27 @@ def _get_model_files(directory: str) -> tuple[str, str, str]:
 
     return model, config, framework
 
+@functools.lru_cache(maxsize=None)
+def _load_class_names() -> tuple[str, ...]:
+    """Reads the COCO class names from the resource subfolder. Only read from disk once per process.
+
+    Returns:
+        tuple[str, ...]: class names, indexed by class ID
+    """
+    names_file = importlib.resources.files("iotbike") / "resources/coco.names"
+    with importlib.resources.as_file(names_file) as f:
+        with open(f) as names:
+            return tuple(names.read().strip().split("\n"))
+
+@functools.lru_cache(maxsize=None)
+def _load_class_index() -> MappingProxyType:
+    """Read-only lookup from COCO class name to class ID, built once per process.
+
+    Returns:
+        MappingProxyType: class name to class ID
+    """
+    return MappingProxyType({name: i for i, name in enumerate(_load_class_names())})
+
 def _yolo_to_coco(x: float, y: float, w: float, h: float) -> tuple[int, int, int, int]:
     """Takes YOLO bounding box format [x_center, y_center, width, height] and outputs COCO bounding box format [x_min, y_min, width, height]
 
@@ -66,6 +95,21 @@ def _voc_to_coco(x_min: float, y_min: float, x_max: float, y_max: float) -> tupl
     """
     return int(x_min), int(y_min), int(x_max - x_min), int(y_max - y_min)
 
+def _clip_roi(roi: tuple[int, int, int, int], shape: tuple[int, ...]) -> tuple[int, int, int, int]:
+    """Clips a region of interest [x, y, width, height] to the bounds of an image
+
+    Args:
+        roi (tuple[int, int, int, int]): x, y coordinates of top left, width, and height (pixels)
+        shape (tuple[int, ...]): shape of image
+
+    Returns:
+        tuple[int, int, int, int]: region of interest within the image
+    """
+    x, y, w, h = (int(v) for v in roi)
+    x, y = min(max(x, 0), shape[1] - 1), min(max(y, 0), shape[0] - 1)
+
+    return x, y, max(1, min(w, shape[1] - x)), max(1, min(h, shape[0] - y))
+
 def _convert_detection(raw_detection, shape):
     """Splits a raw detection into a list of tuples containing bounding boxes, confidences, and classes
 
@@ -93,6 +137,92 @@ def _convert_detection(raw_detection, shape):
     return lump
 
 
+def _split_batch(outputs, n: int, framework: str) -> list[list[np.ndarray]]:
+    """Splits the output of a forward pass over a batch of n images into the output for each image
+
+    Args:
+        outputs (list[np.ndarray]): output of each output layer of the network
+        n (int): number of images in the batch
+        framework (str): framework of neural network used. Accepts ["dn", "tf"] for "darknet" or "tensorflow"
+
+    Returns:
+        list[list[np.ndarray]]: output of each output layer, for each image
+    """
+    if framework == "tf":
+        # detections from every image are in one list, with the index of the image in column 0
+        detections = np.vstack(outputs)[0][0]
+        return [[detections[detections[:, 0] == i].reshape(1, 1, -1, 7)] for i in range(n)]
+
+    # yolo layers give [images, rows, 85] for a batch, or [images * rows, 85] on some versions of opencv
+    split = [out if out.ndim == 3 else np.split(out, n) for out in outputs]
+    return [[out[i] for out in split] for i in range(n)]
+
+
+def suppress(boxes: list, confidences: list, classIDs: list, threshold: float):
+    """Non maximum suppression of filtered boxes
+
+    Args:
+        boxes (list): COCO bounding boxes
+        confidences (list): confidence of each box
+        classIDs (list): class ID of each box
+        threshold (float): threshold confidence
+
+    Returns:
+        tuple: boxes, confidences, and classIDs which are kept. All None if there are none
+    """
+    indices = cv.dnn.NMSBoxes(boxes, confidences, threshold, NMS_THRESHOLD)
+
+    if len(indices) == 0:
+        return None, None, None
+
+    lump = [[boxes[i], confidences[i], classIDs[i]] for i in indices]
+    return tuple(zip(*lump))
+
+
+def filter_boxes(raw_detections: np.ndarray, shape: tuple[int, ...], threshold: float, framework: str):
+    """Filters raw detections by confidence and converts them to COCO bounding boxes.
+
+    Vectorised over every row of the network output, see DetectionOutput._filter_boxes_reference for the per-row
+    version.
+
+    Args:
+        raw_detections (np.ndarray): raw detections (ensure it has been vstacked)
+        shape (tuple[int, ...]): shape of image
+        threshold (float): threshold confidence
+        framework (str): framework of neural network used. Accepts ["dn", "tf"] for "darknet" or "tensorflow"
+
+    Returns:
+        list : list of boxes, confidences, and classIDs
+    """
+    scale = np.array([shape[1], shape[0], shape[1], shape[0]])
+
+    if framework == "dn":
+        scores = raw_detections[:, 5:]
+        classIDs = np.argmax(scores, axis=1)
+        confidences = scores[np.arange(len(scores)), classIDs].astype(float)
+
+        mask = confidences > threshold
+        x, y, w, h = (raw_detections[mask, :4] * scale).T
+
+        # same rounding as _yolo_to_coco
+        boxes = np.stack([x - w // 2, y - h // 2, w, h], axis=1).astype(int)
+    elif framework == "tf":
+        detections = raw_detections[0][0]
+        classIDs = detections[:, 1].astype(int)
+        confidences = detections[:, 2].astype(float)
+
+        mask = confidences > threshold
+        x_min, y_min, x_max, y_max = (detections[mask, 3:7] * scale).T
+
+        # same rounding as _voc_to_coco
+        boxes = np.stack([x_min.astype(int), y_min.astype(int),
+                          (x_max - x_min).astype(int), (y_max - y_min).astype(int)], axis=1)
+    else:
+        return [], [], []
+
+    return list(map(tuple, boxes.tolist())), confidences[mask].tolist(), classIDs[mask].tolist()
+
+
 class DetectionOutput:
     """Object for output of a single object detection.
 
@@ -102,44 +232,87 @@ class DetectionOutput:
     """
 
     def __init__(self, raw_detections, shape: tuple[int, ...], threshold: float, elapsed: float, framework: str,
-                 image: np.ndarray):
+                 image: np.ndarray, classes: tuple[str, ...] = None, class_index: MappingProxyType = None,
+                 offset: tuple[int, int] = (0, 0)):
         """Takes raw detection from neural network and filters into a list of all of the bounding boxes in image.
 
         Args:
             raw_detections (output of neural network): raw detections of neural network
-            shape (tuple[int, ...]): shape of image
+            shape (tuple[int, ...]): shape of the image the network was run on (the region of interest, if cropped)
             threshold (float): threshold confidence value for filtering
             elapsed (float): time taken for forward propagation of neural network
             framework (str): framework of neural network used. Accepts ["dn", "tf"] for "darknet" or "tensorflow"
             image (np.ndarray): frame
+            classes (tuple[str, ...], optional): class names shared from ObjectDetection. Loaded if not given.
+            class_index (MappingProxyType, optional): class name to class ID lookup for classes
+            offset (tuple[int, int], optional): x, y coordinates of the region of interest in image, added to every box
         """
         self.elapsed = elapsed
+        self.offset = offset
         self.__framework = framework
-
-        names_file = importlib.resources.files("iotbike") / "resources/coco.names"
-        with importlib.resources.as_file(names_file) as f:
-            self.__classes = open(f).read().strip().split("\n")
+        self._set_classes(classes, class_index)
 
         raw_detections = np.vstack(raw_detections)
 
         boxes, confidences, classIDs = self._filter_boxes(raw_detections, shape, threshold)
 
-        indices = cv.dnn.NMSBoxes(boxes, confidences, threshold, 0.2)
+        if offset != (0, 0):
+            boxes = [(x + offset[0], y + offset[1], w, h) for x, y, w, h in boxes]
 
-        if len(indices) > 0:
-            lump = [[boxes[i], confidences[i], classIDs[i]] for i in indices]
-            self.boxes, self.confidences, self.classIDs = list(zip(*lump))
-        else:
-            self.boxes, self.confidences, self.classIDs = None, None, None
+        self.boxes, self.confidences, self.classIDs = suppress(boxes, confidences, classIDs, threshold)
 
         self.image = image
 
-    def draw_boxes(self) -> np.ndarray:
+    @classmethod
+    def from_boxes(cls, boxes, confidences, classIDs, image: np.ndarray, framework: str = "dn",
+                   classes: tuple[str, ...] = None, class_index: MappingProxyType = None, elapsed: float = 0.0):
+        """Makes the output of a detection from boxes which have already been filtered and suppressed, e.g. by
+        filter_boxes and suppress
+
+        Args:
+            boxes (tuple): COCO bounding boxes which are kept, None if there are none
+            confidences (tuple): confidence of each box, None if there are none
+            classIDs (tuple): class ID of each box, None if there are none
+            image (np.ndarray): frame
+            framework (str): framework of neural network used. Accepts ["dn", "tf"] for "darknet" or "tensorflow"
+            classes (tuple[str, ...], optional): class names shared from ObjectDetection. Loaded if not given.
+            class_index (MappingProxyType, optional): class name to class ID lookup for classes
+            elapsed (float): time taken for forward propagation of neural network
+
+        Returns:
+            DetectionOutput: output with the boxes as given
+        """
+        output = cls.__new__(cls)
+        output.elapsed = elapsed
+        output.offset = (0, 0)
+        output.__framework = framework
+        output._set_classes(classes, class_index)
+
+        output.boxes, output.confidences, output.classIDs = boxes, confidences, classIDs
+        output.image = image
+
+        return output
+
+    def _set_classes(self, classes: tuple[str, ...], class_index: MappingProxyType):
+        if classes is None:
+            classes, class_index = _load_class_names(), _load_class_index()
+        elif class_index is None:
+            class_index = MappingProxyType({name: i for i, name in enumerate(classes)})
+        self.__classes = classes
+        self.__class_index = class_index
+
+    def draw_boxes(self, copy: bool = False) -> np.ndarray:
         """Draws bounding boxes and confidences on frame.
 
+        Args:
+            copy (bool): draw on a copy, leaving the frame untouched for anything else reading it
+
         Returns:
             np.ndarray: frame with bounding boxes drawn
         """
+        if copy:
+            self.image = self.image.copy()
+
         if self.boxes is not None:
             for i in range(len(self.boxes)):
                 box = self.boxes[i]
@@ -175,28 +348,45 @@ class DetectionOutput:
         else:
             return 0
 
-    def get_people(self):
+    def get_class_count(self, name: str) -> int:
+        """Gets number of objects of one class in frame
 
-        if self.boxes is not None:
-            people = []
+        Args:
+            name (str): name of class in COCO.names
 
-            for i in range(len(self.boxes)):
-                box = self.boxes[i]
+        Returns:
+            int: number of objects of that class
+        """
+        if self.boxes is None:
+            return 0
 
-                if self.__classes[self.classIDs[i]] == "person":
-                    people.append(box)
+        class_id = self.__class_index.get(name)
+        return sum(1 for i in self.classIDs if i == class_id)
 
-            return len(people)
-        else:
-            return 0
-            
+    def get_people(self):
+        """Gets number of people in frame
+
+        Returns:
+            int: number of people
+        """
+        return self.get_class_count("person")
 
     def _filter_boxes(self, raw_detections: np.ndarray, shape: tuple[int, ...], threshold: float):
-        """Performs non-maximum suppression on bounding boxes
+        """Filters raw detections by confidence and converts them to COCO bounding boxes, see filter_boxes
+
+        Returns:
+            list : list of boxes, confidences, and classIDs
+        """
+        return filter_boxes(raw_detections, shape, threshold, self.__framework)
+
+    def _filter_boxes_reference(self, raw_detections: np.ndarray, shape: tuple[int, ...], threshold: float):
+        """Reference implementation of _filter_boxes, looping over each detection in python.
+
+        Kept to check the vectorised version against.
 
         Args:
             raw_detections (np.ndarray): raw detections (ensure it has been vstacked)
-            shape (tuple[int, ...]): shape of imagefjdskj
+            shape (tuple[int, ...]): shape of image
             threshold (float): threshold confidence
 
         Returns:
@@ -233,12 +423,82 @@ class DetectionOutput:
             return boxes, confs, classIDs
 
 
+class AdaptiveInputSize:
+    """Picks the input size of the network to keep the forward pass within the time budget of a target frame rate.
+
+    Keeps an exponential moving average of the forward time. Steps down a size when it is over budget, and steps up
+    when the next size is predicted (forward time goes with the number of pixels) to fit within headroom of the budget.
+    """
+
+    def __init__(self, target_fps: float, size: int = 416, sizes: tuple[int, ...] = INPUT_SIZES, alpha: float = 0.2,
+                 settle: int = 10, headroom: float = 0.8):
+        """
+        Args:
+            target_fps (float): frame rate to keep the forward pass within
+            size (int): starting input size (pixels)
+            sizes (tuple[int, ...]): input sizes to choose from
+            alpha (float): weight of each new forward time in the moving average
+            settle (int): forward passes after a change of size before changing again
+            headroom (float): fraction of the budget the next size up has to fit in
+        """
+        self.budget = 1. / target_fps
+        self.size = size
+        self.sizes = tuple(sorted(set(sizes) | {size}))
+        self.alpha = alpha
+        self.settle = settle
+        self.headroom = headroom
+
+        self.ema = None
+        self._since_change = 0
+
+    def update(self, elapsed: float) -> int:
+        """Adds the time of a forward pass
+
+        Args:
+            elapsed (float): time taken for forward propagation (seconds)
+
+        Returns:
+            int: input size to use for the next forward pass
+        """
+        self.ema = elapsed if self.ema is None else self.alpha * elapsed + (1 - self.alpha) * self.ema
+        self._since_change += 1
+
+        if self._since_change < self.settle:
+            return self.size
+
+        i = self.sizes.index(self.size)
+        if self.ema > self.budget and i > 0:
+            size = self.sizes[i - 1]
+        elif i < len(self.sizes) - 1 and self.ema * (self.sizes[i + 1] / self.size) ** 2 < self.budget * self.headroom:
+            size = self.sizes[i + 1]
+        else:
+            return self.size
+
+        self.ema *= (size / self.size) ** 2
+        self.size = size
+        self._since_change = 0
+
+        return self.size
+
+
 class ObjectDetection:
     """ObjectDetection class.
     """
-    def __init__(self):
+    def __init__(self, input_size: int = 416, target_fps: float = None):
         """Gets neural network config files and initiates network
+
+        Args:
+            input_size (int): width and height (pixels) images are resized to for the network, a multiple of 32. The
+                smaller, the faster. See INPUT_SIZES
+            target_fps (float, optional): if given, the input size is changed to keep the forward pass within the
+                time budget of this frame rate
         """
+        if input_size % 32:
+            raise ValueError(f"Input size must be a multiple of 32, not {input_size}")
+
+        self.input_size = input_size
+        self.adaptive = AdaptiveInputSize(target_fps, input_size) if target_fps else None
+
         # resource_dirs = importlib.resources.files("camsystem") / "resources"
         # models = [str(model) for model in resource_dirs.iterdir()
         #           if (model.is_dir() and (str(model).rsplit("/")[-1] != "position"))]
@@ -254,46 +514,112 @@ class ObjectDetection:
 
         model, config, self.__framework = _get_model_files(model_dir)
 
+        self.classes = _load_class_names()
+        self.class_index = _load_class_index()
+
         self.__net = cv.dnn.readNet(model, config)
         self.__net.setPreferableBackend(cv.dnn.DNN_BACKEND_OPENCV)
         self.__net.setPreferableTarget(cv.dnn.DNN_TARGET_CPU)
         self.__outputNames = self.__net.getUnconnectedOutLayersNames()
 
-    def detect(self, image: np.ndarray, threshold: float) -> DetectionOutput:
+    def detect(self, image: np.ndarray, threshold: float, roi: tuple[int, int, int, int] = None):
         """
         Takes image and returns the output from the __net
 
         :param threshold:
         :param image: image to be analysed
         :type image: ndarray
+        :param roi: x, y, width, height of the region of the image to detect in (the whole image if None)
         :return: raw output of detection, time
         """
+        return self._forward(self.make_blob(image, roi), 1)
 
-        if image.shape[0] > 1080:
-            image = self.resize(image, 0.2)
+    def make_blob(self, image: np.ndarray, roi: tuple[int, int, int, int] = None) -> np.ndarray:
+        """Makes the input of the network from an image
+
+        Args:
+            image (np.ndarray): image to be analysed
+            roi (tuple[int, int, int, int], optional): x, y, width, height of the region of the image to use
+
+        Returns:
+            np.ndarray: blob at the current input size
+        """
+        if roi is not None:
+            x, y, w, h = _clip_roi(roi, image.shape)
+            image = image[y:y + h, x:x + w]
+
+        # the blob is resized to the input size anyway, so large images don't need shrinking first
+        size = self.input_size
+        return cv.dnn.blobFromImage(image, 1 / 255.0, (size, size), swapRB=True, crop=False)
+
+    @property
+    def framework(self) -> str:
+        """Framework of the network, "dn" or "tf"
+        """
+        return self.__framework
 
-        blob = cv.dnn.blobFromImage(image, 1 / 255.0, (416, 416), swapRB=True, crop=False)
+    def _forward(self, blob: np.ndarray, n: int):
+        """Runs the network on a blob of n images, adapting the input size to the time taken per image
+
+        Returns:
+            tuple: raw output of the network, time taken
+        """
         self.__net.setInput(blob)
 
         t0 = time.time()
         outputs = self.__net.forward(self.__outputNames)
         elapsed_time = time.time() - t0
 
+        if self.adaptive is not None:
+            self.input_size = self.adaptive.update(elapsed_time / n)
+
         return outputs, elapsed_time
 
-    def detect_filtered(self, image: np.ndarray, threshold: float) -> DetectionOutput:
+    def detect_filtered(self, image: np.ndarray, threshold: float,
+                        roi: tuple[int, int, int, int] = None) -> DetectionOutput:
         """Detects objects with __net and outputs filtered detections as DetectionOutput object
 
         Args:
             image (np.ndarray): image to be detected
             threshold (float): threshold for detection
+            roi (tuple[int, int, int, int], optional): x, y, width, height of the region of the image to detect in.
+                Boxes are still in the coordinates of the whole image, and drawn on the whole image
 
         Returns:
             DetectionOutput: DetectionOutput object, which performs nms on initialisation
         """
-        outputs, elapsed_time = self.detect(image, threshold)
+        outputs, elapsed_time = self.detect(image, threshold, roi)
+
+        if roi is None:
+            shape, offset = image.shape[:2], (0, 0)
+        else:
+            x, y, w, h = _clip_roi(roi, image.shape)
+            shape, offset = (h, w), (x, y)
+
+        return DetectionOutput(outputs, shape, threshold, elapsed_time, self.__framework, image,
+                               self.classes, self.class_index, offset)
+
+    def detect_batch(self, images: list[np.ndarray], threshold: float) -> list[DetectionOutput]:
+        """Detects objects in several images with a single forward pass, which is faster than detecting each in turn
+
+        Args:
+            images (list[np.ndarray]): images to be detected, of any sizes
+            threshold (float): threshold for detection
+
+        Returns:
+            list[DetectionOutput]: DetectionOutput for each image, in order. Each has an equal share of the forward
+            propagation time
+        """
+        if not images:
+            return []
 
-        return DetectionOutput(outputs, image.shape[:2], threshold, elapsed_time, self.__framework, image)
+        size = self.input_size
+        blob = cv.dnn.blobFromImages(images, 1 / 255.0, (size, size), swapRB=True, crop=False)
+        outputs, elapsed_time = self._forward(blob, len(images))
+
+        return [DetectionOutput(raw, image.shape[:2], threshold, elapsed_time / len(images), self.__framework, image,
+                                self.classes, self.class_index)
+                for raw, image in zip(_split_batch(outputs, len(images), self.__framework), images)]
 
     # def detect_tracks(self, image: np.ndarray, threshold: float):
     #     """Detects objects and used DEEP SORT to track objects
@@ -350,20 +676,27 @@ def detect_from_file(file_path: str, conf_thresh: float, detector: ObjectDetecti
     detector.display(output.draw_boxes(), output.elapsed, name=file_path.rsplit("/")[-1])
 
 
-def detect_from_dir(dir_path: str, conf_thresh: float, detector: ObjectDetection = None):
+def detect_from_dir(dir_path: str, conf_thresh: float, detector: ObjectDetection = None, batch_size: int = 8):
     """
     Performs object detection on a directory of images
     :param dir_path: absolute path to a directory containing images
     :param conf_thresh: threshold for detection
     :param detector: ObjectDetection object (not required)
+    :param batch_size: number of images detected in each forward pass
     """
     if not detector:
         detector = ObjectDetection()
 
     p = Path(dir_path)
+    files = [file for file in sorted(p.glob("**/*")) if file.is_file()]
+
+    for start in range(0, len(files), batch_size):
+        batch = [(file, cv.imread(str(file.resolve()))) for file in files[start:start + batch_size]]
+        batch = [(file, image) for file, image in batch if image is not None]
 
-    for file in p.glob("**/*"):
-        detect_from_file(str(file.resolve()), conf_thresh, detector)
+        outputs = detector.detect_batch([image for _, image in batch], conf_thresh)
+        for (file, _), output in zip(batch, outputs):
+            detector.display(output.draw_boxes(), output.elapsed, name=file.name)
 
     close_flag = True
     while close_flag:
@@ -0,0 +1,180 @@
+import time
+from datetime import datetime
+from queue import Queue, Empty
+from threading import Thread
+
+
+class DropOldestQueue(Queue):
+    """Bounded queue which never blocks the producer. When full, the oldest item is dropped to make room.
+
+    on_drop is called with every dropped item, e.g. to give a pooled frame back.
+    """
+
+    def __init__(self, maxsize: int = 1, on_drop=None):
+        super().__init__(maxsize)
+        self.dropped = 0
+        self.on_drop = on_drop
+
+    def put(self, item, block=True, timeout=None):
+        """Puts item on the queue, dropping the oldest item if the queue is full
+
+        Args:
+            item (any): item to put on the queue
+        """
+        dropped = None
+
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                dropped = self._get()
+                self.unfinished_tasks -= 1
+                self.dropped += 1
+
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+
+class Stage(Thread):
+    """A single stage of a pipeline, running func in its own thread.
+
+    A stage with no inbox is a source and calls func() with no arguments, at most rate times a second. Otherwise
+    func is called with each item taken from the inbox. Anything func returns (other than None) is put on the outbox.
+    """
+
+    def __init__(self, name: str, func, inbox: DropOldestQueue = None, outbox: DropOldestQueue = None,
+                 rate: float = None):
+        super().__init__(name=name, daemon=True)
+
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.rate = rate
+
+        self.stopped = False
+
+        self.processed = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self.start_time = None
+
+    def run(self):
+        """This runs continuously in the thread.
+        """
+        self.start_time = time.time()
+        prev = 0
+
+        while not self.stopped:
+
+            if self.inbox is None:
+                if self.rate:
+                    wait = 1. / self.rate - (time.time() - prev)
+                    if wait > 0:
+                        time.sleep(wait)
+                    prev = time.time()
+                args = ()
+            else:
+                try:
+                    args = (self.inbox.get(timeout=0.1),)
+                except Empty:
+                    continue
+
+            t0 = time.time()
+            try:
+                result = self.func(*args)
+            except Exception as e:
+                self.errors += 1
+                print(f"{datetime.now().isoformat()} Error in {self.name} stage: {e}")
+                continue
+            finally:
+                self.busy_time += time.time() - t0
+
+            self.processed += 1
+
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+    def stop(self):
+        """Stops the while loop in the run function
+        """
+        self.stopped = True
+
+    def stats(self) -> dict:
+        """Throughput and queue depth of the stage
+
+        Returns:
+            dict: items processed, items per second, errors, time spent in func, and the depth and number of dropped
+            items of the inbox
+        """
+        elapsed = time.time() - self.start_time if self.start_time else 0
+
+        return {
+            "processed": self.processed,
+            "rate": self.processed / elapsed if elapsed > 0 else 0.0,
+            "errors": self.errors,
+            "busy": self.busy_time / elapsed if elapsed > 0 else 0.0,
+            "queue_depth": self.inbox.qsize() if self.inbox is not None else 0,
+            "dropped": self.inbox.dropped if self.inbox is not None else 0
+        }
+
+
+class Pipeline:
+    """Chain of stages, each connected to the next by a DropOldestQueue.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name: str, func, queue_size: int = 1, rate: float = None, on_drop=None) -> Stage:
+        """Adds a stage to the end of the pipeline. The first stage added is the source.
+
+        Args:
+            name (str): name of the stage (and its thread)
+            func (callable): function to run for each item
+            queue_size (int): size of the queue between this stage and the previous one
+            rate (float, optional): maximum rate (Hz) of the source stage
+            on_drop (callable, optional): called with every item dropped from the queue
+
+        Returns:
+            Stage: the new stage
+        """
+        inbox = None
+        if self.stages:
+            inbox = DropOldestQueue(queue_size, on_drop=on_drop)
+            self.stages[-1].outbox = inbox
+
+        stage = Stage(name, func, inbox=inbox, rate=rate)
+        self.stages.append(stage)
+
+        return stage
+
+    def start(self):
+        """Starts every stage
+        """
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout: float = 1.0):
+        """Stops every stage and waits for the threads to finish
+        """
+        for stage in self.stages:
+            stage.stop()
+
+        for stage in self.stages:
+            if stage.is_alive():
+                stage.join(timeout)
+
+    def is_alive(self) -> bool:
+        """Whether every stage is still running
+        """
+        return all(stage.is_alive() for stage in self.stages)
+
+    def stats(self) -> dict:
+        """Gets the stats of each stage
+
+        Returns:
+            dict: stage name to Stage.stats()
+        """
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,406 @@
+import bisect
+import os
+import time
+from threading import Lock
+
+import cv2 as cv
+import numpy as np
+
+# files in a recording directory
+FRAMES_VIDEO = "frames.avi"   # frames, as mjpg
+FRAMES_INDEX = "frames.csv"   # timestamp of each frame
+GPS_DATA = "gps.nmea"         # bytes read from the gps serial port, as they were read
+GPS_INDEX = "gps.csv"         # timestamp, offset, and length of each read
+IMU_SAMPLES = "imu.csv"       # timestamp and x, y, z acceleration of each sample
+
+
+def _load_csv(path: str, columns: int) -> np.ndarray:
+    """Loads a recording index, skipping the header
+
+    Returns:
+        np.ndarray: [rows, columns] array
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.zeros((0, columns))
+
+    return np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2).reshape(-1, columns)
+
+
+class Recorder:
+    """Records the camera, gps, and imu of a live bike to a directory, to be played back with Replay.
+
+    Each sensor is written under its own lock, so encoding a frame never holds up an imu sample.
+    """
+
+    def __init__(self, directory: str, fps: float = 30):
+        """
+        Args:
+            directory (str): directory to record to, created if it doesn't exist
+            fps (float): nominal frame rate of the video. Frames are played back by their timestamps, not this
+        """
+        self.directory = directory
+        self.fps = fps
+        os.makedirs(directory, exist_ok=True)
+
+        self._frame_lock = Lock()
+        self._gps_lock = Lock()
+        self._imu_lock = Lock()
+        self.closed = False
+
+        self._video = None
+        self._frames = open(os.path.join(directory, FRAMES_INDEX), "w")
+        self._frames.write("timestamp\n")
+
+        self._nmea = open(os.path.join(directory, GPS_DATA), "wb")
+        self._gps = open(os.path.join(directory, GPS_INDEX), "w")
+        self._gps.write("timestamp,offset,length\n")
+        self._nmea_offset = 0
+
+        self._imu = open(os.path.join(directory, IMU_SAMPLES), "w")
+        self._imu.write("timestamp,x,y,z\n")
+
+    def write_frame(self, frame: np.ndarray, timestamp: float):
+        """Adds a frame to the video
+
+        Args:
+            frame (np.ndarray): BGR frame. Every frame must be the same size
+            timestamp (float): time the frame was captured
+        """
+        with self._frame_lock:
+            if self.closed:
+                return
+
+            if self._video is None:
+                height, width = frame.shape[:2]
+                self._video = cv.VideoWriter(os.path.join(self.directory, FRAMES_VIDEO),
+                                             cv.VideoWriter_fourcc(*"MJPG"), self.fps, (width, height))
+
+            self._video.write(frame)
+            self._frames.write(f"{timestamp!r}\n")
+
+    def write_nmea(self, data: bytes, timestamp: float):
+        """Adds bytes read from the gps serial port
+
+        Args:
+            data (bytes): bytes, exactly as read
+            timestamp (float): time they were read
+        """
+        with self._gps_lock:
+            if self.closed or not data:
+                return
+
+            self._nmea.write(data)
+            self._gps.write(f"{timestamp!r},{self._nmea_offset},{len(data)}\n")
+            self._nmea_offset += len(data)
+
+    def write_imu(self, sample: tuple[float, float, float], timestamp: float):
+        """Adds an accelerometer sample
+
+        Args:
+            sample (tuple[float, float, float]): x, y, z acceleration (g)
+            timestamp (float): time it was read
+        """
+        with self._imu_lock:
+            if self.closed:
+                return
+
+            self._imu.write(f"{timestamp!r},{sample[0]!r},{sample[1]!r},{sample[2]!r}\n")
+
+    def close(self):
+        """Finishes the recording. Anything written after is ignored
+        """
+        with self._frame_lock, self._gps_lock, self._imu_lock:
+            if self.closed:
+                return
+            self.closed = True
+
+            if self._video is not None:
+                self._video.release()
+            for f in (self._frames, self._nmea, self._gps, self._imu):
+                f.close()
+
+
+class RecordingSerial:
+    """Wraps a serial port, recording everything read from it
+    """
+
+    def __init__(self, serial_port, recorder: Recorder):
+        self.serial = serial_port
+        self.recorder = recorder
+
+    @property
+    def in_waiting(self) -> int:
+        return self.serial.in_waiting
+
+    @property
+    def is_open(self) -> bool:
+        return self.serial.is_open
+
+    def read(self, size: int = 1) -> bytes:
+        data = self.serial.read(size)
+        self.recorder.write_nmea(data, time.time())
+        return data
+
+    def open(self):
+        self.serial.open()
+
+    def close(self):
+        self.serial.close()
+
+
+class RecordingSenseHat:
+    """Wraps a sense hat, recording every accelerometer sample. Everything else is passed straight through
+    """
+
+    def __init__(self, sense, recorder: Recorder):
+        self.sense = sense
+        self.recorder = recorder
+
+    def get_accelerometer_raw(self) -> dict:
+        acceleration = self.sense.get_accelerometer_raw()
+        self.recorder.write_imu((acceleration["x"], acceleration["y"], acceleration["z"]), time.time())
+        return acceleration
+
+    def __getattr__(self, name):
+        return getattr(self.sense, name)
+
+
+class ReplayClock:
+    """Maps time in a recording to wall time, shared by every sensor of a replay so they stay in step.
+
+    The clock starts the first time it is read. With speed None (or 0), there is no waiting at all and each sensor
+    plays back as fast as it is read.
+    """
+
+    def __init__(self, start: float, speed: float = 1.0):
+        """
+        Args:
+            start (float): time the recording started
+            speed (float, optional): playback speed, e.g. 2 for twice real time. None or 0 for as fast as possible
+        """
+        self.start = start
+        self.speed = speed or None
+        self._wall_start = None
+
+    @property
+    def fast(self) -> bool:
+        """Whether the replay runs as fast as possible
+        """
+        return self.speed is None
+
+    def now(self) -> float:
+        """Gets the current time in the recording
+        """
+        if self._wall_start is None:
+            self._wall_start = time.time()
+
+        if self.fast:
+            return float("inf")
+
+        return self.start + (time.time() - self._wall_start) * self.speed
+
+    def wait_until(self, timestamp: float, timeout: float = None) -> bool:
+        """Waits until a time in the recording
+
+        Args:
+            timestamp (float): time in the recording
+            timeout (float, optional): most seconds to wait for
+
+        Returns:
+            bool: True if the time was reached, False if timed out first
+        """
+        wait = 0 if self.fast else (timestamp - self.now()) / self.speed
+
+        if timeout is not None and wait > timeout:
+            time.sleep(timeout)
+            return False
+
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+
+class ReplayCamera:
+    """Plays back recorded frames, at the time they were captured.
+
+    Has the read and release methods of cv.VideoCapture, and capture_array of Picamera2. Frames which are already
+    late are dropped, as they would be by a live camera. Once every frame has been read, ended is True and read
+    fails straight away.
+    """
+
+    def __init__(self, directory: str, clock: ReplayClock):
+        self.clock = clock
+        self.timestamps = _load_csv(os.path.join(directory, FRAMES_INDEX), 1)[:, 0]
+        self._capture = cv.VideoCapture(os.path.join(directory, FRAMES_VIDEO))
+        self._index = 0
+        self.ended = len(self.timestamps) == 0
+
+    def read(self, image: np.ndarray = None):
+        """Gets the next frame, waiting until it is due
+
+        Returns:
+            tuple: whether a frame was read, frame
+        """
+        if self._index >= len(self.timestamps):
+            self.ended = True
+            return False, None
+
+        self.clock.wait_until(self.timestamps[self._index])
+
+        if not self.clock.fast:
+            now = self.clock.now()
+            while self._index + 1 < len(self.timestamps) and self.timestamps[self._index + 1] <= now:
+                self._capture.grab()
+                self._index += 1
+
+        self._index += 1
+        if image is None:
+            return self._capture.read()
+        return self._capture.read(image)
+
+    def capture_array(self) -> np.ndarray:
+        grabbed, frame = self.read()
+        return frame
+
+    def isOpened(self) -> bool:
+        return self._capture.isOpened()
+
+    def release(self):
+        self._capture.release()
+
+
+class ReplaySerial:
+    """Plays back the bytes read from a gps serial port, each chunk becoming readable at the time it was read.
+
+    Has the read, in_waiting, is_open, and close of serial.Serial, and read blocks (up to timeout) like a real port.
+    """
+
+    def __init__(self, directory: str, clock: ReplayClock, timeout: float = 1):
+        self.clock = clock
+        self.timeout = timeout
+        self.is_open = True
+
+        with open(os.path.join(directory, GPS_DATA), "rb") as f:
+            self.data = f.read()
+
+        index = _load_csv(os.path.join(directory, GPS_INDEX), 3)
+        self._times = index[:, 0]
+        self._ends = (index[:, 1] + index[:, 2]).astype(int)
+
+        self._chunk = 0  # chunks before this one are readable
+        self._pos = 0
+
+    def _due(self) -> int:
+        """Gets the offset up to which the data is readable
+        """
+        if self.clock.fast:
+            # one chunk at a time, once the last has been read
+            if self._chunk < len(self._times) and self._pos >= self._readable():
+                self._chunk += 1
+        else:
+            self._chunk = bisect.bisect_right(self._times, self.clock.now(), lo=self._chunk)
+
+        return self._readable()
+
+    def _readable(self) -> int:
+        return int(self._ends[self._chunk - 1]) if self._chunk else 0
+
+    @property
+    def in_waiting(self) -> int:
+        return self._due() - self._pos
+
+    def read(self, size: int = 1) -> bytes:
+        due = self._due()
+
+        if due <= self._pos:
+            if self._chunk >= len(self._times):
+                # the recording has ended, time out like a real port
+                time.sleep(self.timeout)
+                return b""
+
+            if not self.clock.wait_until(self._times[self._chunk], self.timeout):
+                return b""
+            due = self._due()
+
+        data = self.data[self._pos:min(self._pos + size, due)]
+        self._pos += len(data)
+
+        return data
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+class ReplaySenseHat:
+    """Plays back recorded accelerometer samples. Each read gets the latest sample due, and the LED matrix is a no-op
+    """
+
+    def __init__(self, directory: str, clock: ReplayClock):
+        self.clock = clock
+
+        samples = _load_csv(os.path.join(directory, IMU_SAMPLES), 4)
+        self._times = samples[:, 0]
+        self._samples = samples[:, 1:]
+        self._index = 0
+
+        self.letter = None
+
+    def get_accelerometer_raw(self) -> dict:
+        if self.clock.fast:
+            i = min(self._index, len(self._times) - 1)
+            self._index += 1
+        else:
+            i = max(0, bisect.bisect_right(self._times, self.clock.now()) - 1)
+
+        x, y, z = self._samples[i]
+        return {"x": float(x), "y": float(y), "z": float(z)}
+
+    def show_letter(self, letter, text_colour=None, back_colour=None):
+        self.letter = letter
+
+    def clear(self, *args):
+        self.letter = None
+
+
+class Replay:
+    """A recording made by Recorder, played back through stand ins for the camera, gps serial port, and sense hat,
+    which all follow the same clock.
+    """
+
+    def __init__(self, directory: str, speed: float = 1.0):
+        """
+        Args:
+            directory (str): directory of the recording
+            speed (float, optional): playback speed, e.g. 2 for twice real time. None or 0 for as fast as possible
+        """
+        self.directory = directory
+
+        if not os.path.exists(os.path.join(directory, FRAMES_VIDEO)):
+            raise Exception(f"No recording in {directory}")
+
+        firsts = [_load_csv(os.path.join(directory, name), columns)[:1, 0]
+                  for name, columns in ((FRAMES_INDEX, 1), (GPS_INDEX, 3), (IMU_SAMPLES, 4))]
+        start = min((float(first[0]) for first in firsts if len(first)), default=0.0)
+
+        self.clock = ReplayClock(start, speed)
+
+    @property
+    def has_gps(self) -> bool:
+        path = os.path.join(self.directory, GPS_DATA)
+        return os.path.exists(path) and os.path.getsize(path) > 0
+
+    @property
+    def has_imu(self) -> bool:
+        return len(_load_csv(os.path.join(self.directory, IMU_SAMPLES), 4)) > 0
+
+    def camera(self) -> ReplayCamera:
+        return ReplayCamera(self.directory, self.clock)
+
+    def serial(self) -> ReplaySerial:
+        return ReplaySerial(self.directory, self.clock)
+
+    def sense_hat(self) -> ReplaySenseHat:
+        return ReplaySenseHat(self.directory, self.clock)
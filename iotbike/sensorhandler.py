@@ -1,7 +1,9 @@
 import threading
+import time
+from datetime import datetime
 
 import cv2 as cv
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 import numpy as np
 
 
@@ -28,63 +30,481 @@ def _draw_boxes(image, boxes):
     return image
 
 
+class PooledFrame:
+    """A frame in one of the buffers of a FramePool. Call release once it is no longer being used, so the buffer can
+    be captured into again.
+    """
+
+    def __init__(self, pool, index: int):
+        self.pool = pool
+        self.index = index
+        self.array = pool.buffers[index]
+
+    def retain(self):
+        """Adds a reference to the buffer, which must be released separately
+
+        Returns:
+            PooledFrame: self
+        """
+        self.pool._retain(self.index)
+        return self
+
+    def release(self):
+        """Removes a reference to the buffer
+        """
+        self.pool._release(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class FramePool:
+    """Fixed set of preallocated frame buffers, so capturing a frame never allocates memory.
+
+    Buffers are reference counted: acquire gives a buffer with no other references, and it goes back in the pool
+    once every reference has been released.
+    """
+
+    def __init__(self, shape: tuple, size: int = 4, dtype=np.uint8):
+        """
+        Args:
+            shape (tuple): shape of each frame, e.g. (480, 640, 3)
+            size (int): number of buffers
+            dtype (np.dtype): type of each frame
+        """
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        self._refs = [0] * size
+        self._released = Condition()
+
+        self.starved = 0
+
+    def acquire(self, timeout: float = None) -> PooledFrame:
+        """Takes a free buffer from the pool, waiting for one to be released if there aren't any
+
+        Args:
+            timeout (float, optional): seconds to wait for, forever if None
+
+        Returns:
+            PooledFrame: frame with a single reference. None if no buffer was free before timeout
+        """
+        with self._released:
+            if 0 not in self._refs:
+                self.starved += 1
+                if not self._released.wait_for(lambda: 0 in self._refs, timeout):
+                    return None
+
+            index = self._refs.index(0)
+            self._refs[index] = 1
+
+            return PooledFrame(self, index)
+
+    def free(self) -> int:
+        """Number of buffers with no references
+        """
+        with self._released:
+            return self._refs.count(0)
+
+    def _retain(self, index: int):
+        with self._released:
+            self._refs[index] += 1
+
+    def _release(self, index: int):
+        with self._released:
+            if self._refs[index] <= 0:
+                raise Exception(f"{datetime.now().isoformat()} Frame buffer {index} released too many times")
+
+            self._refs[index] -= 1
+            if self._refs[index] == 0:
+                self._released.notify()
+
+
+class FrameSlot:
+    """Holds the latest camera frame, with the time it was captured and an id which goes up by one for every frame.
+
+    Consumers can wait for a frame newer than the last one they used, so the same frame is never processed twice.
+
+    The slot can also hold PooledFrames, in which case it takes over the publisher's reference and releases it when
+    the frame is replaced. Pass retain=True to get a reference of your own, which you must release.
+
+    Once the publisher has stopped, the slot is closed, so nothing waits for a frame which will never come.
+    """
+
+    def __init__(self):
+        self._changed = Condition()
+
+        self.frame = None
+        self.frame_id = 0
+        self.timestamp = None
+        self.closed = False
+
+    def publish(self, frame, timestamp: float = None) -> int:
+        """Replaces the frame in the slot and wakes anything waiting for it
+
+        Args:
+            frame (np.ndarray | PooledFrame): new frame
+            timestamp (float, optional): time the frame was captured, defaults to now
+
+        Returns:
+            int: id of the new frame
+        """
+        with self._changed:
+            previous = self.frame
+
+            self.frame = frame
+            self.timestamp = time.time() if timestamp is None else timestamp
+            self.frame_id += 1
+            self._changed.notify_all()
+
+        if isinstance(previous, PooledFrame):
+            previous.release()
+
+        return self.frame_id
+
+    def close(self):
+        """Marks that no more frames will be published, waking anything waiting for one. The last frame stays
+        """
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def latest(self, retain: bool = False):
+        """Gets the current frame
+
+        Args:
+            retain (bool): add a reference to the frame if it is a PooledFrame
+
+        Returns:
+            tuple: frame id, capture time, frame
+        """
+        with self._changed:
+            return self._current(retain)
+
+    def wait_newer(self, frame_id: int, timeout: float = None, retain: bool = False):
+        """Waits for a frame newer than frame_id
+
+        Args:
+            frame_id (int): id of the last frame used
+            timeout (float, optional): seconds to wait for, forever if None
+            retain (bool): add a reference to the frame if it is a PooledFrame
+
+        Returns:
+            tuple: frame id, capture time, frame. None if there wasn't a newer frame before timeout, or the slot is
+            closed
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.frame_id > frame_id or self.closed, timeout)
+            if self.frame_id <= frame_id:
+                return None
+
+            return self._current(retain)
+
+    def _current(self, retain: bool):
+        """Call with the lock held, so the frame can't be released before it is retained
+        """
+        if retain and isinstance(self.frame, PooledFrame):
+            self.frame.retain()
+
+        return self.frame_id, self.timestamp, self.frame
+
+
+class SensorReader:
+    """Reads a single sensor in its own thread, so that a slow sensor never holds up the others.
+
+    Calls read_func at most rate times a second and publishes each result with the time it was read. If read_func
+    returns None, nothing is published.
+    """
+
+    def __init__(self, name: str, read_func, rate: float = None):
+        """
+        Args:
+            name (str): name of the thread
+            read_func (callable): reads the sensor and returns a sample
+            rate (float, optional): maximum rate (Hz) to read at. As fast as read_func returns if None
+        """
+        self.read_func = read_func
+        self.rate = rate
+        self.stopped = False
+
+        # time and sample, replaced together so a read never gets the time of one sample with another
+        self._latest = (None, None)
+
+        self.thread = Thread(target=self._update, name=name, daemon=True)
+
+    def start(self):
+        """Starts thread
+        """
+        self.thread.start()
+
+    def stop(self):
+        """Stops the while loop in the update function
+        """
+        self.stopped = True
+
+    def read(self):
+        """Gets the latest sample without blocking
+
+        Returns:
+            tuple: time the sample was read (None if there isn't one yet), sample
+        """
+        return self._latest
+
+    def _update(self):
+        """This runs continuously in the thread.
+        """
+        prev = 0
+
+        while not self.stopped:
+            if self.rate:
+                wait = 1. / self.rate - (time.time() - prev)
+                if wait > 0:
+                    time.sleep(wait)
+                prev = time.time()
+
+            try:
+                sample = self.read_func()
+            except Exception as e:
+                print(f"{datetime.now().isoformat()} Error reading {self.thread.name}: {e}")
+                time.sleep(1)
+                continue
+
+            if sample is not None:
+                self._latest = (time.time(), sample)
+
+
 class SensorHandler:
     """Class to handle webcam`
     """
 
-    def __init__(self, name: str = "WebcamStream", src: int = 0, pi: bool = False):
+    def __init__(self, name: str = "WebcamStream", src: int = 0, pi: bool = False, imu_rate: float = 100,
+                 buffer_pool: int = 0, replay: str = None, replay_speed: float = 1.0, record: str = None):
+        """
+        Args:
+            name (str): name of the camera thread
+            src (int): webcam index, if not using the pi camera
+            pi (bool): use the pi camera, sense hat, and gps
+            imu_rate (float): rate (Hz) the sense hat accelerometer is sampled at
+            buffer_pool (int): number of preallocated frame buffers to capture into (at least 2). If 0, every frame
+                is a new array. When using a pool, frames from read and read_newer must be given back with release
+            replay (str, optional): directory of a recording to play back instead of using the camera and sensors
+            replay_speed (float): playback speed of the replay, 0 for as fast as possible
+            record (str, optional): directory to record the camera and sensors to, for replaying later
+        """
+        if buffer_pool == 1:
+            raise ValueError("A buffer pool needs at least 2 buffers, one for the latest frame and one to capture into")
+
         self.stopped = False
         self.name = name
         self.boxes = None
 
-        if pi:
-            from picamera2 import Picamera2
+        self.sensehat = None
+        self.indicator = None
+        self.gps = None
+        self.gps_reader = None
+
+        self.frames = FrameSlot()
+        self.pool = None
+
+        self.recorder = None
+        if record is not None:
+            from iotbike.replay import Recorder, RecordingSenseHat, RecordingSerial
+            self.recorder = Recorder(record)
+
+        if replay is not None:
+            from iotbike.replay import Replay
+            from iotbike.imu import IMU
+            from iotbike.indicator import StatusIndicator
+            from iotbike.gps import GPS
+
+            recording = Replay(replay, replay_speed)
+
+            # the replayed camera behaves like a webcam
+            self.stream = recording.camera()
+            self._start_webcam(name, buffer_pool)
+
+            if recording.has_imu:
+                self.sensehat = IMU(rate=imu_rate, on_motion=self._on_motion, sense=recording.sense_hat())
+                self.indicator = StatusIndicator(self.sensehat.sense)
+
+            if recording.has_gps:
+                self.gps = GPS(serial_port=recording.serial())
+                self.gps_reader = SensorReader("GPS", self._read_gps)
+        elif pi:
+            from picamera2 import Picamera2, MappedArray
             from iotbike.imu import IMU
+            from iotbike.indicator import StatusIndicator
             from iotbike.gps import GPS
  
             self.stream = Picamera2()
             self.stream.configure(self.stream.create_preview_configuration(main={"format": "RGB888", "size": (640, 480)}))
             self.stream.start()
 
-            self.frame = self.stream.capture_array()
+            if buffer_pool:
+                self._mapped_array = MappedArray
+                self.pool = FramePool((480, 640, 3), buffer_pool)
+                frame = self.pool.acquire()
+                self._capture_picam(frame.array)
+                self._publish(frame)
+            else:
+                self._publish(self.stream.capture_array())
 
-            self.sensehat = IMU()
-            self.sensehat.update_data()
+            # each sensor is read in its own thread, at its own rate. The imu samples itself, to score motion
+            self.sensehat = IMU(rate=imu_rate, on_motion=self._on_motion)
+            self.indicator = StatusIndicator(self.sensehat.sense)
 
             self.gps = GPS()
-            self.gps.update()
+            self.gps_reader = SensorReader("GPS", self._read_gps)
 
             self.thread = Thread(target=self._update_picam, name=name, args=())
         else:
             self.stream = cv.VideoCapture(src)
-            self.grabbed, self.frame = self.stream.read()
+            self._start_webcam(name, buffer_pool)
 
-            self.thread = Thread(target=self._update_webcam, name=name, args=())
-            self.thread.daemon = True
+        if self.recorder is not None:
+            if self.sensehat is not None:
+                self.sensehat.sense = RecordingSenseHat(self.sensehat.sense, self.recorder)
+            if self.gps is not None:
+                self.gps.serial = RecordingSerial(self.gps.serial, self.recorder)
 
         # self.lock = Lock()
 
+    def _start_webcam(self, name, buffer_pool):
+        """Reads the first frame from a webcam (or anything with the same read), and sets up its thread
+        """
+        self.grabbed, frame = self.stream.read()
+        self._publish(frame)
+
+        if buffer_pool and self.grabbed:
+            self.pool = FramePool(frame.shape, buffer_pool, frame.dtype)
+
+        self.thread = Thread(target=self._update_webcam, name=name, args=())
+        self.thread.daemon = True
+
+    def _publish(self, frame):
+        """Publishes a frame to the frame slot, recording it first if recording
+        """
+        timestamp = time.time()
+
+        if self.recorder is not None and frame is not None:
+            self.recorder.write_frame(frame.array if isinstance(frame, PooledFrame) else frame, timestamp)
+
+        return self.frames.publish(frame, timestamp)
+
     def start(self):
         """Starts thread
         """
         self.thread.start()
 
+        for reader in (self.sensehat, self.indicator, self.gps_reader):
+            if reader is not None:
+                reader.start()
+
+    @property
+    def ended(self) -> bool:
+        """Whether the camera has stopped for good: the handler was stopped, or a replay ran out of frames
+        """
+        return self.frames.closed
+
+    @property
+    def frame(self):
+        """Current frame
+        """
+        frame = self.frames.frame
+        return frame.array if isinstance(frame, PooledFrame) else frame
+
     def read(self):
-        """Returns current frame
+        """Returns the latest reading of every sensor, without waiting for any of them
 
         Returns:
-            np.ndarray: current frame
+            dict: current frame (with its id and capture time), whether the bike is moving, latitude, and longitude,
+            with the time each was read. If using a buffer pool, frame_handle is the PooledFrame holding the frame
         """
-        return {"frame": self.frame, 
-                "is_moving": self.sensehat.is_moving(), 
-                "latitude": self.gps.latitude, 
-                "longitude": self.gps.longitude
+        return self._combine(self.frames.latest(retain=True))
+
+    def read_newer(self, frame_id: int, timeout: float = None):
+        """Same as read, but waits for a frame newer than frame_id first
+
+        Args:
+            frame_id (int): id of the last frame used
+            timeout (float, optional): seconds to wait for, forever if None
+
+        Returns:
+            dict: same as read. None if there wasn't a newer frame before timeout, or the camera has ended
+        """
+        latest = self.frames.wait_newer(frame_id, timeout, retain=True)
+
+        if latest is None:
+            return None
+
+        return self._combine(latest)
+
+    def _combine(self, latest):
+        """Combines a frame from the frame slot with the latest readings of the other sensors
+        """
+        frame_id, frame_time, frame = latest
+
+        handle = None
+        if isinstance(frame, PooledFrame):
+            handle, frame = frame, frame.array
+
+        data = {"frame": frame,
+                "frame_handle": handle,
+                "frame_id": frame_id,
+                "frame_time": frame_time,
+                "is_moving": False,
+                "imu_time": None,
+                "latitude": None,
+                "longitude": None,
+                "gps_time": None
             }
 
+        if self.sensehat is not None:
+            data["imu_time"] = self.sensehat.timestamp
+            data["is_moving"] = self.sensehat.is_moving()
+
+        if self.gps is not None:
+            # the fix the reader published, not the gps attributes, which its thread may be halfway through updating
+            data["gps_time"], sample = self.gps_reader.read()
+            if sample is not None:
+                _, (data["latitude"], data["longitude"]) = sample
+
+        return data
+
+    def show_sentry_mode(self, sentry_mode: bool):
+        """Shows whether sentry mode is on, on the sense hat. Does nothing without a sense hat
+
+        Args:
+            sentry_mode (bool): whether sentry mode is on
+        """
+        if self.indicator is not None:
+            self.indicator.set("sentry", sentry_mode)
+
+    def _on_motion(self, moving: bool):
+        # the imu is created before the indicator
+        if self.indicator is not None:
+            self.indicator.set("moving", moving)
+
+    def release(self, data: dict):
+        """Gives the frame of a reading back to the buffer pool. Does nothing if not using a buffer pool
+
+        Args:
+            data (dict): reading from read or read_newer
+        """
+        if data and data.get("frame_handle") is not None:
+            data["frame_handle"].release()
+            data["frame_handle"] = None
+
     def stop(self):
-        """Stops the while loop in the update function
+        """Stops the while loop in the update function, and wakes anything waiting for a frame
         """
         self.stopped = True
+        self.frames.close()
+
+        for reader in (self.sensehat, self.indicator, self.gps_reader):
+            if reader is not None:
+                reader.stop()
 
     def update_boxes(self, b):
         """Depracted.
@@ -101,24 +521,84 @@ class SensorHandler:
             if self.stopped is True:
                 break
 
-            self.grabbed, self.frame = self.stream.read()
+            if self.pool is None:
+                self.grabbed, frame = self.stream.read()
+
+                if self.grabbed:
+                    self._publish(frame)
+                elif getattr(self.stream, "ended", False):
+                    break  # the end of a replay
+            else:
+                pooled = self.pool.acquire(timeout=1)
+                if pooled is None:
+                    continue  # every buffer is still held by a consumer
+
+                # read decodes straight into the buffer, as long as it is the right size
+                self.grabbed, frame = self.stream.read(pooled.array)
+
+                if self.grabbed and frame is pooled.array:
+                    self._publish(pooled)
+                else:
+                    pooled.release()
+                    if self.grabbed:
+                        self._publish(frame)
+                    elif getattr(self.stream, "ended", False):
+                        break
 
             # with self.lock:
             #     self._display()
 
         # cv.destroyAllWindows()
         self.stream.release()
+        self.frames.close()
+
+        if self.recorder is not None:
+            self.recorder.close()
 
     def _update_picam(self):
-        """Same but for the picam
+        """Same but for the picam. The sense hat and gps are read by their own SensorReaders
         """
         while True:
             if self.stopped is True:
                 break
 
-            self.frame = self.stream.capture_array()
-            self.sensehat.update_data()
-            self.gps.update()
+            if self.pool is None:
+                self._publish(self.stream.capture_array())
+                continue
+
+            pooled = self.pool.acquire(timeout=1)
+            if pooled is None:
+                continue  # every buffer is still held by a consumer
+
+            try:
+                self._capture_picam(pooled.array)
+            except Exception:
+                pooled.release()
+                raise
+
+            self._publish(pooled)
+
+        self.frames.close()
+
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _capture_picam(self, buffer: np.ndarray):
+        """Copies the next frame from the camera into buffer, without allocating a new array
+        """
+        request = self.stream.capture_request()
+        try:
+            with self._mapped_array(request, "main") as mapped:
+                height, width = buffer.shape[:2]
+                # rows of the camera buffer may be padded past the width of the frame
+                np.copyto(buffer, mapped.array[:height, :width, :3])
+        finally:
+            request.release()
+
+    def _read_gps(self):
+        # blocks until the gps sends something, which is fine in its own thread
+        if self.gps.update():
+            return self.gps.get_latlong()
 
 
     def _display(self):
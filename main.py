@@ -1,20 +1,94 @@
 
 import argparse
 
+from iotbike import apiclient
 from iotbike import camsystem
 from iotbike import iotbike
+from iotbike import objectdetection
 
 
-# def init_argparse():
-#     """
-#     Parses command line arguments
-#     :return: parser
-#     :rtype: argparse.parser object
-#     """
-#     # parser = argparse.ArgumentParser(
-#     #     usage="%(prog)s [options] ",
-#     #     description=""
-#     # )
+def init_argparse():
+    """
+    Parses command line arguments
+    :return: parser
+    :rtype: argparse.parser object
+    """
+    parser = argparse.ArgumentParser(
+        usage="%(prog)s [options] ",
+        description=""
+    )
+
+    parser.add_argument(
+        "-m", "--mode", action="store", choices=["sync", "pipeline", "async"],
+        help="Run the bike loop serially, as a pipeline of capture, inference, and upload stages, or with asyncio",
+        default="sync"
+    )
+
+    parser.add_argument(
+        "--buffer-pool", action="store", type=int,
+        help="Capture into this many preallocated frame buffers instead of allocating every frame (0 to disable)",
+        default=0
+    )
+
+    parser.add_argument(
+        "--motion-threshold", action="store", type=float,
+        help="Fraction of a frame which has to change for the detector to run on it (0 to run it on every frame)",
+        default=0.005
+    )
+
+    parser.add_argument(
+        "--max-skip", action="store", type=int,
+        help="Most frames in a row the detector skips when nothing changes",
+        default=30
+    )
+
+    parser.add_argument(
+        "--input-size", action="store", type=int, choices=objectdetection.INPUT_SIZES,
+        help="Input size of the detector, smaller is faster but less accurate",
+        default=416
+    )
+
+    parser.add_argument(
+        "--target-fps", action="store", type=float,
+        help="Adapt the input size of the detector to keep up with this frame rate",
+        default=None
+    )
+
+    parser.add_argument(
+        "--roi", action="store", type=int, nargs=4, metavar=("X", "Y", "W", "H"),
+        help="Only detect in this region of the frame, e.g. around the parked bike",
+        default=None
+    )
+
+    parser.add_argument(
+        "--replay", action="store",
+        help="Play back a recording instead of using the camera and sensors",
+        default=None
+    )
+
+    parser.add_argument(
+        "--replay-speed", action="store", type=float,
+        help="Playback speed of the replay, e.g. 2 for twice real time (0 for as fast as possible)",
+        default=1.0
+    )
+
+    parser.add_argument(
+        "--record", action="store",
+        help="Record the camera and sensors to this directory, to replay later",
+        default=None
+    )
+
+    parser.add_argument(
+        "--api-url", action="store",
+        help="Url of the api to post to",
+        default=apiclient.API_URL
+    )
+
+    parser.add_argument(
+        "--bike-id", action="store",
+        help="Id of this bike in the fleet (letters, digits, and underscores)",
+        default="default"
+    )
 
 #     # parser.add_argument(
 #     #     "-p", "--pi", action="store_true",
@@ -59,7 +133,7 @@ from iotbike import iotbike
 
 #     parser.add_argument("-b", "--bike", action="store_true")
 
-#     return parser
+    return parser
 
 
 def main():
@@ -69,8 +143,8 @@ def main():
     # f = pyfiglet.figlet_format("Trac OS", font="slant")
     # print(f)
 
-    # parser = init_argparse()
-    # args = parser.parse_args()
+    parser = init_argparse()
+    args = parser.parse_args()
 
     # if args.file:
     #     camsystem.detect_images(args.file)
@@ -83,7 +157,26 @@ def main():
     # elif args.bike:
     #     iotbike.main(pi=args.pi)
 
-    iotbike.main()
+    iotbike.configure_api(args.api_url, bike_id=args.bike_id)
+
+    options = {
+        "buffer_pool": args.buffer_pool,
+        "motion_threshold": args.motion_threshold,
+        "max_skip": args.max_skip,
+        "input_size": args.input_size,
+        "target_fps": args.target_fps,
+        "roi": args.roi,
+        "replay": args.replay,
+        "replay_speed": args.replay_speed,
+        "record": args.record
+    }
+
+    if args.mode == "pipeline":
+        iotbike.main_pipelined(**options)
+    elif args.mode == "async":
+        iotbike.run_async(**options)
+    else:
+        iotbike.main(**options)
 
 
 if __name__ == "__main__":
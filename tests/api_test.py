@@ -0,0 +1,225 @@
+import io
+import os
+import sys
+import tempfile
+import time
+from threading import Thread
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+# the api is run from its own directory, so its modules import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+os.environ.setdefault("IMAGE_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("TELEMETRY_DB", ":memory:")
+
+import app as api_app  # noqa: E402
+from fleet import Fleet  # noqa: E402
+from imagestore import ImageStore  # noqa: E402
+from telemetry import TelemetryStore  # noqa: E402
+
+JPEG = cv.imencode(".jpg", np.full((48, 64, 3), 128, np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(api_app, "fleet", Fleet())
+    monkeypatch.setattr(api_app, "image_store", ImageStore(str(tmp_path)))
+    monkeypatch.setattr(api_app, "telemetry", TelemetryStore(":memory:"))
+    yield api_app.app.test_client()
+    api_app.telemetry.close()
+
+
+def _poll(client, since, timeout, bike="default"):
+    t0 = time.time()
+    response = client.get(f"/api/bikes/{bike}/sentry", query_string={"since": since, "timeout": timeout})
+    return response.get_json(), time.time() - t0
+
+
+def test_sentry_poll_times_out_with_current_mode(client):
+    # a bike may poll before it has ever posted
+    assert _poll(client, since=-1, timeout=5)[0] == {"sentry_mode": False, "version": 0}
+
+    body, elapsed = _poll(client, since=0, timeout=0.2)
+
+    assert body == {"sentry_mode": False, "version": 0}
+    assert 0.2 <= elapsed < 2
+
+
+def test_sentry_poll_wakes_on_change(client):
+    results = []
+    poll = Thread(target=lambda: results.append(_poll(api_app.app.test_client(), since=0, timeout=10)))
+    poll.start()
+
+    time.sleep(0.1)
+    client.post("/api/bike", json={"sentry_mode": True})
+    poll.join(5)
+
+    body, elapsed = results[0]
+    assert body == {"sentry_mode": True, "version": 1}
+    assert elapsed < 5
+
+
+def test_sentry_poll_ignores_other_fields_and_bikes(client):
+    client.post("/api/bike", json={"latitude": 51.5})
+    client.post("/api/bikes/other", json={"sentry_mode": True})
+
+    assert _poll(client, since=0, timeout=0.1)[0]["version"] == 0
+
+
+@pytest.mark.parametrize("value, expected", [("False", False), ("false", False), ("0", False), ("True", True),
+                                             (True, True), (False, False)])
+def test_sentry_mode_parsed_as_boolean(client, value, expected):
+    client.post("/api/bike", json={"sentry_mode": not expected})
+    client.post("/api/bike", json={"sentry_mode": value})
+
+    assert _poll(client, since=-1, timeout=0)[0]["sentry_mode"] is expected
+
+
+@pytest.mark.parametrize("upload", [
+    lambda client: client.post("/api/bikes/bike_7/image", data=JPEG, content_type="image/jpeg"),
+    lambda client: client.post("/api/image?bike=bike_7", data={"image": (io.BytesIO(JPEG), "frame.jpg")},
+                               content_type="multipart/form-data"),
+])
+def test_image_upload_is_served_back_as_jpeg(client, upload):
+    response = upload(client)
+    assert response.status_code == 200
+    image = response.get_json()["image"]
+    assert image["bike"] == "bike_7"
+
+    for url in (image["url"], "/api/bikes/bike_7/image", "/api/image?bike=bike_7"):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.mimetype == "image/jpeg"
+        assert response.data == JPEG
+
+    thumb = client.get(image["thumb_url"])
+    assert thumb.mimetype == "image/jpeg" and thumb.data.startswith(b"\xff\xd8")
+
+
+def test_image_upload_must_be_jpeg(client):
+    response = client.post("/api/image", data=b"\x89PNG", content_type="image/png")
+
+    assert response.status_code == 415
+    assert client.get("/api/image").status_code == 404
+
+
+def test_image_urls_are_cached_forever_but_latest_is_revalidated(client):
+    image = client.post("/api/image", data=JPEG, content_type="image/jpeg").get_json()["image"]
+
+    assert client.get(image["url"]).cache_control.immutable
+    latest = client.get("/api/image")
+    assert latest.cache_control.no_cache and not latest.cache_control.immutable
+
+    assert client.get(image["url"], headers={"If-None-Match": f'"{image["id"]}"'}).status_code == 304
+
+
+@pytest.mark.parametrize("url, post, change", [("/api/bike", {"latitude": 51.5}, {"latitude": 52.0}),
+                                               ("/api/alerts", {"object_flag": True}, {"object_flag": False})])
+def test_unchanged_state_is_not_sent_again(client, url, post, change):
+    client.post(url, json=post)
+
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers["ETag"]
+
+    again = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+    assert again.headers["ETag"] == first.headers["ETag"]
+
+    client.post(url, json=change)
+    changed = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != first.headers["ETag"]
+
+
+def test_etags_change_after_a_restart(client, monkeypatch):
+    client.post("/api/bike", json={"latitude": 51.5})
+    etag = client.get("/api/bike").headers["ETag"]
+
+    # versions start again from 0 after a restart, so an old etag could otherwise match different state
+    monkeypatch.setattr(api_app, "BOOT_ID", "rebooted")
+    monkeypatch.setattr(api_app, "fleet", Fleet())
+    client.post("/api/bike", json={"latitude": 52.0})
+
+    response = client.get("/api/bike", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["bike_status"]["latitude"] == 52.0
+
+
+def test_bikes_are_kept_apart(client):
+    client.post("/api/bikes/bike_1", json={"latitude": 51.5, "sentry_mode": True})
+    client.post("/api/bikes/bike_1/alerts", json={"movement_flag": True})
+    client.post("/api/bikes/bike_2", json={"latitude": 52.0})
+
+    assert client.get("/api/bikes/bike_1").get_json()["bike_status"] == {"latitude": 51.5, "sentry_mode": True}
+    assert client.get("/api/bikes/bike_2").get_json()["bike_status"] == {"latitude": 52.0}
+    assert client.get("/api/bikes/bike_2/alerts").get_json()["movement_flag"] is False
+    assert _poll(client, since=-1, timeout=0, bike="bike_2")[0]["sentry_mode"] is False
+
+    # the single bike api is the bike "default"
+    assert client.get("/api/bike").status_code == 404
+    client.post("/api/bike", json={"objects": 1})
+    assert client.get("/api/bikes/default").get_json()["bike_status"] == {"objects": 1}
+
+    history = client.get("/api/bikes/bike_1/history").get_json()["points"]
+    assert [point["latitude"] for point in history] == [51.5]
+
+
+def test_heartbeats_refresh_the_bike_but_not_the_history(client):
+    state = {"latitude": 51.5, "longitude": -0.1, "objects": 0, "sentry_mode": False}
+    client.post("/api/bikes/bike_1", json=state)
+    updated = client.get("/api/bikes/bike_1").get_json()["last_updated"]
+
+    # a heartbeat is the whole state again, unchanged
+    time.sleep(0.01)
+    client.post("/api/bikes/bike_1", json=state)
+    client.post("/api/bikes/bike_1", json={})
+    assert client.get("/api/bikes/bike_1").get_json()["last_updated"] > updated
+
+    client.post("/api/bikes/bike_1", json={**state, "objects": 2})
+
+    history = client.get("/api/bikes/bike_1/history").get_json()["points"]
+    assert [point["objects"] for point in history] == [0, 2]
+
+
+def test_unknown_and_invalid_bikes(client):
+    assert client.get("/api/bikes/nobody").status_code == 404
+    assert client.post("/api/bikes/" + "x" * 65, json={"objects": 1}).status_code == 400
+    assert client.get("/api/bikes").get_json()["bikes"] == 0
+
+
+def test_fleet_summary(client):
+    for bike in ("bike_1", "bike_2", "bike_3"):
+        client.post(f"/api/bikes/{bike}", json={"objects": 0})
+
+    client.post("/api/bikes/bike_1", json={"sentry_mode": True})
+    client.post("/api/bikes/bike_2", json={"sentry_mode": True})
+    client.post("/api/bikes/bike_2", json={"sentry_mode": "true"})  # no change
+    client.post("/api/bikes/bike_3/alerts", json={"coord_flag": True})
+    client.post("/api/bikes/bike_1/alerts", json={"object_flag": True})
+
+    assert client.get("/api/bikes").get_json() == {"bikes": 3, "sentry": 2, "alerting": ["bike_1", "bike_3"]}
+
+    client.post("/api/bikes/bike_2", json={"sentry_mode": False})
+    client.post("/api/bikes/bike_1/alerts", json={"object_flag": False})
+
+    assert client.get("/api/bikes").get_json() == {"bikes": 3, "sentry": 1, "alerting": ["bike_3"]}
+
+
+def test_alerts_only_touch_the_fleet_lock_when_alerting_flips():
+    fleet = Fleet()
+    device = fleet.get("bike_1", create=True)
+    fleet.update_alerts(device, {"movement_flag": True})
+
+    # with the fleet lock held elsewhere, alerts which don't start or stop the bike alerting don't wait for it
+    with fleet._lock:
+        done = Thread(target=fleet.update_alerts, args=(device, {"object_flag": True}))
+        done.start()
+        done.join(1)
+        assert not done.is_alive()
+
+    assert fleet.update_alerts(device, {"movement_flag": False, "object_flag": False}) == {
+        "movement_flag": False, "object_flag": False, "coord_flag": False}
+    assert fleet.summary()["alerting"] == []
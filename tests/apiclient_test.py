@@ -0,0 +1,121 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+from iotbike.apiclient import ApiClient
+
+
+class FakeApi(BaseHTTPRequestHandler):
+    """Fails the first `failures` requests with a 503, then answers with the json of `body` and an etag"""
+
+    failures = 0
+    requests = []
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.requests.append((self.command, self.path, dict(self.headers), self.rfile.read(length)))
+
+        if len(self.requests) <= self.failures:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = json.dumps({"n": len(self.requests)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    FakeApi.failures = 0
+    FakeApi.requests = []
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApi)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    with ApiClient(f"http://127.0.0.1:{server.server_port}", backoff_factor=0) as client:
+        yield client
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_is_retried(api):
+    FakeApi.failures = 2
+
+    assert api.get("/api/bike") == {"n": 3}
+    assert len(FakeApi.requests) == 3
+
+
+def test_post_is_not_retried(api):
+    # the api may have stored it before failing, so a retry could store a second copy
+    FakeApi.failures = 1
+
+    with pytest.raises(Exception):
+        api.post_image(b"jpeg", "/api/image")
+    assert len(FakeApi.requests) == 1
+
+    assert api.post({"sentry_mode": True}, "/api/bike") == {"n": 2}
+
+
+def test_get_sends_etag_and_reuses_json(api):
+    assert api.get("/api/bike") == {"n": 1}
+    assert api.get("/api/bike") == {"n": 1}
+
+    assert FakeApi.requests[1][2]["If-None-Match"] == '"v1"'
+
+    # different params are cached separately
+    assert api.get("/api/bike", params={"since": 1}) == {"n": 3}
+
+
+def test_cached_get_with_no_headers(api):
+    assert api.get("/api/bike", headers=None) == {"n": 1}
+    assert api.get("/api/bike", headers=None) == {"n": 1}
+    assert FakeApi.requests[1][2]["If-None-Match"] == '"v1"'
+
+    # the caller's headers are sent alongside
+    api.get("/api/bike", headers={"X-Test": "1"})
+    assert FakeApi.requests[2][2]["X-Test"] == "1" and FakeApi.requests[2][2]["If-None-Match"] == '"v1"'
+
+
+def test_bike_path():
+    assert ApiClient(bike_id="bike_7").bike_path("/alerts") == "/api/bikes/bike_7/alerts"
+
+
+def test_session_per_thread(api):
+    sessions = []
+    threads = [Thread(target=lambda: sessions.append(api.session)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+
+    assert api.session is api.session
+    assert len({id(session) for session in sessions + [api.session]}) == 3
+    assert {session.get_adapter("http://") for session in sessions} == {api.session.get_adapter("http://")}
+
+
+def test_post_image_keeps_callers_headers(api):
+    api.post_image(b"\xff\xd8jpeg", "/api/image", headers={"X-Bike-Id": "bike_7"})
+
+    method, path, headers, body = FakeApi.requests[0]
+    assert (method, path, body) == ("POST", "/api/image", b"\xff\xd8jpeg")
+    assert headers["Content-Type"] == "image/jpeg"
+    assert headers["X-Bike-Id"] == "bike_7"
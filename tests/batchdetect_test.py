@@ -0,0 +1,31 @@
+import csv
+import io
+
+from iotbike.batchdetect import CSV_FIELDS, _write_csv, find_images
+
+
+def test_find_images_skips_directories_and_other_files(tmp_path):
+    (tmp_path / "day1").mkdir()
+    (tmp_path / "day1" / "b.JPG").touch()
+    (tmp_path / "a.png").touch()
+    (tmp_path / "notes.txt").touch()
+    (tmp_path / "folder.jpg").mkdir()
+
+    assert find_images(tmp_path) == [str(tmp_path / "a.png"), str(tmp_path / "day1" / "b.JPG")]
+
+
+def test_write_csv_row_per_detection():
+    f = io.StringIO()
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+
+    _write_csv(writer, {"path": "a.jpg", "detections": [
+        {"class": "person", "confidence": 0.95, "box": [1, 2, 3, 4]},
+        {"class": "bicycle", "confidence": 0.9, "box": [5, 6, 7, 8]}
+    ]})
+    _write_csv(writer, {"path": "b.jpg", "detections": []})
+    _write_csv(writer, {"path": "c.jpg", "error": "Image could not be decoded"})
+
+    rows = list(csv.DictReader(io.StringIO(f.getvalue()), fieldnames=CSV_FIELDS))
+    assert [(row["path"], row["class"], row["error"]) for row in rows] == [
+        ("a.jpg", "person", ""), ("a.jpg", "bicycle", ""), ("b.jpg", "", ""), ("c.jpg", "", "Image could not be decoded")
+    ]
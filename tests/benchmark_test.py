@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from bin import benchmark
+
+
+def test_percentiles():
+    summary = benchmark.percentiles([0.001] * 99 + [0.1])
+
+    assert summary["n"] == 100
+    assert summary["p50_ms"] == pytest.approx(1)
+    assert summary["p99_ms"] > summary["p95_ms"] == pytest.approx(1)
+    assert summary["fps"] == pytest.approx(1000 / 1.99, rel=1e-3)
+
+
+def test_run_is_comparable_to_itself():
+    result = benchmark.run(["320x240"], repeat=3, warmup=1, gps=False, imu=False)
+
+    # survives a round trip through json, as written by main
+    result = json.loads(json.dumps(result))
+    stages = result["detection"]["320x240"]["stages"]
+    assert set(stages) == set(benchmark.STAGES)
+    assert all(stages[stage]["n"] == 3 for stage in ("blob", "filter", "nms", "draw_boxes", "jpeg_encode"))
+
+    assert benchmark.compare(result, result, 0.2) == []
+
+    slower = json.loads(json.dumps(result))
+    slower["detection"]["320x240"]["stages"]["nms"]["p95_ms"] *= 2
+    assert [regression.split(":")[0] for regression in benchmark.compare(slower, result, 0.2)] == ["320x240 nms"]
+
+
+def test_imu_is_reported_and_compared():
+    result = benchmark.run(["320x240"], repeat=1, warmup=0, gps=False)
+    result["imu"] = benchmark.bench_imu(samples=200)
+
+    result = json.loads(json.dumps(result))
+    assert set(result["imu"]["stages"]) == set(benchmark.IMU_STAGES)
+    assert result["imu"]["stages"]["update_data"]["n"] == 200
+    assert result["imu"]["samples_per_second"] > 0
+
+    assert benchmark.compare(result, result, 0.2) == []
+
+    slower = json.loads(json.dumps(result))
+    slower["imu"]["stages"]["motion_window"]["p95_ms"] *= 2
+    slower["imu"]["samples_per_second"] //= 2
+    assert [regression.split(":")[0] for regression in benchmark.compare(slower, result, 0.2)] == [
+        "imu motion_window", "imu samples_per_second"]
+
+
+def test_sample_image_is_reproducible():
+    assert (benchmark.sample_image(64, 48) == benchmark.sample_image(64, 48)).all()
@@ -0,0 +1,41 @@
+"""Stand ins shared by the tests. The hardware fakes live in iotbike.fakes, as the benchmark uses them too
+"""
+import time
+
+import numpy as np
+
+from iotbike.fakes import (FakeSenseHat, FakeSerial, ManualClock, acceleration_trace,  # noqa: F401
+                           nmea_fix, nmea_sentence)
+from iotbike.replay import Recorder
+
+# a fix at 51.5, -0.125
+RMC = nmea_sentence("GNRMC,120000.00,A,5130.000,N,00007.500,W,0.0,,010124,,,A")
+
+
+def make_recording(directory, frames: int = 5, start: float = 1000.0):
+    """Records a replay of a bike at rest: frames 64x48 frames 0.1 s apart, each a shade brighter (by 50) than the
+    last, the imu at 100 Hz, and a single gps fix split over two reads
+    """
+    recorder = Recorder(str(directory))
+
+    for i in range(frames):
+        frame = np.full((48, 64, 3), i * 50 % 256, dtype=np.uint8)
+        recorder.write_frame(frame, start + i * 0.1)
+    for i in range(frames * 10):
+        recorder.write_imu((0.0, 0.0, 1.0), start + i * 0.01)
+    recorder.write_nmea(RMC[:20], start + 0.05)
+    recorder.write_nmea(RMC[20:], start + 0.06)
+
+    recorder.close()
+
+
+def wait_for(condition, timeout: float = 2) -> bool:
+    """Waits until condition() is true, or timeout seconds have passed
+
+    Returns:
+        bool: condition(), once waiting is over
+    """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.005)
+    return condition()
@@ -1,67 +1,38 @@
+import pytest
 
-import matplotlib.pyplot as plt
-import time
-import sys
+from iotbike.gps import GPS
+from tests.fakes import FakeSerial, ManualClock, nmea_fix
 
-from gps import GPS
 
+def test_fake_serial_bytes_arrive_at_baud():
+    clock = ManualClock()
+    port = FakeSerial([b"x" * 100, b"y" * 100], baudrate=9600, burst_interval=1, clock=clock, sleep=clock.sleep)
 
-def main():
+    assert port.in_waiting == 0
 
-    plt.ion()
-    fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(10, 8))
+    clock.sleep(0.01)  # 9600 baud is 960 bytes a second
+    assert port.in_waiting == 9
 
-    gps = GPS()
+    assert port.read(100) == b"x" * 9
+    assert port.read(1) == b"x"  # blocks until the next byte
+    clock.sleep(0.5)
+    assert len(port.read(1000)) == 90
 
-    start_time = time.time()
+    assert port.read(1) == b"y"  # blocks until the next burst
+    assert clock.now == pytest.approx(1 + 10 / 9600)
 
-    times = []
-    lat = []
-    long = []
 
-    # Set up the plots
-    ax1.set_title("Latitude vs Time")
-    ax1.set_xlabel("Time (s)")
-    ax1.set_ylabel("Latitude")
-    lat_line, = ax1.plot([], [], '-o')
+def test_gps_parses_every_fix_from_bursts():
+    clock = ManualClock()
+    bursts = [nmea_fix(i) for i in range(20)]
+    gps = GPS(serial_port=FakeSerial(bursts, baudrate=9600, burst_interval=1, clock=clock, sleep=clock.sleep))
 
-    ax2.set_title("Longitude vs Time")
-    ax2.set_xlabel("Time (s)")
-    ax2.set_ylabel("Longitude")
-    long_line, = ax2.plot([], [], '-o')
-
-    ax3.set_title("Latitude vs Longitude")
-    ax3.set_xlabel("Longitude")
-    ax3.set_ylabel("Latitude")
-    ax3.grid(True)
-
-    while True:
-        gps.update()
-
-        current_time = time.time() - start_time
-        useful, coord = gps.get_latlong()
-
-        if useful:
-            lat.append(coord[0])
-            long.append(coord[1])
-            times.append(current_time)
-
-            lat_line.set_data(times, lat)
-            long_line.set_data(times, long)
-
-            ax1.set_xlim(0, max(times) + 1)
-            ax1.set_ylim(min(lat) - 0.01, max(lat) + 0.01)
-
-            ax2.set_xlim(0, max(times) + 1)
-            ax2.set_ylim(min(long) - 0.01, max(long) + 0.01)
-
-            ax3.scatter(long, lat, color='blue')
-        else:
-            print("Incorrect GPS data")
-
-        plt.pause(0.1)
-
-if __name__ == "__main__":
-    main()
+    fixes = []
+    while clock.now < 20:
+        if gps.update() and gps.utc_time not in fixes:
+            fixes.append(gps.utc_time)
 
+    assert len(fixes) == 20
+    assert gps.latitude == pytest.approx(51.5 + 19e-5)
+    assert gps.parser.checksum_errors == 0
 
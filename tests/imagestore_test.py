@@ -0,0 +1,139 @@
+import os
+import sys
+
+import cv2 as cv
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import imagestore  # noqa: E402
+from imagestore import ImageStore, _IdList  # noqa: E402
+
+
+def _jpeg(width=320, height=240, value=128):
+    return cv.imencode(".jpg", np.full((height, width, 3), value, np.uint8))[1].tobytes()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Moves time on by a second for every image added"""
+    now = [1_700_000_000.0]
+
+    def time():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(imagestore.time, "time", time)
+    return now
+
+
+def test_evicts_oldest_past_max_images(tmp_path, clock):
+    store = ImageStore(str(tmp_path), max_images=3)
+    records = [store.add(_jpeg(), "bike_1" if i % 2 else "bike_2") for i in range(5)]
+
+    assert [r.id for r in store.list()] == [r.id for r in reversed(records[2:])]
+    assert store.get(records[0].id) is None
+    assert not os.path.exists(store.path(records[0]))
+    assert not os.path.exists(store.path(records[0], thumb=True))
+
+    assert [r.id for r in store.list(bike="bike_1")] == [records[3].id]
+
+
+def test_evicts_oldest_past_max_bytes(tmp_path, clock):
+    first = ImageStore(str(tmp_path / "sizing")).add(_jpeg())
+    store = ImageStore(str(tmp_path / "store"), max_bytes=int(first.size * 2.5))
+
+    records = [store.add(_jpeg()) for _ in range(4)]
+
+    assert [r.id for r in store.list()] == [records[3].id, records[2].id]
+
+
+def test_evicts_older_than_max_age(tmp_path, clock):
+    store = ImageStore(str(tmp_path), max_age=2.5)
+    old = store.add(_jpeg())
+
+    store.add(_jpeg())
+    assert store.get(old.id) is not None
+
+    clock[0] += 5
+    new = store.add(_jpeg())
+    assert [r.id for r in store.list()] == [new.id]
+
+
+def test_thumbnail_made_on_add(tmp_path, clock):
+    store = ImageStore(str(tmp_path), thumb_width=80)
+    image = _jpeg(640, 480)
+    record = store.add(image)
+
+    with open(store.path(record), "rb") as f:
+        assert f.read() == image
+
+    thumb = cv.imread(store.path(record, thumb=True))
+    assert thumb.shape == (60, 80, 3)
+    assert record.size == len(image) + os.path.getsize(store.path(record, thumb=True))
+
+
+def test_rejects_bad_images_and_bikes(tmp_path):
+    store = ImageStore(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        store.add(b"\xff\xd8not a jpeg")
+    with pytest.raises(ValueError):
+        store.add(_jpeg(), "../bike")
+
+
+def test_rejects_images_larger_than_the_store(tmp_path, clock):
+    store = ImageStore(str(tmp_path), max_bytes=5000)
+    small = store.add(_jpeg(16, 16))
+
+    with pytest.raises(ValueError):
+        store.add(_jpeg(640, 480, 0) + bytes(5000))
+
+    # nothing was written, and the images already stored are kept
+    assert [r.id for r in store.list()] == [small.id]
+    assert len(os.listdir(os.path.dirname(store.path(small)))) == 1
+
+
+def test_paging(tmp_path, clock):
+    store = ImageStore(str(tmp_path))
+    records = [store.add(_jpeg(), "bike_1") for _ in range(7)]
+
+    pages = []
+    before_id = None
+    while True:
+        page = store.list(before_id=before_id, limit=3)
+        if not page:
+            break
+        pages.append([r.id for r in page])
+        before_id = page[-1].id
+
+    assert pages == [[r.id for r in reversed(records[i:j])] for i, j in ((4, 7), (1, 4), (0, 1))]
+
+    # before is a time, before_id an image, and both together take the older
+    assert store.list(before=records[3].timestamp) == list(reversed(records[:3]))
+    assert store.list(before=records[5].timestamp, before_id=records[2].id) == list(reversed(records[:2]))
+    assert store.list(bike="bike_2") == []
+    assert store.latest("bike_1") == records[-1]
+
+
+def test_index_rebuilt_on_start(tmp_path, clock):
+    store = ImageStore(str(tmp_path), max_images=3)
+    records = [store.add(_jpeg()) for _ in range(4)]
+
+    reloaded = ImageStore(str(tmp_path), max_images=2)
+
+    assert reloaded.list() == list(reversed(records[2:]))
+    assert reloaded.add(_jpeg()).id > records[-1].id
+
+
+def test_id_list_evicts_from_the_front():
+    ids = _IdList()
+    for i in range(10):
+        ids.append(f"{i:02d}")
+
+    assert [ids.popleft() for _ in range(7)] == [f"{i:02d}" for i in range(7)]
+    assert len(ids) == 3
+    assert ids.first() == "07"
+    assert ids.newest() == ["09", "08", "07"]
+    assert ids.newest(before="09", limit=5) == ["08", "07"]
@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+import pytest
+
+from iotbike.imu import IMU, MotionWindow
+from tests.fakes import FakeSenseHat, acceleration_trace
+
+
+def _fill(window, samples):
+    for sample in samples:
+        window.append(sample)
+
+
+def test_gravity_at_rest_is_not_motion():
+    rng = np.random.default_rng(0)
+    window = MotionWindow(size=50, rate=100)
+
+    # at rest, tilted, with sensor noise: z is ~1 g, which the old per axis check counted as moving
+    _fill(window, np.array([0.3, 0.0, 0.95]) + rng.normal(0, 0.005, (100, 3)))
+
+    assert window.rms < 0.02
+    assert window.jerk < 3.0
+
+
+def test_shaking_scores_high():
+    rng = np.random.default_rng(0)
+    window = MotionWindow(size=50, rate=100)
+
+    _fill(window, np.array([0.0, 0.0, 1.0]) + rng.normal(0, 0.3, (100, 3)))
+
+    assert window.rms > 0.3
+    assert window.jerk > 10
+
+
+def test_window_is_oldest_first():
+    window = MotionWindow(size=3)
+    _fill(window, [(i, 0, 0) for i in range(5)])
+
+    assert window.window()[:, 0].tolist() == [2, 3, 4]
+
+
+def _sample(imu, n):
+    for _ in range(n):
+        imu.update_data()
+
+
+def test_imu_at_rest_is_not_moving():
+    # upside down, with the sensor noise of a real sense hat
+    events = []
+    imu = IMU(sense=FakeSenseHat(acceleration_trace(2, gravity=(0, 0, -1))), on_motion=events.append)
+
+    _sample(imu, 200)
+
+    assert not imu.is_moving()
+    assert imu.get_score()["rms"] < imu.rms_threshold
+    assert events == []
+
+
+def test_imu_starts_and_stops_moving():
+    trace = np.concatenate([acceleration_trace(1), acceleration_trace(1, shake=0.3, seed=1), acceleration_trace(1)])
+    events = []
+    imu = IMU(sense=FakeSenseHat(trace), hold=0.05, on_motion=events.append)
+
+    _sample(imu, 150)
+    assert imu.is_moving()
+    assert events == [True]
+
+    # the window is clear of the shaking, so once the hold is up the bike has stopped
+    _sample(imu, 100)
+    time.sleep(0.1)
+    _sample(imu, 1)
+
+    assert not imu.is_moving()
+    assert events == [True, False]
+
+
+def test_scores_match_the_window_in_order():
+    rng = np.random.default_rng(1)
+    window = MotionWindow(size=20, rate=100)
+
+    for i, sample in enumerate(rng.normal(0, 0.3, (65, 3))):
+        window.append(sample)
+
+        ordered = window.window()
+        if len(ordered) < 2:
+            continue
+        rms = np.sqrt(np.mean(np.sum((ordered - ordered.mean(axis=0)) ** 2, axis=1)))
+        jerk = np.sqrt(np.mean(np.sum((np.diff(ordered, axis=0) * 100) ** 2, axis=1)))
+
+        assert window.rms == pytest.approx(rms)
+        assert window.jerk == pytest.approx(jerk)
@@ -0,0 +1,26 @@
+from iotbike.indicator import StatusIndicator
+from tests.fakes import FakeSenseHat, acceleration_trace, wait_for
+
+
+def test_only_transitions_are_written_at_a_capped_rate():
+    sense = FakeSenseHat(acceleration_trace(1))
+    indicator = StatusIndicator(sense, max_rate=10)
+    indicator.start()
+
+    # repeated and quickly reverted sets don't reach the hardware
+    for _ in range(100):
+        indicator.set("sentry", True)
+    wait_for(lambda: sense.shown == ["S"])
+
+    indicator.set("moving", True)
+    indicator.set("moving", False)
+    indicator.set("moving", True)
+    wait_for(lambda: sense.shown == ["S", "!"])
+
+    indicator.set("moving", False)
+    wait_for(lambda: len(sense.shown) == 3)
+
+    indicator.stop()
+    indicator.thread.join(1)
+
+    assert sense.shown == ["S", "!", "S", None]
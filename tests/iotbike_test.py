@@ -0,0 +1,256 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from iotbike import iotbike
+from iotbike.pipeline import Pipeline
+from iotbike.sensorhandler import SensorHandler
+from iotbike.iotbike import ChangeTracker, SentryMonitor
+from tests.fakes import make_recording
+
+
+def test_change_tracker_only_sends_changes():
+    tracker = ChangeTracker()
+    status = {"latitude": 51.5, "longitude": -0.1, "objects": 0}
+
+    changes = tracker.changes(status)
+    assert changes == status
+    tracker.commit(changes)
+
+    assert tracker.changes(status) is None
+    assert tracker.changes(dict(status, objects=2)) == {"objects": 2}
+
+
+def test_change_tracker_coordinate_distance():
+    tracker = ChangeTracker(distance=10)
+    tracker.commit({"latitude": 51.5, "longitude": -0.1})
+
+    # ~5 m north, then ~20 m north
+    assert tracker.changes({"latitude": 51.500045, "longitude": -0.1}) is None
+    assert tracker.changes({"latitude": 51.50018, "longitude": -0.1}) == {"latitude": 51.50018, "longitude": -0.1}
+
+    # losing the gps fix is always a change
+    assert tracker.changes({"latitude": None, "longitude": None}) == {"latitude": None, "longitude": None}
+
+
+def test_change_tracker_heartbeat_sends_whole_state():
+    tracker = ChangeTracker(distance=10, heartbeat=0)
+    tracker.commit({"latitude": 51.5, "longitude": -0.1, "objects": 0})
+
+    # so an api which has restarted gets everything back, not just what changes next
+    status = {"latitude": 51.500045, "longitude": -0.1, "objects": 0}
+    assert tracker.changes(status) == status
+    assert ChangeTracker().changes({}) is None
+
+
+def test_upload_initial_seeds_trackers(bike):
+    _, calls = bike
+    status_tracker, flags_tracker = ChangeTracker(heartbeat=30), ChangeTracker(heartbeat=30)
+    data = {"latitude": 51.5, "longitude": -0.1, "is_moving": False}
+
+    iotbike._upload_initial(data, SentryMonitor(), status_tracker, flags_tracker)
+
+    assert [suffix for suffix, _, _ in calls] == ["/api/bike", "/api/bike/alerts"]
+    # sentry mode is the api's, a reboot mustn't turn it off
+    assert "sentry_mode" not in calls[0][1]
+    assert status_tracker.changes({"latitude": 51.5, "longitude": -0.1, "objects": None}) is None
+    assert flags_tracker.changes(SentryMonitor().flags) is None
+
+
+def test_sentry_monitor_keeps_people_counter_over_skipped_frames():
+    monitor = SentryMonitor()
+    data = {"latitude": None, "longitude": None, "is_moving": False}
+
+    assert monitor.update(data, True, 1)
+    assert not monitor.update(data, True, None)  # skipped by the motion gate
+    monitor.update(data, True, 1)
+
+    assert monitor.flags["object_flag"]
+
+
+class StopLoop(Exception):
+    pass
+
+
+class FakeSensors:
+    """Hands out `frames` frames, then ends the bike loop"""
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.released = []
+        self.issued = []
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+    def _data(self, frame_id):
+        frame = np.zeros((48, 64, 3), np.uint8)
+        self.issued.append(frame)
+        return {"frame": frame, "frame_id": frame_id, "frame_time": time.time(),
+                "is_moving": False, "latitude": 51.5, "longitude": -0.1}
+
+    def read(self):
+        return self._data(0)
+
+    def read_newer(self, frame_id, timeout=None):
+        if frame_id >= self.frames:
+            raise StopLoop()
+        return self._data(frame_id + 1)
+
+    def release(self, data):
+        self.released.append(data["frame_id"])
+
+    def show_sentry_mode(self, on):
+        pass
+
+
+class FakeDetection:
+    def __init__(self, frame):
+        self.frame = frame
+
+    def get_objects(self):
+        return 1
+
+    def draw_boxes(self, copy=False):
+        frame = self.frame.copy() if copy else self.frame
+        frame[:] = 255
+        return frame
+
+
+class FakeWatcher:
+    sentry_mode = True
+
+    def __init__(self, on_change=None):
+        self.stopped = False
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def bike(monkeypatch):
+    """Runs the bike loops against fakes, recording the api calls and the thread each was made from"""
+    sensors = FakeSensors(frames=5)
+    calls = []
+
+    monkeypatch.setattr(iotbike.sensorhandler, "SensorHandler", lambda **kwargs: sensors)
+    monkeypatch.setattr(iotbike.objectdetection, "ObjectDetection",
+                        lambda **kwargs: SimpleNamespace(detect_filtered=lambda frame, *args: FakeDetection(frame)))
+    monkeypatch.setattr(iotbike, "SentryWatcher", FakeWatcher)
+    monkeypatch.setattr(iotbike, "api_post",
+                        lambda data, suffix: calls.append((suffix, data, threading.current_thread())))
+    monkeypatch.setattr(iotbike, "_upload_frame",
+                        lambda frame: calls.append(("image", frame, threading.current_thread())))
+    monkeypatch.setattr(iotbike, "bike_path", lambda resource="": "/api/bike" + resource)
+
+    return sensors, calls
+
+
+def test_main_async_uploads_off_the_event_loop(bike):
+    sensors, calls = bike
+
+    with pytest.raises(StopLoop):
+        iotbike.run_async(pi=False, motion_threshold=0)
+
+    # every frame had a person in sentry mode, so every frame was uploaded, along with the first status. The last
+    # frame's uploads may still be in flight when the loop stops, and are cancelled
+    assert sum(1 for suffix, _, _ in calls if suffix == "image") in (4, 5)
+    assert any(suffix == "/api/bike" and data.get("objects") == 1 for suffix, data, _ in calls)
+    assert all(thread is not threading.main_thread() for _, _, thread in calls)
+
+    assert sensors.released == [0, 1, 2, 3, 4, 5]
+    assert sensors.stopped
+
+    # boxes were drawn on copies, not the frames shared with anything else reading the sensors
+    assert not any(frame.any() for frame in sensors.issued)
+
+
+def test_main_uploads_and_releases_every_frame(bike):
+    sensors, calls = bike
+
+    with pytest.raises(StopLoop):
+        iotbike.main(pi=False, motion_threshold=0)
+
+    assert sum(1 for suffix, _, _ in calls if suffix == "image") == 5
+    assert sensors.released == [0, 1, 2, 3, 4, 5]
+    assert sensors.stopped
+    assert not any(frame.any() for frame in sensors.issued)
+
+
+def test_main_async_uploads_one_frame_at_a_time(bike, monkeypatch):
+    sensors, calls = bike
+    in_flight = {"now": 0, "most": 0}
+    lock = threading.Lock()
+
+    def slow_upload(frame):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["most"] = max(in_flight["most"], in_flight["now"])
+        time.sleep(0.02)
+        with lock:
+            in_flight["now"] -= 1
+
+    monkeypatch.setattr(iotbike, "_upload_frame", slow_upload)
+
+    with pytest.raises(StopLoop):
+        iotbike.run_async(pi=False, motion_threshold=0)
+
+    assert in_flight["most"] == 1
+
+
+def test_main_pipelined_releases_dropped_frames_and_stops_with_a_replay(bike, monkeypatch, tmp_path):
+    _, calls = bike
+    make_recording(tmp_path, frames=30)
+    handlers, pipelines, logs = [], [], []
+
+    def detect_filtered(frame, *args):
+        # slower than the replay, so frames queued for inference are dropped
+        time.sleep(0.03)
+        return FakeDetection(frame)
+
+    def sensor_handler(**kwargs):
+        handlers.append(SensorHandler(**kwargs))
+        return handlers[-1]
+
+    def make_pipeline():
+        pipelines.append(Pipeline())
+        return pipelines[-1]
+
+    monkeypatch.setattr(iotbike.sensorhandler, "SensorHandler", sensor_handler)
+    monkeypatch.setattr(iotbike.pipeline, "Pipeline", make_pipeline)
+    monkeypatch.setattr(iotbike.objectdetection, "ObjectDetection",
+                        lambda **kwargs: SimpleNamespace(detect_filtered=detect_filtered, input_size=416))
+    monkeypatch.setattr(iotbike, "log", logs.append)
+
+    # with only 3 buffers, a dropped frame which wasn't released would leave the camera waiting for one forever
+    thread = threading.Thread(target=iotbike.main_pipelined,
+                              kwargs={"pi": False, "replay": str(tmp_path), "replay_speed": 10, "buffer_pool": 3,
+                                      "capture_rate": None, "queue_size": 1, "stats_interval": 0.1,
+                                      "motion_threshold": 0}, daemon=True)
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+
+    # every frame was captured, and every buffer is back in the pool but the one holding the last frame
+    sensors = handlers[0]
+    assert sensors.ended and sensors.frames.frame_id == 30
+    assert sensors.pool.free() == 2
+
+    assert pipelines[0].stats()["inference"]["dropped"] > 0
+    # and capture waited, rather than spinning, once the replay had ended
+    assert pipelines[0].stats()["capture"]["processed"] < 100
+    assert sum(1 for suffix, _, _ in calls if suffix == "image") > 0
+
+    stats = [message for message in logs if message.startswith("Pipeline stats")]
+    assert stats and all(f"'{stage}'" in stats[-1] for stage in ("capture", "inference", "upload"))
+    assert "Camera has ended, e.g. the replay finished, stopping" in logs
@@ -0,0 +1,30 @@
+import numpy as np
+
+from iotbike.motion import MotionGate
+
+
+def _frame(value=0):
+    return np.full((480, 640, 3), value, dtype=np.uint8)
+
+
+def test_static_scene_is_skipped():
+    gate = MotionGate(max_skip=100)
+
+    assert gate.check(_frame())  # first frame sets the background
+    assert not any(gate.check(_frame()) for _ in range(10))
+    assert gate.stats()["skipped"] == 10
+
+
+def test_change_movement_and_max_skip_pass():
+    gate = MotionGate(max_skip=3)
+    gate.check(_frame())
+
+    changed = _frame()
+    changed[100:300, 200:400] = 255
+    assert gate.check(changed)
+
+    assert gate.check(_frame(), is_moving=True)
+
+    gate = MotionGate(max_skip=3)
+    results = [gate.check(_frame()) for _ in range(6)]
+    assert results == [True, False, False, False, True, False]
@@ -0,0 +1,87 @@
+import pytest
+
+from iotbike.gps import GPS, NMEAParser
+from tests.fakes import FakeSerial, ManualClock, nmea_sentence as sentence
+
+
+RMC = sentence("GNRMC,123519.00,A,5130.0000,N,00007.5000,W,10.0,84.4,230394,,,A")
+RMC_LATER = sentence("GNRMC,123520.00,A,5130.0600,N,00007.5000,W,10.0,84.4,230394,,,A")
+RMC_VOID = sentence("GNRMC,123521.00,V,,,,,,,230394,,,N")
+GGA = sentence("GNGGA,123519.00,5130.0000,N,00007.5000,W,1,08,0.9,545.4,M,46.9,M,,")
+VTG = sentence("GNVTG,84.4,T,,M,10.0,N,18.5,K,A")
+
+
+def _port(chunks):
+    """One chunk arrives a second, and each read blocks until the next"""
+    clock = ManualClock()
+    return FakeSerial(chunks, burst_interval=1, clock=clock, sleep=clock.sleep)
+
+
+def _update(gps):
+    """Updates until a sentence is parsed, as the first read after blocking only gets a byte"""
+    for _ in range(10):
+        if gps.update():
+            return True
+    return False
+
+
+def test_parser_checksum():
+    parser = NMEAParser()
+
+    assert parser.feed(RMC) == [RMC.decode()[1:-5].split(",")]
+    assert parser.feed(RMC.replace(b"5130", b"5131")) == []
+    assert parser.checksum_errors == 1
+
+
+def test_parser_carries_partial_sentences():
+    parser = NMEAParser()
+    data = RMC + GGA
+
+    sentences = []
+    for i in range(0, len(data), 7):
+        sentences += parser.feed(data[i:i + 7])
+
+    assert [fields[0] for fields in sentences] == ["GNRMC", "GNGGA"]
+
+
+def test_parser_drops_overlong_partial():
+    parser = NMEAParser()
+
+    parser.feed(b"x" * 500 + RMC[:20])
+
+    assert parser.feed(RMC[20:])[0][0] == "GNRMC"
+
+
+def test_parser_skips_garbage():
+    parser = NMEAParser()
+
+    sentences = parser.feed(b"\xff\xfe\x00garbage" + RMC + b"$GNRMC,trunc\xc3" + GGA + b"\xe2\x82")
+
+    assert [fields[0] for fields in sentences] == ["GNRMC", "GNGGA"]
+
+
+def test_gps_keeps_latest_fix_and_extra_fields():
+    gps = GPS(serial_port=_port([RMC + GGA + VTG[:10], VTG[10:] + RMC_LATER]))
+
+    assert gps.update()
+    assert gps.useful
+    assert gps.latitude == pytest.approx(51.5)
+    assert gps.longitude == pytest.approx(-0.125)
+    assert gps.altitude == 545.4
+    assert gps.satellites == 8
+    assert gps.hdop == 0.9
+
+    assert _update(gps)
+    assert gps.speed == pytest.approx(10.0 * 1.852)  # RMC (in knots) came after VTG
+    assert gps.utc_time == "123520.00"
+    assert gps.latitude == pytest.approx(51.501)
+
+
+def test_gps_void_fix():
+    gps = GPS(serial_port=_port([RMC, RMC_VOID]))
+
+    assert _update(gps)
+    assert _update(gps)
+
+    assert not gps.useful
+    assert gps.get_latlong()[1] == (pytest.approx(51.5), pytest.approx(-0.125))
@@ -0,0 +1,142 @@
+import numpy as np
+import pytest
+
+from iotbike.objectdetection import (AdaptiveInputSize, DetectionOutput, _clip_roi, _split_batch, filter_boxes,
+                                     suppress)
+
+
+def _output(framework):
+    return DetectionOutput.from_boxes(None, None, None, None, framework, classes=("person",))
+
+
+def _yolo_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.random((n, 85), dtype=np.float32)
+    rows[:, 5:] **= 8  # most rows below threshold, like a real yolo output
+    return rows
+
+
+def _tf_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.random((1, 1, n, 7), dtype=np.float32)
+    rows[..., 1] = rng.integers(0, 90, n)
+    rows[..., 5:7] += rows[..., 3:5]
+    return rows
+
+
+@pytest.mark.parametrize("shape", [(480, 640), (1080, 1920), (416, 416)])
+@pytest.mark.parametrize("threshold", [0.2, 0.5, 0.9])
+def test_filter_boxes_dn_matches_reference(shape, threshold):
+    output = _output("dn")
+    raw = np.vstack([_yolo_rows(2535, seed=1), _yolo_rows(10140, seed=2)])
+
+    boxes, confs, class_ids = output._filter_boxes(raw, shape, threshold)
+    ref_boxes, ref_confs, ref_class_ids = output._filter_boxes_reference(raw, shape, threshold)
+
+    assert len(boxes) > 0
+    assert boxes == ref_boxes
+    assert confs == ref_confs
+    assert class_ids == [int(c) for c in ref_class_ids]
+
+
+@pytest.mark.parametrize("shape", [(480, 640), (1080, 1920)])
+@pytest.mark.parametrize("threshold", [0.2, 0.5, 0.9])
+def test_filter_boxes_tf_matches_reference(shape, threshold):
+    output = _output("tf")
+    raw = _tf_rows(100)
+
+    assert output._filter_boxes(raw, shape, threshold) == output._filter_boxes_reference(raw, shape, threshold)
+
+
+def test_filter_boxes_empty():
+    output = _output("dn")
+    raw = np.zeros((10, 85), dtype=np.float32)
+
+    assert output._filter_boxes(raw, (480, 640), 0.5) == ([], [], [])
+
+
+def test_get_people_uses_shared_class_table():
+    classes = ("person",) + tuple(f"class{i}" for i in range(1, 80))
+    raw = [_yolo_rows(2535, seed=3)]
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    output = DetectionOutput(raw, image.shape[:2], 0.5, 0.0, "dn", image, classes)
+
+    assert output.get_people() == sum(1 for i in output.classIDs if classes[i] == "person")
+    assert output.get_class_count("not a class") == 0
+    assert output.get_name(0) == "person"
+
+
+def test_roi_offset_maps_boxes_to_full_frame():
+    classes = tuple(f"class{i}" for i in range(80))
+    raw = [_yolo_rows(2535, seed=4)]
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    full = DetectionOutput(raw, (200, 300), 0.5, 0.0, "dn", image, classes)
+    cropped = DetectionOutput(raw, (200, 300), 0.5, 0.0, "dn", image, classes, offset=(100, 50))
+
+    assert full.boxes is not None
+    assert [(x + 100, y + 50, w, h) for x, y, w, h in full.boxes] == list(cropped.boxes)
+
+
+def test_draw_boxes_on_a_copy_leaves_the_frame_untouched():
+    classes = tuple(f"class{i}" for i in range(80))
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+    output = DetectionOutput([_yolo_rows(2535, seed=4)], image.shape[:2], 0.5, 0.0, "dn", image, classes)
+
+    drawn = output.draw_boxes(copy=True)
+
+    assert drawn is not image and drawn.any()
+    assert not image.any()
+
+
+def test_from_boxes_matches_the_constructor():
+    classes = tuple(f"class{i}" for i in range(80))
+    raw = [_yolo_rows(2535, seed=5)]
+    image = np.zeros((480, 640, 3), dtype=np.uint8)
+
+    output = DetectionOutput(raw, image.shape[:2], 0.5, 0.0, "dn", image, classes)
+    boxes = suppress(*filter_boxes(np.vstack(raw), image.shape[:2], 0.5, "dn"), 0.5)
+    staged = DetectionOutput.from_boxes(*boxes, image, "dn", classes)
+
+    assert staged.get_objects() == output.get_objects() > 0
+    assert staged.boxes == output.boxes and staged.classIDs == output.classIDs
+    assert (staged.draw_boxes(copy=True) == output.draw_boxes(copy=True)).all()
+
+
+def test_clip_roi():
+    assert _clip_roi((100, 50, 300, 200), (480, 640)) == (100, 50, 300, 200)
+    assert _clip_roi((-10, 400, 1000, 1000), (480, 640)) == (0, 400, 640, 80)
+
+
+def test_adaptive_input_size():
+    adaptive = AdaptiveInputSize(target_fps=10, size=416, settle=3)
+
+    # over budget: steps down to 320 and stays there
+    sizes = [adaptive.update(0.2) for _ in range(10)]
+    assert sizes[2] == 320 and sizes[-1] == 320
+
+    # well within budget: steps back up, one size at a time
+    sizes = [adaptive.update(0.01) for _ in range(20)]
+    assert 416 in sizes and sizes[-1] == 608
+
+
+def test_split_batch_dn():
+    rows = [_yolo_rows(300, seed=i) for i in range(3)]
+    stacked_3d = [np.stack(rows)]
+    stacked_2d = [np.vstack(rows)]
+
+    for outputs in (stacked_3d, stacked_2d):
+        split = _split_batch(outputs, 3, "dn")
+        assert len(split) == 3
+        assert all(np.array_equal(split[i][0], rows[i]) for i in range(3))
+
+
+def test_split_batch_tf():
+    raw = _tf_rows(10)
+    raw[0, 0, :, 0] = [0, 1, 1, 0, 2, 2, 2, 0, 1, 0]
+
+    split = _split_batch([raw], 3, "tf")
+
+    assert [s[0].shape for s in split] == [(1, 1, 4, 7), (1, 1, 3, 7), (1, 1, 3, 7)]
+    assert (split[2][0][0, 0, :, 0] == 2).all()
@@ -0,0 +1,42 @@
+import time
+
+from iotbike.pipeline import DropOldestQueue, Pipeline
+
+
+def test_drop_oldest_queue_keeps_newest():
+    q = DropOldestQueue(2)
+
+    for i in range(5):
+        q.put(i)
+
+    assert q.dropped == 3
+    assert [q.get_nowait(), q.get_nowait()] == [3, 4]
+
+
+def test_drop_oldest_queue_on_drop():
+    dropped = []
+    q = DropOldestQueue(1, on_drop=dropped.append)
+
+    for i in range(3):
+        q.put(i)
+
+    assert dropped == [0, 1]
+
+
+def test_pipeline_slow_stage_drops_instead_of_blocking():
+    counter = iter(range(10 ** 9))
+    results = []
+
+    stages = Pipeline()
+    stages.add_stage("source", lambda: next(counter), rate=500)
+    stages.add_stage("slow", lambda i: time.sleep(0.02) or i, queue_size=1)
+    stages.add_stage("sink", results.append, queue_size=4)
+
+    stages.start()
+    time.sleep(0.3)
+    stats = stages.stats()
+    stages.stop()
+
+    assert stats["source"]["processed"] > stats["slow"]["processed"] > 0
+    assert stats["slow"]["dropped"] > 0
+    assert results == sorted(results)
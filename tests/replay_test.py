@@ -0,0 +1,93 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from iotbike import iotbike
+from iotbike.gps import GPS
+from iotbike.replay import Replay
+from iotbike.sensorhandler import SensorHandler
+from tests.fakes import make_recording
+
+
+def test_replay_as_fast_as_possible(tmp_path):
+    make_recording(tmp_path)
+    replay = Replay(str(tmp_path), speed=0)
+
+    assert replay.clock.start == 1000.0
+    assert replay.has_gps and replay.has_imu
+
+    camera = replay.camera()
+    frames = [camera.read() for _ in range(5)]
+    assert all(grabbed for grabbed, _ in frames)
+    assert [round(frame.mean() / 50) for _, frame in frames] == [0, 1, 2, 3, 4]
+
+    gps = GPS(serial_port=replay.serial())
+    while not gps.update():
+        pass
+    assert round(gps.latitude, 3) == 51.5 and round(gps.longitude, 4) == -0.125
+
+    assert replay.sense_hat().get_accelerometer_raw() == {"x": 0.0, "y": 0.0, "z": 1.0}
+
+
+def test_replay_in_real_time_waits_for_each_frame(tmp_path):
+    make_recording(tmp_path)
+    camera = Replay(str(tmp_path), speed=2).camera()
+
+    t0 = time.time()
+    for _ in range(5):
+        assert camera.read()[0]
+
+    # 0.4s of frames at twice real time
+    assert 0.15 < time.time() - t0 < 1
+
+
+def test_sensor_handler_replays_recording(tmp_path):
+    make_recording(tmp_path)
+
+    sensors = SensorHandler(replay=str(tmp_path), replay_speed=1)
+    sensors.start()
+    try:
+        data = sensors.read_newer(0, timeout=2)
+        assert data["frame"].shape == (48, 64, 3)
+        assert data["imu_time"] is not None and not data["is_moving"]
+    finally:
+        sensors.stop()
+
+
+def test_sensor_handler_ends_with_the_recording(tmp_path):
+    make_recording(tmp_path)
+
+    sensors = SensorHandler(replay=str(tmp_path), replay_speed=0)
+    sensors.start()
+    try:
+        frame_id = 0
+        while (data := sensors.read_newer(frame_id, timeout=2)) is not None:
+            frame_id = data["frame_id"]
+
+        assert sensors.ended
+        assert frame_id == 5
+    finally:
+        sensors.stop()
+
+
+def test_main_stops_at_the_end_of_a_replay(tmp_path, monkeypatch):
+    make_recording(tmp_path)
+    uploads = []
+
+    detection = SimpleNamespace(get_objects=lambda: 0, draw_boxes=lambda copy=False: None)
+    monkeypatch.setattr(iotbike.objectdetection, "ObjectDetection",
+                        lambda **kwargs: SimpleNamespace(detect_filtered=lambda *args: detection))
+    monkeypatch.setattr(iotbike, "SentryWatcher",
+                        lambda on_change=None: SimpleNamespace(sentry_mode=False, start=lambda: None,
+                                                               stop=lambda: None))
+    monkeypatch.setattr(iotbike, "api_post", lambda data, suffix: uploads.append(data))
+    monkeypatch.setattr(iotbike, "bike_path", lambda resource="": "/api/bike" + resource)
+
+    for main in (iotbike.main, iotbike.run_async):
+        thread = threading.Thread(target=main, kwargs={"pi": False, "replay": str(tmp_path), "replay_speed": 0,
+                                                       "motion_threshold": 0}, daemon=True)
+        thread.start()
+        thread.join(10)
+
+        assert not thread.is_alive()
+    assert uploads
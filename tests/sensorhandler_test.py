@@ -0,0 +1,138 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from iotbike.sensorhandler import FramePool, FrameSlot, SensorHandler, SensorReader
+from tests.fakes import wait_for
+
+
+def test_frame_slot_ids_and_timestamps():
+    slot = FrameSlot()
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+
+    assert slot.latest() == (0, None, None)
+    assert slot.publish(frame, timestamp=12.5) == 1
+    assert slot.publish(frame) == 2
+
+    frame_id, timestamp, latest = slot.latest()
+    assert frame_id == 2 and timestamp > 12.5 and latest is frame
+
+
+def test_frame_slot_wait_newer():
+    slot = FrameSlot()
+    slot.publish(np.zeros(1))
+
+    assert slot.wait_newer(1, timeout=0.01) is None
+    assert slot.wait_newer(0, timeout=0.01)[0] == 1
+
+    threading.Timer(0.05, slot.publish, args=(np.ones(1),)).start()
+    frame_id, timestamp, frame = slot.wait_newer(1, timeout=2)
+
+    assert frame_id == 2 and frame[0] == 1
+
+
+def test_frame_slot_close_wakes_waiters():
+    slot = FrameSlot()
+    slot.publish(np.zeros(1))
+
+    threading.Timer(0.05, slot.close).start()
+    t0 = time.time()
+
+    assert slot.wait_newer(1, timeout=5) is None
+    assert time.time() - t0 < 2
+    assert slot.closed
+
+    # the last frame is still there, and nothing waits for another
+    assert slot.latest()[0] == 1
+    assert slot.wait_newer(0)[0] == 1
+    assert slot.wait_newer(1) is None
+
+
+def test_frame_pool_reuses_released_buffers():
+    pool = FramePool((4, 4, 3), size=2)
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert pool.acquire(timeout=0.01) is None and pool.starved == 1
+
+    first.release()
+    assert pool.acquire().array is first.array
+
+    with pytest.raises(Exception):
+        second.release()
+        second.release()
+
+
+def test_frame_slot_releases_replaced_pooled_frames():
+    pool = FramePool((4, 4, 3), size=3)
+    slot = FrameSlot()
+
+    slot.publish(pool.acquire())
+    _, _, held = slot.latest(retain=True)
+
+    slot.publish(pool.acquire())
+    assert pool.free() == 1  # the held frame isn't back in the pool until it is released
+
+    held.release()
+    assert pool.free() == 2
+
+
+def test_sensor_reader_publishes_samples_with_their_time():
+    samples = iter([1, None, 2])
+
+    def read():
+        sample = next(samples, None)
+        if sample is None:
+            time.sleep(0.01)
+        return sample
+
+    reader = SensorReader("Test", read)
+    assert reader.read() == (None, None)
+
+    t0 = time.time()
+    reader.start()
+    # None isn't published, so the last sample stays
+    assert wait_for(lambda: reader.read()[1] == 2)
+    reader.stop()
+
+    timestamp, sample = reader.read()
+    assert t0 <= timestamp <= time.time()
+
+
+def test_sensor_reader_rate_and_errors():
+    calls = []
+
+    def read():
+        calls.append(time.time())
+        if len(calls) == 1:
+            raise OSError("sensor unplugged")
+        return len(calls)
+
+    reader = SensorReader("Test", read, rate=50)
+    reader.start()
+
+    # carries on after an error
+    assert wait_for(lambda: reader.read()[1] is not None and reader.read()[1] >= 5)
+    reader.stop()
+
+    gaps = np.diff(calls[1:])
+    assert gaps.min() > 0.015
+
+
+def test_combine_uses_the_gps_fix_the_reader_published():
+    handler = SensorHandler.__new__(SensorHandler)
+    handler.sensehat = None
+    # the gps thread is halfway through the next fix: the reader's sample is the last complete one
+    handler.gps = SimpleNamespace(latitude=52.0, longitude=-0.1)
+    handler.gps_reader = SimpleNamespace(read=lambda: (100.0, (True, (51.5, -0.125))))
+
+    data = handler._combine((3, 99.0, np.zeros((4, 4, 3), np.uint8)))
+
+    assert (data["latitude"], data["longitude"], data["gps_time"]) == (51.5, -0.125, 100.0)
+    assert (data["frame_id"], data["frame_time"], data["frame_handle"]) == (3, 99.0, None)
+
+    handler.gps_reader = SimpleNamespace(read=lambda: (None, None))
+    assert handler._combine((3, 99.0, None))["latitude"] is None
@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api"))
+
+import telemetry  # noqa: E402
+from telemetry import TelemetryStore  # noqa: E402
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def store():
+    store = TelemetryStore(":memory:")
+    yield store
+    store.close()
+
+
+def _fill(store, bike="bike_1", points=10, start=NOW, interval=1.0):
+    for i in range(points):
+        store.append(bike, {"latitude": 51.5 + i, "longitude": -0.1, "objects": i, "sentry_mode": i % 2 == 0},
+                     timestamp=start + i * interval)
+
+
+def test_range(store):
+    _fill(store)
+    _fill(store, bike="bike_2", points=3)
+
+    points = store.range("bike_1")
+    assert [p["objects"] for p in points] == list(range(10))
+    assert points[0] == {"timestamp": NOW, "latitude": 51.5, "longitude": -0.1, "objects": 0, "sentry_mode": True}
+
+    assert [p["objects"] for p in store.range("bike_1", start=NOW + 3, end=NOW + 5)] == [3, 4, 5]
+    assert [p["objects"] for p in store.range("bike_1", start=NOW + 8)] == [8, 9]
+    assert [p["objects"] for p in store.range("bike_1", end=NOW + 1)] == [0, 1]
+    assert [p["objects"] for p in store.range("bike_1", limit=2)] == [0, 1]
+    assert len(store.range("bike_2")) == 3
+    assert store.range("bike_3") == []
+
+
+def test_partial_status_leaves_other_fields_empty(store):
+    store.append("bike_1", {"objects": 2}, timestamp=NOW)
+
+    assert store.range("bike_1") == [{"timestamp": NOW, "latitude": None, "longitude": None, "objects": 2,
+                                      "sentry_mode": None}]
+
+
+def test_downsample_keeps_last_point_of_each_step(store):
+    _fill(store, points=10, interval=1.0)
+
+    points = store.range("bike_1", step=4)
+
+    # steps are aligned to multiples of step seconds since the epoch
+    assert [p["objects"] for p in points] == [3, 7, 9]
+    assert [p["objects"] for p in store.range("bike_1", start=NOW + 1, end=NOW + 6, step=4)] == [3, 6]
+
+
+def test_compaction(store, monkeypatch):
+    store.retention, store.compact_after, store.compact_step = 100, 20, 5
+    monkeypatch.setattr(telemetry.time, "time", lambda: NOW + 130)
+
+    _fill(store, points=130, interval=1.0)
+    store.compact()
+
+    points = [p["timestamp"] - NOW for p in store.range("bike_1")]
+
+    # past retention deleted, then one point every 5 s until 20 s ago, then every point
+    assert points[0] >= 30
+    assert [t for t in points if t < 110] == list(range(34, 110, 5))
+    assert [t for t in points if t >= 110] == list(range(110, 130))
+
+
+def test_compacts_every_n_appends(store, monkeypatch):
+    store.retention, store.compact_every = 100, 5
+    monkeypatch.setattr(telemetry.time, "time", lambda: NOW + 1000)
+
+    _fill(store, points=4)
+    assert len(store.range("bike_1")) == 4
+
+    _fill(store, points=1, start=NOW + 950)
+    assert [p["timestamp"] for p in store.range("bike_1")] == [NOW + 950]
+
+
+def test_append_does_not_wait_for_the_database(store):
+    # as if a slow batch were being written
+    with store._lock:
+        _fill(store, points=100)
+
+    assert len(store.range("bike_1")) == 100
+
+
+def test_close_writes_out_the_queue(tmp_path):
+    path = str(tmp_path / "telemetry.db")
+    store = TelemetryStore(path)
+    with store._lock:
+        _fill(store, points=3)
+    store.close()
+
+    reopened = TelemetryStore(path)
+    assert len(reopened.range("bike_1")) == 3
+    reopened.close()